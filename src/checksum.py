@@ -11,17 +11,41 @@
 #    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
-
-from typing import List, Optional, Tuple
+import hashlib
+import mmap
+from typing import List, Optional, Union
 
 from src.adler32 import Adler32
 
 
+def add_to_delta(delta: List[Union[List[int], bytes]], op: Union[List[int], bytes]):
+    """
+    Append an instruction to a delta, merging it with the previous one when possible.
+    :param delta:  The delta to append to.
+    :param op:  An [offset, length] range to copy from the basis, or literal bytes.
+    :return: None
+    """
+    if delta and isinstance(op, bytes) and isinstance(delta[-1], bytes):
+        delta[-1] += op
+    elif (
+        delta
+        and isinstance(op, list)
+        and isinstance(delta[-1], list)
+        and sum(delta[-1]) == op[0]
+    ):
+        # The basis ranges are contiguous
+        delta[-1] = [delta[-1][0], delta[-1][1] + op[1]]
+    elif op:
+        delta.append(op)
+
+
 class Checksum:
     parts: int
     checksums: List[int]
+    strongChecksums: List[bytes]
     partLength: int
     totalLength: int
+    offset: int
 
     def __init__(
         self,
@@ -31,6 +55,9 @@ class Checksum:
         total_length: Optional[int] = None,
         checksums: Optional[List[int]] = None,
         part_length: Optional[int] = None,
+        strong_checksums: Optional[List[bytes]] = None,
+        offset: int = 0,
+        length: Optional[int] = None,
     ):
         """
         Create a divide checksum of a file.
@@ -38,13 +65,24 @@ class Checksum:
         :param divide:  The number of parts to divide the file into.
         :param max_size:  The maximum size of the file.
         To be able to find the difference between two files, the maximum size of the file must be the same.
+        :param strong_checksums:  The strong checksums of each part, used to confirm a rolling checksum match.
+        :param offset:  The offset of the region of the file to checksum.
+        :param length:  The length of the region of the file to checksum, until the end of the file by default.
         """
 
+        self.offset = offset
+
         if checksums is not None:
             self.checksums = checksums
+            self.strongChecksums = strong_checksums or []
             self.parts = len(checksums)
-            self.partLength = part_length
             self.totalLength = total_length
+            # The part length is derived from the total length the same way calculate does
+            self.partLength = (
+                part_length
+                if part_length is not None
+                else total_length // max(self.parts, 1) + 1
+            )
             return
 
         if path == "":
@@ -52,6 +90,7 @@ class Checksum:
 
         self.parts = divide
         self.path = path
+        self.length = length
         self.checksums = self.calculate(max_size)
 
     def calculate(self, max_size: Optional[int] = None) -> List[int]:
@@ -59,121 +98,111 @@ class Checksum:
         Calculate the checksums.
         """
         checksums = []
+        self.strongChecksums = []
         with open(self.path, "rb") as f:
             f.seek(0, 2)
-            size = f.tell()
+            size = max(0, f.tell() - self.offset)
+            if self.length is not None and size > self.length:
+                size = self.length
             self.totalLength = size
             if max_size is not None and size > max_size:
                 size = max_size
 
             self.partLength = size // self.parts + 1
-            f.seek(0)
+            f.seek(self.offset)
             for i in range(self.parts):
-                checksums.append(Adler32(f.read(self.partLength)).checksum)
+                data = f.read(
+                    min(self.partLength, max(0, self.totalLength - i * self.partLength))
+                )
+                checksums.append(Adler32(data).checksum)
+                self.strongChecksums.append(hashlib.md5(data).digest())
 
         return checksums
 
-    def compare_with_file(self, path: str):
+    def part_size(self, index: int) -> int:
         """
-        Compare this checksum with a file.
-        :param path:  The path to the file.
-        :return:  The parts that are different.
+        Get the real length of a part, the last parts can be shorter than the part length.
+        :param index:  The index of the part.
+        :return:  The length of the part.
         """
-        return self.get_difference_bytes(Checksum(path, self.parts, self.totalLength))
+        return max(0, min(self.partLength, self.totalLength - index * self.partLength))
 
-    def get_difference_bytes(self, other: "Checksum") -> List[Tuple[int, int, int]]:
+    def get_delta(
+        self, path: str, start: int = 0, end: Optional[int] = None
+    ) -> List[Union[List[int], bytes]]:
         """
-        Get the bytes that are different between this file and another file.
-        :param other: Another Checksum object representing the other file to compare to.
-        :return:
+        Get the instructions to rebuild a file from the file this checksum was calculated on (the basis).
+        The file is scanned with a rolling checksum, every window matching a part of the basis
+        becomes a copy instruction, everything else is sent as literal data.
+        :param path:  The path to the new version of the file.
+        :param start:  The offset of the region of the new file to scan.
+        :param end:  The end of the region of the new file to scan, the end of the file by default.
+        :return:  A list of [offset, length] ranges to copy from the basis, or literal bytes, in file order.
         """
-        if self.parts != other.parts:
-            raise ValueError("The checksums have different parts.")
-        parts = []
-
-        if self.totalLength < other.totalLength:
-            other.calculate(self.totalLength)
-
-        # Compare the checksums
-        with open(other.path, "rb") as f1:
-            window = 0
-
-            for i in range(other.parts):
-                # Move the window to the next part
-                f1.seek(i * other.partLength + window)
-
-                read_data = f1.read(other.partLength)
-                current_hash = Adler32(read_data)
-
-                # Calculate the checksums for all the possible windows
-                while window < other.partLength:
-                    if current_hash.checksum == self.checksums[i]:
-                        if window > 0:
-                            # Send the part between the start and the offset
-                            parts.append(
-                                (i * other.partLength, i * other.partLength + window, 0)
-                            )
-                            # Send an offset representing the part that is the same
-                            parts.append(
-                                (
-                                    i * other.partLength,
-                                    (i + 1) * other.partLength - window,
-                                    window,
-                                )
-                            )
-                        break
-
-                    if len(read_data) <= window:
-                        # Send the whole part as a difference
-                        parts.append(
-                            (i * other.partLength, (i + 1) * other.partLength, 0)
-                        )
-                        break
-
-                    first_byte = bytes([read_data[window]])
-                    next_byte = f1.read(1)
-
-                    current_hash.move_window(first_byte, next_byte)
-
-                    window += 1
-
-                # All windows have been checked and no match was found.
-                # Add the whole part as a difference.
-                if window >= other.partLength:
-                    parts.append((i * other.partLength, (i + 1) * other.partLength, 0))
-                    window = 0
-
-        # Add the last part if it is not the same length as the other parts
-        if self.totalLength < other.totalLength:
-            if len(parts) == 0 or (parts[-1][1] + parts[-1][2]) != other.totalLength:
-                parts.append((self.totalLength, other.totalLength, 0))
-        elif self.totalLength > other.totalLength:
-            if len(parts) == 0 or (parts[-1][1] + parts[-1][2]) != self.totalLength:
-                parts.append((other.totalLength, self.totalLength, 0))
-
-        # Group parts that are next to each other
-        # This is done to reduce the amount of data that needs to be sent
-        # Example: [0, 100, 0], [100, 200, 0] -> [0, 200, 0]
-        return_parts = []
-        for part in parts:
-            if len(return_parts) == 0:
-                return_parts.append(part)
-                continue
-            if return_parts[-1][1] == part[0] and return_parts[-1][2] == part[2]:
-                return_parts[-1] = (return_parts[-1][0], part[1], return_parts[-1][2])
-            elif return_parts[-1][1] > part[0] and return_parts[-1][2] == part[2]:
-                return_parts[-1] = (
-                    return_parts[-1][0],
-                    max(return_parts[-1][1], part[1]),
-                    return_parts[-1][2],
+        parts = {}
+        for i in range(self.parts):
+            if self.part_size(i) > 0:
+                parts.setdefault(self.checksums[i], []).append(i)
+
+        delta = []
+
+        with open(path, "rb") as f:
+            size = f.seek(0, 2)
+            if end is not None and end < size:
+                size = end
+            if size <= start:
+                return delta
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                position = start
+                literal_start = start
+                current_hash = Adler32(
+                    data[position : min(position + self.partLength, size)]
                 )
-            else:
-                return_parts.append(part)
 
-        # Order the parts by offset since the offset need to be applied first
-        return_parts.sort(key=lambda x: -x[2])
+                while position < size:
+                    length = min(self.partLength, size - position)
+
+                    match = None
+                    for i in parts.get(current_hash.checksum, []):
+                        if self.part_size(i) != length:
+                            continue
+                        # A weak checksum match is only trusted if the strong checksum agrees
+                        if (
+                            self.strongChecksums
+                            and hashlib.md5(data[position : position + length]).digest()
+                            != self.strongChecksums[i]
+                        ):
+                            continue
+                        match = i
+                        break
 
-        return return_parts
+                    if match is not None:
+                        add_to_delta(delta, data[literal_start:position])
+                        add_to_delta(
+                            delta, [self.offset + match * self.partLength, length]
+                        )
+                        position += length
+                        literal_start = position
+                        current_hash = Adler32(
+                            data[position : min(position + self.partLength, size)]
+                        )
+                        continue
+
+                    # Move the window by one byte
+                    current_hash.move_window(
+                        data[position : position + 1],
+                        (
+                            data[position + length : position + length + 1]
+                            if position + length < size
+                            else b""
+                        ),
+                    )
+                    position += 1
+
+                add_to_delta(delta, data[literal_start:size])
+
+        return delta
 
     def __hash__(self):
         return hash(self.checksums)
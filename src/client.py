@@ -12,18 +12,36 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 import os
+import signal
 from argparse import Namespace
 from os import path
 from typing import List
 
-from src.checksum import Checksum
+from src.checksum import Checksum, add_to_delta
 from src.filelist import (
+    FileEntry,
     generate_file_list,
+    generate_file_list_for_paths,
+    prefix_checksum,
     generate_info,
+    iterate_file_list,
+    read_files_from,
     generate_file_list_flags_from_args,
+    FileListInfo,
 )
+from src.filters import filter_rules_from_args
 from src.logger import Logger
+from src.merkle import MerkleTree
 from src.message import recv, MESSAGE_TAG, send, MessageMethod
+from src.plan import print_transfer_plan
+from src.scan_cache import scan_cache_from_args
+from src.utils import get_data_extents
+from src.watch import Watcher
+
+# Maximum amount of data sent in a single message for the files sent in several parts
+PART_MESSAGE_SIZE = 4 * 1024 * 1024
+# Amount of entries in each part of a file list sent as it is scanned
+FILE_LIST_PART_ENTRIES = 1000
 
 
 class Client:
@@ -41,6 +59,271 @@ class Client:
         self.wr = wr
         self.args = args
 
+        # Hash trees of the files being compared with the destination
+        self.trees = {}
+
+        # Changes of the sources, in watch mode
+        self.watcher = Watcher(sources, args.recursive) if args.watch else None
+        self.file_list_flags = 0
+
+        # The checksum of a file is only needed in the file list
+        self.file_info_flags = (
+            generate_file_list_flags_from_args(args) & ~FileListInfo.CHECKSUM.value
+        )
+
+    def get_target_path(self, filename: str, source: int) -> str:
+        """
+        Get the path of a file asked by the generator
+        :param filename: The file name, relative to its source
+        :param source: The index of the source of the file
+        :return: The path of the file
+        """
+        # If the filename is empty, it means that the file is the source itself
+        return (
+            path.join(self.sources[source], filename)
+            if filename != ""
+            else self.sources[source]
+        )
+
+    def send_delta(
+        self,
+        filename: str,
+        file_info: FileEntry,
+        target_path: str,
+        delta: list,
+        total_length: int,
+    ):
+        """
+        Send the instructions to rebuild a file from the destination file
+        :param filename: The file name, relative to its source
+        :param file_info: The file info
+        :param target_path: The path of the file
+        :param delta: The delta of the file
+        :param total_length: The size of the destination file
+        :return: None
+        """
+        # If the whole destination file is reused as is, the file is already up-to-date
+        # Ask for the server to update the modification time
+        if path.getsize(target_path) == total_length and delta == (
+            [[0, total_length]] if total_length > 0 else []
+        ):
+            self.logger.info(f"File {filename} is already up to date")
+            send(
+                self.wr,
+                MESSAGE_TAG.FILE_DATA,
+                (filename, file_info, 0, 0, False, b""),
+                timeout=self.args.timeout,
+                logger=self.logger,
+                compress_file=self.args.compress,
+                compress_level=self.args.compress_level,
+            )
+        else:
+            send(
+                self.wr,
+                MESSAGE_TAG.FILE_DELTA,
+                (filename, file_info, delta),
+                timeout=self.args.timeout,
+                logger=self.logger,
+                compress_file=self.args.compress,
+                compress_level=self.args.compress_level,
+            )
+
+    def send_bundle(self, files: List[list]):
+        """
+        Send several small files in a single message
+        :param files: The [file name, source] of the files
+        :return: None
+        """
+        entries = []
+        data = []
+
+        for filename, source in files:
+            target_path = self.get_target_path(filename, source)
+            file_info = generate_info(target_path, self.file_info_flags, source, False)
+
+            self.logger.info(f"File data requested for {target_path}")
+            if path.isdir(target_path):
+                entries.append([filename + "/", file_info, 0])
+                continue
+
+            with open(target_path, "rb") as f:
+                file_data = f.read()
+            entries.append([filename, file_info, len(file_data)])
+            data.append(file_data)
+
+        send(
+            self.wr,
+            MESSAGE_TAG.FILE_BUNDLE,
+            (entries, b"".join(data)),
+            timeout=self.args.timeout,
+            logger=self.logger,
+            compress_file=self.args.compress,
+            compress_level=self.args.compress_level,
+        )
+
+    def send_sparse_file(self, filename: str, file_info: FileEntry, target_path: str):
+        """
+        Send a whole file without its holes
+        The data extents are split in several messages to avoid loading big files in memory
+        :param filename: The file name, relative to its source
+        :param file_info: The file info
+        :param target_path: The path of the file
+        :return: None
+        """
+        with open(target_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            extents = []
+            data_size = 0
+            first = True
+
+            for offset, length in get_data_extents(f.fileno()):
+                while length > 0:
+                    data = os.pread(
+                        f.fileno(), min(length, PART_MESSAGE_SIZE - data_size), offset
+                    )
+                    if not data:
+                        break
+
+                    extents.append([offset, data])
+                    offset += len(data)
+                    length -= len(data)
+                    data_size += len(data)
+
+                    if data_size >= PART_MESSAGE_SIZE:
+                        send(
+                            self.wr,
+                            MESSAGE_TAG.FILE_SPARSE,
+                            (filename, file_info, size, first, False, extents),
+                            timeout=self.args.timeout,
+                            logger=self.logger,
+                            compress_file=self.args.compress,
+                            compress_level=self.args.compress_level,
+                        )
+                        extents = []
+                        data_size = 0
+                        first = False
+
+        send(
+            self.wr,
+            MESSAGE_TAG.FILE_SPARSE,
+            (filename, file_info, size, first, True, extents),
+            timeout=self.args.timeout,
+            logger=self.logger,
+            compress_file=self.args.compress,
+            compress_level=self.args.compress_level,
+        )
+
+    def send_appended_data(
+        self, filename: str, file_info: FileEntry, target_path: str, offset: int
+    ):
+        """
+        Send the data appended to a file after the size of its destination version
+        :param filename: The file name, relative to its source
+        :param file_info: The file info
+        :param target_path: The path of the file
+        :param offset: The size of the destination file
+        :return: None
+        """
+        with open(target_path, "rb", buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+
+            while True:
+                data = os.pread(
+                    f.fileno(), min(size - offset, PART_MESSAGE_SIZE), offset
+                )
+                last = offset + len(data) >= size or not data
+                send(
+                    self.wr,
+                    MESSAGE_TAG.FILE_APPEND,
+                    (filename, file_info, offset, last, data),
+                    timeout=self.args.timeout,
+                    logger=self.logger,
+                    compress_file=self.args.compress,
+                    compress_level=self.args.compress_level,
+                )
+                offset += len(data)
+
+                if last:
+                    break
+
+    def send_file_list_parts(self, options: int):
+        """
+        Send the file list in parts as the sources are scanned, for the listings that are printed as they are received.
+        :param options: The info to include in the file list.
+        :return:
+        """
+        part = []
+        for info in iterate_file_list(
+            self.sources,
+            options,
+            recursive=self.args.recursive,
+            directory=self.args.dirs,
+            threads=self.args.scan_threads,
+            filter_rules=filter_rules_from_args(self.args),
+        ):
+            part.append(info)
+            if len(part) == FILE_LIST_PART_ENTRIES:
+                send(
+                    self.wr,
+                    MESSAGE_TAG.FILE_LIST_PART,
+                    part,
+                    timeout=self.args.timeout,
+                    logger=self.logger,
+                )
+                part = []
+
+        send(
+            self.wr,
+            MESSAGE_TAG.FILE_LIST,
+            part,
+            timeout=self.args.timeout,
+            logger=self.logger,
+        )
+
+    def wait_for_changes(self) -> bool:
+        """
+        Wait for changes in the sources, then send the file list of the changed paths
+        :return: False if the watch was interrupted
+        """
+        self.logger.info("Waiting for changes...")
+        try:
+            paths = self.watcher.wait(self.args.watch_delay)
+        except KeyboardInterrupt:
+            # Let the server finish before exiting
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            return False
+
+        if paths is None:
+            self.logger.warn("Changes were lost, scanning the sources again...")
+            file_list = generate_file_list(
+                self.sources,
+                self.logger,
+                recursive=self.args.recursive,
+                directory=self.args.dirs,
+                options=self.file_list_flags,
+                threads=self.args.scan_threads,
+                filter_rules=filter_rules_from_args(self.args),
+            )
+        else:
+            self.logger.info(f"Changes in {paths}")
+            file_list = generate_file_list_for_paths(
+                self.sources,
+                paths,
+                self.logger,
+                recursive=self.args.recursive,
+                options=self.file_list_flags,
+                filter_rules=filter_rules_from_args(self.args),
+            )
+
+        send(
+            self.wr,
+            MESSAGE_TAG.FILE_LIST_UPDATE,
+            (file_list, paths),
+            timeout=self.args.timeout,
+            logger=self.logger,
+        )
+        return True
+
     def run(self):
         """
         Run the client
@@ -54,20 +337,59 @@ class Client:
 
             if tag == MESSAGE_TAG.ASK_FILE_LIST:
                 self.logger.info("File list requested")
-                file_list = generate_file_list(
-                    self.sources,
-                    self.logger,
-                    recursive=self.args.recursive,
-                    directory=self.args.dirs,
-                    options=v,
-                )
-                send(
-                    self.wr,
-                    MESSAGE_TAG.FILE_LIST,
-                    file_list,
-                    timeout=self.args.timeout,
-                    logger=self.logger,
-                )
+                self.file_list_flags = v
+                if self.args.files_from:
+                    # Only the listed paths are stated, the sources are not walked
+                    paths = read_files_from(
+                        self.args.files_from, self.sources, self.args.recursive
+                    )
+                    file_list = generate_file_list_for_paths(
+                        self.sources,
+                        paths,
+                        self.logger,
+                        recursive=self.args.recursive,
+                        options=v,
+                        filter_rules=filter_rules_from_args(self.args),
+                    )
+                    if self.args.list_only:
+                        # The listing reads a plain file list
+                        send(
+                            self.wr,
+                            MESSAGE_TAG.FILE_LIST,
+                            file_list,
+                            timeout=self.args.timeout,
+                            logger=self.logger,
+                        )
+                    else:
+                        # The server only compares the same paths of the destination
+                        send(
+                            self.wr,
+                            MESSAGE_TAG.FILE_LIST_UPDATE,
+                            (file_list, paths),
+                            timeout=self.args.timeout,
+                            logger=self.logger,
+                        )
+                elif self.args.list_only:
+                    # The listing is printed as it is received
+                    self.send_file_list_parts(v)
+                else:
+                    file_list = generate_file_list(
+                        self.sources,
+                        self.logger,
+                        recursive=self.args.recursive,
+                        directory=self.args.dirs,
+                        options=v,
+                        threads=self.args.scan_threads,
+                        scan_cache=scan_cache_from_args(self.args),
+                        filter_rules=filter_rules_from_args(self.args),
+                    )
+                    send(
+                        self.wr,
+                        MESSAGE_TAG.FILE_LIST,
+                        file_list,
+                        timeout=self.args.timeout,
+                        logger=self.logger,
+                    )
             elif tag == MESSAGE_TAG.PING:
                 send(
                     self.wr,
@@ -76,18 +398,12 @@ class Client:
                     logger=self.logger,
                 )
             elif tag == MESSAGE_TAG.ASK_FILE_DATA:
-                (filename, source, checksums, total_length) = v
-
-                # If the filename is empty, it means that the file is the source itself
-                target_path = (
-                    path.join(self.sources[source], filename)
-                    if filename != ""
-                    else self.sources[source]
-                )
+                (filename, source, checksums, strong_checksums, total_length) = v
+                target_path = self.get_target_path(filename, source)
 
                 file_info = generate_info(
                     target_path,
-                    generate_file_list_flags_from_args(self.args),
+                    self.file_info_flags,
                     source,
                     False,
                 )
@@ -103,91 +419,186 @@ class Client:
                         compress_file=self.args.compress,
                         compress_level=self.args.compress_level,
                     )
-                else:
+                elif not checksums and self.args.sparse:
+                    # If there are no checksums, it means that the file is new
+                    self.send_sparse_file(filename, file_info, target_path)
+                elif not checksums:
+                    # If there are no checksums, it means that the file is new
                     with open(target_path, "rb") as f:
-                        # If there are no checksums, it means that the file is new
-                        if not checksums:
-                            send(
-                                self.wr,
-                                MESSAGE_TAG.FILE_DATA,
-                                (filename, file_info, 0, 0, True, f.read()),
-                                timeout=self.args.timeout,
-                                logger=self.logger,
-                                compress_file=self.args.compress,
-                                compress_level=self.args.compress_level,
-                            )
-                            continue
-
-                        # Calculate the parts that need to be sent
-                        destination_checksum = Checksum(
-                            "",
-                            checksums=checksums,
-                            part_length=total_length / len(checksums),
-                            total_length=total_length,
+                        send(
+                            self.wr,
+                            MESSAGE_TAG.FILE_DATA,
+                            (filename, file_info, 0, 0, True, f.read()),
+                            timeout=self.args.timeout,
+                            logger=self.logger,
+                            compress_file=self.args.compress,
+                            compress_level=self.args.compress_level,
                         )
-                        parts = destination_checksum.compare_with_file(target_path)
-
-                        # If there are no parts, it means that the file is already up-to-date
-                        # Ask for the server to update the modification time
-                        if len(parts) == 0:
-                            self.logger.info(f"File {filename} is already up to date")
-                            send(
-                                self.wr,
-                                MESSAGE_TAG.FILE_DATA,
-                                (filename, file_info, 0, 0, False, b""),
-                                timeout=self.args.timeout,
-                                logger=self.logger,
-                                compress_file=self.args.compress,
-                                compress_level=self.args.compress_level,
-                            )
-                            continue
-                        else:
-                            # Request for all the parts
-                            for part in parts:
-                                if part[2] > 0:
-                                    send(
-                                        self.wr,
-                                        MESSAGE_TAG.FILE_DATA_OFFSET,
-                                        (filename, part[0], part[1], part[2]),
-                                        timeout=self.args.timeout,
-                                        logger=self.logger,
-                                        compress_file=self.args.compress,
-                                        compress_level=self.args.compress_level,
-                                    )
-                                elif part[0] == -1 or part[1] == -1:
-                                    # If the part is -1, it means that the file needs to be sent entirely
-                                    send(
-                                        self.wr,
-                                        MESSAGE_TAG.FILE_DATA,
-                                        (filename, file_info, 0, 0, True, f.read()),
-                                        timeout=self.args.timeout,
-                                        logger=self.logger,
-                                        compress_file=self.args.compress,
-                                        compress_level=self.args.compress_level,
-                                    )
-                                else:
-                                    f.seek(part[0])
-                                    data = f.read(part[1] - part[0] + 1)
-                                    send(
-                                        self.wr,
-                                        MESSAGE_TAG.FILE_DATA,
-                                        (
-                                            filename,
-                                            file_info,
-                                            part[0],
-                                            part[1],
-                                            False,
-                                            data,
-                                        ),
-                                        timeout=self.args.timeout,
-                                        logger=self.logger,
-                                        compress_file=self.args.compress,
-                                        compress_level=self.args.compress_level,
-                                    )
+                else:
+                    # Calculate the instructions to rebuild the file from the destination file
+                    destination_checksum = Checksum(
+                        "",
+                        checksums=checksums,
+                        strong_checksums=strong_checksums,
+                        total_length=total_length,
+                    )
+                    delta = destination_checksum.get_delta(target_path)
+                    self.send_delta(
+                        filename, file_info, target_path, delta, total_length
+                    )
+            elif tag == MESSAGE_TAG.ASK_LINK_PROBE:
+                send(
+                    self.wr,
+                    MESSAGE_TAG.LINK_PROBE,
+                    os.urandom(v),
+                    timeout=self.args.timeout,
+                    logger=self.logger,
+                )
+            elif tag == MESSAGE_TAG.ASK_FILE_ESTIMATE:
+                (filename, source, checksums, strong_checksums, total_length) = v
+                target_path = self.get_target_path(filename, source)
+
+                if checksums:
+                    destination_checksum = Checksum(
+                        "",
+                        checksums=checksums,
+                        strong_checksums=strong_checksums,
+                        total_length=total_length,
+                    )
+                    delta = destination_checksum.get_delta(target_path)
+                    literal_bytes = sum(
+                        len(op) for op in delta if isinstance(op, bytes)
+                    )
+                    matched_bytes = sum(
+                        op[1] for op in delta if not isinstance(op, bytes)
+                    )
+                else:
+                    # The destination is a directory, the file would be sent whole
+                    literal_bytes = path.getsize(target_path)
+                    matched_bytes = 0
+
+                send(
+                    self.wr,
+                    MESSAGE_TAG.FILE_ESTIMATE,
+                    (filename, source, literal_bytes, matched_bytes),
+                    timeout=self.args.timeout,
+                    logger=self.logger,
+                )
+            elif tag == MESSAGE_TAG.TRANSFER_PLAN:
+                if self.logger.to_file:
+                    # The client is the remote side, the plan is printed by the server
+                    send(
+                        self.wr,
+                        MESSAGE_TAG.TRANSFER_PLAN,
+                        v,
+                        timeout=self.args.timeout,
+                        logger=self.logger,
+                    )
+                else:
+                    print_transfer_plan(v, self.logger)
+            elif tag == MESSAGE_TAG.ASK_FILE_BUNDLE:
+                self.send_bundle(v)
+            elif tag == MESSAGE_TAG.ASK_FILE_APPEND:
+                (filename, source, total_length, digest) = v
+                target_path = self.get_target_path(filename, source)
+
+                # The destination file must be the start of the source file
+                verified = (
+                    path.getsize(target_path) >= total_length
+                    and prefix_checksum(target_path, total_length) == digest
+                )
+                send(
+                    self.wr,
+                    MESSAGE_TAG.FILE_APPEND_VERIFY,
+                    (filename, source, verified),
+                    timeout=self.args.timeout,
+                    logger=self.logger,
+                )
+
+                if verified:
+                    self.logger.info(f"Appended data requested for {target_path}")
+                    file_info = generate_info(
+                        target_path,
+                        self.file_info_flags,
+                        source,
+                        False,
+                    )
+                    self.send_appended_data(
+                        filename, file_info, target_path, total_length
+                    )
+            elif tag == MESSAGE_TAG.ASK_FILE_TREE:
+                (filename, source, leaf_size, depth, level, nodes) = v
+                target_path = self.get_target_path(filename, source)
+
+                # The tree of the file is kept until the data of the different leaves is asked
+                if (source, filename) not in self.trees:
+                    self.trees[(source, filename)] = MerkleTree(
+                        target_path, leaf_size, depth
+                    )
+                tree = self.trees[(source, filename)]
+
+                send(
+                    self.wr,
+                    MESSAGE_TAG.FILE_TREE_DIFFERENCE,
+                    (filename, source, level, tree.get_differences(level, nodes)),
+                    timeout=self.args.timeout,
+                    logger=self.logger,
+                )
+            elif tag == MESSAGE_TAG.ASK_FILE_TREE_DATA:
+                (filename, source, leaf_size, total_length, leaves) = v
+                target_path = self.get_target_path(filename, source)
+                self.trees.pop((source, filename), None)
+
+                file_info = generate_info(
+                    target_path,
+                    self.file_info_flags,
+                    source,
+                    False,
+                )
+
+                self.logger.info(f"File data requested for {target_path}")
+
+                # The leaves that are not different are the same as in the destination file
+                leaves = {
+                    leaf: (checksums, strong_checksums, length)
+                    for leaf, checksums, strong_checksums, length in leaves
+                }
+                size = path.getsize(target_path)
+                delta = []
+                for start in range(0, size, leaf_size):
+                    end = min(start + leaf_size, size)
+                    if start // leaf_size not in leaves:
+                        add_to_delta(delta, [start, end - start])
+                        continue
+
+                    (checksums, strong_checksums, length) = leaves[start // leaf_size]
+                    destination_checksum = Checksum(
+                        "",
+                        checksums=checksums,
+                        strong_checksums=strong_checksums,
+                        total_length=length,
+                        offset=start,
+                    )
+                    for op in destination_checksum.get_delta(target_path, start, end):
+                        add_to_delta(delta, op)
+
+                self.send_delta(filename, file_info, target_path, delta, total_length)
             elif tag == MESSAGE_TAG.END:
                 self.logger.debug("End of transmission")
                 break
             elif tag == MESSAGE_TAG.GENERATOR_FINISHED:
+                # In watch mode, the server keeps running to synchronize the next changes
+                if self.watcher is not None:
+                    send(
+                        self.wr,
+                        MESSAGE_TAG.GENERATOR_FINISHED,
+                        None,
+                        timeout=self.args.timeout,
+                        logger=self.logger,
+                    )
+                    if self.wait_for_changes():
+                        continue
+
                 send(
                     self.wr,
                     MESSAGE_TAG.END,
@@ -209,9 +620,19 @@ class Client:
                     timeout=self.args.timeout,
                     logger=self.logger,
                 )
+            elif tag in (MESSAGE_TAG.HARD_LINKS, MESSAGE_TAG.DIRECTORY_INFO):
+                send(
+                    self.wr,
+                    tag,
+                    v,
+                    timeout=self.args.timeout,
+                    logger=self.logger,
+                )
             else:
                 raise Exception(f"Unknown message tag {tag}")
 
         self.logger.debug("Client finished")
+        if self.watcher is not None:
+            self.watcher.close()
         self.rd.close()
         self.wr.close()
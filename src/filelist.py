@@ -11,14 +11,26 @@
 #    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
+import hashlib
 import os
+import stat
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from time import strftime, localtime
-from typing import List, Optional
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 
 from argparse import Namespace
 
-from src.adler32 import Adler32
+from src.filters import FilterRules
+from src.scan_cache import ScanCache
+from src.utils import get_physical_offset
+
+# Size of the chunks read to calculate the checksum of a whole file
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+# Amount of entries written at once by the streaming listing
+LIST_BUFFER_ENTRIES = 1024
 
 
 # Enum bitfield for info to include in file list.
@@ -39,11 +51,111 @@ class FileListInfo(Enum):
     FILE_SIZE = 4
     FILE_TIMES = 8
     CHECKSUM = 16
+    INODE = 32
+    EXTENT = 64
 
     def __str__(self):
         return self.name.replace("_", " ").title()
 
 
+class FileEntry:
+    """
+    An entry of a file list.
+    The optional fields are None when they were not asked for. The entries use slots instead of a dict,
+    since the file lists of big trees have millions of them.
+    """
+
+    __slots__ = (
+        "type",
+        "path",
+        "source",
+        "mtime",
+        "size",
+        "permissions",
+        "atime",
+        "ctime",
+        "checksum",
+        "hard_link",
+        "inode",
+        "extent",
+    )
+
+    def __init__(
+        self,
+        type: int,
+        path: str,
+        source: int,
+        mtime: int,
+        size: Optional[int] = None,
+        permissions: Optional[int] = None,
+        atime: Optional[int] = None,
+        ctime: Optional[int] = None,
+        checksum: Optional[str] = None,
+        hard_link: Optional[str] = None,
+        inode: Optional[int] = None,
+        extent: Optional[int] = None,
+    ):
+        """
+        Create an entry of a file list.
+        :param type: The FileType value of the entry.
+        :param path: The path of the entry, relative to its source.
+        :param source: The index of the source of the entry.
+        :param mtime: The modification time.
+        :param size: The size in bytes.
+        :param permissions: The mode of the entry.
+        :param atime: The access time.
+        :param ctime: The change time.
+        :param checksum: The checksum of the content of a file.
+        :param hard_link: The path of the first file of the source linked to the same inode.
+        :param inode: The inode number, to read the files in the order of the disk.
+        :param extent: The offset on the disk of the first extent of a file, to read the files in the order of the disk.
+        """
+        self.type = type
+        self.path = path
+        self.source = source
+        self.mtime = mtime
+        self.size = size
+        self.permissions = permissions
+        self.atime = atime
+        self.ctime = ctime
+        self.checksum = checksum
+        self.hard_link = hard_link
+        self.inode = inode
+        self.extent = extent
+
+    def to_list(self) -> list:
+        """
+        Get the fields of the entry, without the trailing fields that are not set, to send it.
+        :return: The fields, in the order of the slots.
+        """
+        fields = [getattr(self, name) for name in self.__slots__]
+        while fields[-1] is None:
+            fields.pop()
+        return fields
+
+    @classmethod
+    def from_list(cls, fields: list) -> "FileEntry":
+        """
+        Create an entry from the fields of to_list.
+        :param fields: The fields.
+        :return: The entry.
+        """
+        return cls(*fields)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, FileEntry):
+            return NotImplemented
+        return self.to_list() == other.to_list()
+
+    def __repr__(self) -> str:
+        fields = ", ".join(
+            f"{name}={getattr(self, name)!r}"
+            for name in self.__slots__
+            if getattr(self, name) is not None
+        )
+        return f"FileEntry({fields})"
+
+
 def generate_file_list_flags_from_args(args: Namespace):
     file_list_flags = 0
 
@@ -57,15 +169,217 @@ def generate_file_list_flags_from_args(args: Namespace):
         file_list_flags |= FileListInfo.FILE_SIZE.value
     if args.checksum:
         file_list_flags |= FileListInfo.CHECKSUM.value
+        # The size is compared before the checksum
+        file_list_flags |= FileListInfo.FILE_SIZE.value
 
     if not args.checksum:
         file_list_flags |= FileListInfo.FILE_SIZE.value
         file_list_flags |= FileListInfo.FILE_TIMES.value
 
+    if args.order == "inode":
+        file_list_flags |= FileListInfo.INODE.value
+    if args.order == "extent":
+        # The inode is the order of the files whose extent is unknown
+        file_list_flags |= FileListInfo.EXTENT.value | FileListInfo.INODE.value
+
     return file_list_flags
 
 
-def generate_info(path, options, source, is_self=False, rel=None):
+def file_checksum(path: str) -> str:
+    """
+    Calculate the checksum of a whole file, without loading it in memory.
+    :param path: The path to the file.
+    :return: The hexadecimal md5 digest of the file.
+    """
+    digest = hashlib.md5()
+    buffer = bytearray(CHECKSUM_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            digest.update(view[:size])
+
+    return digest.hexdigest()
+
+
+def prefix_checksum(path: str, length: int) -> str:
+    """
+    Calculate the checksum of the first bytes of a file, to check that another file only grew since.
+    The whole prefix is hashed, so a change anywhere in it is detected.
+    :param path: The path to the file.
+    :param length: The length of the prefix.
+    :return: The hexadecimal md5 digest of the prefix.
+    """
+    digest = hashlib.md5(length.to_bytes(8, byteorder="big"))
+    with open(path, "rb", buffering=0) as f:
+        offset = 0
+        while offset < length:
+            data = os.pread(
+                f.fileno(), min(length - offset, CHECKSUM_CHUNK_SIZE), offset
+            )
+            if not data:
+                break
+            digest.update(data)
+            offset += len(data)
+
+    return digest.hexdigest()
+
+
+def list_directory(
+    directory: str,
+    directory_stat: Optional[os.stat_result] = None,
+    scan_cache: Optional[ScanCache] = None,
+) -> Tuple[List[tuple], List[tuple]]:
+    """
+    List a directory with os.scandir, following the symbolic links.
+    The type of the entries comes from the directory itself, so each entry is only stated once.
+    :param directory: The path to the directory.
+    :param directory_stat: The stat of the directory, needed to use the scan cache.
+    :param scan_cache: The listings of the previous scans, the names in unchanged directories are not read again.
+    :return: The (path, stat) of the files and of the subdirectories, empty if the directory can't be read.
+    """
+    files = []
+    subdirectories = []
+
+    names = None
+    if scan_cache is not None and directory_stat is not None:
+        names = scan_cache.get(directory, directory_stat)
+
+    if names is not None:
+        # The entries still need to be stated, a file can be modified without changing its directory
+        for name in names:
+            entry_path = os.path.join(directory, name)
+            try:
+                entry_stat = os.stat(entry_path)
+            except OSError:
+                continue
+
+            if stat.S_ISDIR(entry_stat.st_mode):
+                subdirectories.append((entry_path, entry_stat))
+            else:
+                files.append((entry_path, entry_stat))
+
+        return files, subdirectories
+
+    names = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                names.append(entry.name)
+                try:
+                    is_dir = entry.is_dir()
+                    entry_stat = entry.stat()
+                except OSError:
+                    # Broken symbolic link, or the entry was deleted during the scan
+                    continue
+
+                if is_dir:
+                    subdirectories.append((entry.path, entry_stat))
+                else:
+                    files.append((entry.path, entry_stat))
+    except OSError:
+        return files, subdirectories
+
+    if scan_cache is not None and directory_stat is not None:
+        scan_cache.put(directory, directory_stat, names)
+
+    return files, subdirectories
+
+
+def scan_directory(
+    path: str,
+    recursive: bool = True,
+    threads: int = 1,
+    scan_cache: Optional[ScanCache] = None,
+    exclude: Optional[Callable[[str, bool], bool]] = None,
+):
+    """
+    Walk a directory, the files of each directory being listed before its subdirectories.
+    With several threads, the directories are listed in parallel as soon as they are found,
+    which hides the latency of network filesystems. The order of the entries stays the same.
+    :param path: The path to the directory.
+    :param recursive: Whether to walk the subdirectories.
+    :param threads: The amount of directories listed at the same time.
+    :param scan_cache: The listings of the previous scans.
+    :param exclude: A function telling if a path is excluded from its path and whether it is a directory,
+    the excluded directories are not walked.
+    :return: A generator of the (path, stat) of the entries.
+    """
+    path_stat = None
+    if scan_cache is not None:
+        scan_cache.add_root(path)
+        path_stat = os.stat(path)
+
+    def list_included(directory: str, directory_stat: Optional[os.stat_result]):
+        files, subdirectories = list_directory(directory, directory_stat, scan_cache)
+        if exclude is not None:
+            files = [entry for entry in files if not exclude(entry[0], False)]
+            subdirectories = [
+                entry for entry in subdirectories if not exclude(entry[0], True)
+            ]
+        return files, subdirectories
+
+    if threads <= 1:
+        directories = [(path, path_stat)]
+        while directories:
+            directory, directory_stat = directories.pop()
+            files, subdirectories = list_included(directory, directory_stat)
+            yield from files
+            yield from subdirectories
+
+            if recursive:
+                directories.extend(reversed(subdirectories))
+        return
+
+    executor = ThreadPoolExecutor(max_workers=threads)
+    stopped = False
+    submitted = set()
+    lock = threading.RLock()
+
+    def forget(future):
+        with lock:
+            submitted.discard(future)
+
+    def submit(directory: str, directory_stat: Optional[os.stat_result]):
+        # Nothing is queued anymore once the walk is interrupted
+        with lock:
+            if stopped:
+                return None
+            future = executor.submit(list_directory_tree, directory, directory_stat)
+            submitted.add(future)
+            future.add_done_callback(forget)
+            return future
+
+    def list_directory_tree(directory: str, directory_stat: Optional[os.stat_result]):
+        # The subdirectories are queued before the results are read
+        files, subdirectories = list_included(directory, directory_stat)
+        children = []
+        if recursive:
+            children = [
+                submit(subdirectory, subdirectory_stat)
+                for subdirectory, subdirectory_stat in subdirectories
+            ]
+        return files, subdirectories, children
+
+    try:
+        pending = [submit(path, path_stat)]
+        while pending:
+            files, subdirectories, children = pending.pop().result()
+            yield from files
+            yield from subdirectories
+            pending.extend(reversed(children))
+    finally:
+        # Cancel the queued directories if the walk is interrupted
+        with lock:
+            stopped = True
+            for future in list(submitted):
+                future.cancel()
+        executor.shutdown()
+
+
+def generate_info(path, options, source, is_self=False, rel=None, path_stat=None):
     """
     Generate info for a file or directory.
     :param path: The path to the file or directory.
@@ -73,9 +387,13 @@ def generate_info(path, options, source, is_self=False, rel=None):
     :param source: The source of the file or directory.
     :param is_self: Whether the path is the source.
     :param rel: The relative path to the source.
+    :param path_stat: The stat of the path, if it is already known.
     :return:
     """
-    file_type = FileType.FILE if os.path.isfile(path) else FileType.DIRECTORY
+    if path_stat is None:
+        path_stat = os.stat(path)
+
+    file_type = FileType.FILE if stat.S_ISREG(path_stat.st_mode) else FileType.DIRECTORY
 
     if is_self:
         info_path = ""
@@ -84,90 +402,297 @@ def generate_info(path, options, source, is_self=False, rel=None):
     else:
         info_path = os.path.basename(path)
 
-    info = {
-        "type": file_type.value,
-        "path": info_path,
-        "source": source,
-        "mtime": int(os.stat(path).st_mtime),
-    }
-
-    if options & FileListInfo.HARD_LINKS.value:
-        # Send all the hard links
-        info["hard_links"] = []
-        for link in os.listdir(os.path.dirname(path)):
-            if os.stat(os.path.join(os.path.dirname(path), link)).st_ino == os.stat(
-                path
-            ).st_ino and link != os.path.basename(path):
-                info["hard_links"].append(link)
+    info = FileEntry(file_type.value, info_path, source, int(path_stat.st_mtime))
+
     if options & FileListInfo.PERMISSIONS.value:
-        info["permissions"] = os.stat(path).st_mode
+        info.permissions = path_stat.st_mode
     if options & FileListInfo.FILE_SIZE.value:
-        info["size"] = os.stat(path).st_size
+        info.size = path_stat.st_size
     if options & FileListInfo.FILE_TIMES.value:
-        info["atime"] = int(os.stat(path).st_atime)
-        info["ctime"] = int(os.stat(path).st_ctime)
+        info.atime = int(path_stat.st_atime)
+        info.ctime = int(path_stat.st_ctime)
+    if options & FileListInfo.INODE.value:
+        info.inode = path_stat.st_ino
 
     if file_type.value == FileType.FILE.value:
         if options & FileListInfo.CHECKSUM.value:
-            with open(path, "rb") as f:
-                info["checksum"] = Adler32(f.read()).checksum
+            info.checksum = file_checksum(path)
+        if options & FileListInfo.EXTENT.value:
+            info.extent = get_physical_offset(path)
 
     return info
 
 
-def generate_file_list(
+def iterate_file_list(
     sources: List[str],
-    logger,
     options: int = FileListInfo.NONE.value,
     recursive: Optional[bool] = False,
     directory: Optional[bool] = False,
-) -> List[dict]:
+    threads: int = 1,
+    scan_cache: Optional[ScanCache] = None,
+    filter_rules: Optional[FilterRules] = None,
+) -> Iterator[FileEntry]:
     """
-    Generate a list of files and directories from a list of paths.
+    Generate the entries of a file list as they are scanned, without keeping them in memory.
     :param sources: list of paths to generate file list from
-    :param logger: logger to log to
     :param options: options to include in file list
     :param recursive: whether to recursively generate file list
     :param directory: whether to treat sources as directories
-    :return:
+    :param threads: amount of directories to scan at the same time
+    :param scan_cache: listings of the previous scans, saved with the new listings once the scan is done
+    :param filter_rules: rules of the files to exclude, the excluded directories are not scanned
+    :return: A generator of the info of the entries.
     """
 
-    logger.debug("Generating file list...")
-    file_list = []
+    # First file found of each inode linked several times, by source, device and inode
+    hard_links = {}
+
+    def get_exclude(source: str) -> Optional[Callable[[str, bool], bool]]:
+        if filter_rules is None:
+            return None
+
+        # The rules match the paths from the root of the transfer,
+        # which contains the source directory itself if it has no trailing slash
+        root = source if source.endswith(os.sep) else os.path.dirname(source)
+        root_length = len(os.path.join(root, "")) if root else 0
+        return lambda path, is_dir: filter_rules.excluded(path[root_length:], is_dir)
 
     def recursive_dir(path, source_num: int):
-        for root, dirs, files in os.walk(path, followlinks=True):
-            for file in files:
-                file_path = os.path.join(root, file)
-                file_list.append(
-                    generate_info(file_path, options, source_num, rel=path)
-                )
-            for dir in dirs:
-                dir_path = os.path.join(root, dir)
-                file_list.append(generate_info(dir_path, options, source_num, rel=path))
-
-            if not recursive:
-                break
+        for entry_path, entry_stat in scan_directory(
+            path, recursive, threads, scan_cache, get_exclude(path)
+        ):
+            info = generate_info(
+                entry_path, options, source_num, rel=path, path_stat=entry_stat
+            )
+
+            if (
+                options & FileListInfo.HARD_LINKS.value
+                and info.type == FileType.FILE.value
+                and entry_stat.st_nlink > 1
+            ):
+                # The other files of the inode are links to the first one
+                key = (source_num, entry_stat.st_dev, entry_stat.st_ino)
+                if key in hard_links:
+                    info.hard_link = hard_links[key]
+                else:
+                    hard_links[key] = info.path
+
+            yield info
 
     for i in range(len(sources)):
         source = sources[i]
+        exclude = get_exclude(source)
+        if (
+            exclude is not None
+            and not source.endswith(os.sep)
+            and exclude(source, os.path.isdir(source))
+        ):
+            continue
+
         if directory:
             if not source.endswith(os.sep):
                 if os.path.isdir(source):
-                    file_list.append(generate_info(source, options, i, True))
+                    yield generate_info(source, options, i, True)
                     if recursive:
-                        recursive_dir(source, i)
+                        yield from recursive_dir(source, i)
                 elif os.path.isfile(source):
-                    file_list.append(generate_info(source, options, i, True))
+                    yield generate_info(source, options, i, True)
             else:
-                recursive_dir(source, i)
+                yield from recursive_dir(source, i)
         elif os.path.isfile(source):
-            file_list.append(generate_info(source, options, i, True))
+            yield generate_info(source, options, i, True)
+
+    if scan_cache is not None:
+        scan_cache.save()
+
+
+def generate_file_list(
+    sources: List[str],
+    logger,
+    options: int = FileListInfo.NONE.value,
+    recursive: Optional[bool] = False,
+    directory: Optional[bool] = False,
+    threads: int = 1,
+    scan_cache: Optional[ScanCache] = None,
+    filter_rules: Optional[FilterRules] = None,
+) -> List[FileEntry]:
+    """
+    Generate a list of files and directories from a list of paths.
+    :param sources: list of paths to generate file list from
+    :param logger: logger to log to
+    :param options: options to include in file list
+    :param recursive: whether to recursively generate file list
+    :param directory: whether to treat sources as directories
+    :param threads: amount of directories to scan at the same time
+    :param scan_cache: listings of the previous scans, saved with the new listings once the scan is done
+    :param filter_rules: rules of the files to exclude, the excluded directories are not scanned
+    :return:
+    """
+
+    logger.debug("Generating file list...")
+
+    # The checksums are calculated at the end, in parallel
+    checksum = options & FileListInfo.CHECKSUM.value
+    options &= ~FileListInfo.CHECKSUM.value
+
+    file_list = list(
+        iterate_file_list(
+            sources,
+            options,
+            recursive,
+            directory,
+            threads,
+            scan_cache,
+            filter_rules,
+        )
+    )
+
+    if checksum:
+        add_checksums(sources, logger, file_list)
 
     logger.debug("File list generated.")
     return file_list
 
 
+def generate_file_list_for_paths(
+    sources: List[str],
+    paths: List[list],
+    logger,
+    options: int = FileListInfo.NONE.value,
+    recursive: Optional[bool] = False,
+    filter_rules: Optional[FilterRules] = None,
+) -> List[FileEntry]:
+    """
+    Generate the file list of some paths of the sources, the paths that don't exist are skipped.
+    :param sources: the source directories
+    :param paths: list of [source, path, scan content] of the paths relative to their source,
+    the content of the directories is listed if scan content is set, and a path of . is the whole source
+    :param logger: logger to log to
+    :param options: options to include in file list
+    :param recursive: whether to list the subdirectories of the scanned directories
+    :param filter_rules: rules of the files to exclude
+    :return:
+    """
+
+    logger.debug("Generating file list...")
+    file_list = []
+    listed = set()
+
+    checksum = options & FileListInfo.CHECKSUM.value
+    options &= ~FileListInfo.CHECKSUM.value
+
+    def add(path: str, source_num: int, path_stat: os.stat_result):
+        info = generate_info(
+            path, options, source_num, rel=sources[source_num], path_stat=path_stat
+        )
+        if (source_num, info.path) not in listed:
+            listed.add((source_num, info.path))
+            file_list.append(info)
+
+    for source_num, path, scan in paths:
+        source = sources[source_num]
+        whole_source = os.path.normpath(path) == "."
+        full_path = source if whole_source else os.path.join(source, path)
+        try:
+            path_stat = os.stat(full_path)
+        except OSError:
+            continue
+
+        exclude = None
+        if filter_rules is not None:
+            # The rules match the paths from the root of the transfer
+            root = source if source.endswith(os.sep) else os.path.dirname(source)
+            root_length = len(os.path.join(root, "")) if root else 0
+            if not (
+                whole_source and source.endswith(os.sep)
+            ) and filter_rules.excluded_path(
+                full_path[root_length:], stat.S_ISDIR(path_stat.st_mode)
+            ):
+                continue
+
+            def exclude(entry_path: str, is_dir: bool) -> bool:
+                return filter_rules.excluded(entry_path[root_length:], is_dir)
+
+        if not whole_source:
+            add(full_path, source_num, path_stat)
+        elif not source.endswith(os.sep) and (source_num, "") not in listed:
+            # Like in a full scan, the source itself is only listed without a trailing slash
+            listed.add((source_num, ""))
+            file_list.append(
+                generate_info(source, options, source_num, True, path_stat=path_stat)
+            )
+
+        if scan and stat.S_ISDIR(path_stat.st_mode):
+            for entry_path, entry_stat in scan_directory(
+                full_path, recursive, exclude=exclude
+            ):
+                add(entry_path, source_num, entry_stat)
+
+    if checksum:
+        add_checksums(sources, logger, file_list)
+
+    logger.debug("File list generated.")
+    return file_list
+
+
+def read_files_from(files_from: str, sources: List[str], recursive: bool) -> List[list]:
+    """
+    Read the paths to transfer from a file, one per line, relative to the sources.
+    The empty lines and the comments starting with # or ; are skipped, the paths going out of the sources are refused.
+    :param files_from: the path of the file, or - for the standard input
+    :param sources: the source directories
+    :param recursive: whether to scan the content of the listed directories
+    :return: list of [source, path, scan content] of the paths, for generate_file_list_for_paths
+    """
+
+    if files_from == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(files_from, "r") as f:
+            lines = f.read().splitlines()
+
+    paths = []
+    for line in lines:
+        if line.strip() == "" or line.startswith(("#", ";")):
+            continue
+
+        # Like rsync, the listed paths are always relative to the sources,
+        # a line of / or . is the whole source
+        path = os.path.normpath(line.lstrip(os.sep) or os.curdir)
+        if path == os.pardir or path.startswith(os.pardir + os.sep):
+            raise ValueError(
+                f"The path {line} of {files_from} is outside of the sources"
+            )
+        for source_num in range(len(sources)):
+            paths.append([source_num, path, recursive])
+
+    return paths
+
+
+def add_checksums(sources: List[str], logger, file_list: List[FileEntry]):
+    """
+    Add the checksum of the files of a file list.
+    :param sources: the sources of the file list
+    :param logger: logger to log to
+    :param file_list: the file list
+    :return:
+    """
+    logger.debug("Calculating checksums...")
+    files = [info for info in file_list if info.type == FileType.FILE.value]
+    paths = [
+        (
+            os.path.join(sources[info.source], info.path)
+            if info.path != ""
+            else sources[info.source]
+        )
+        for info in files
+    ]
+    # hashlib releases the GIL while hashing, so the files are hashed on all the cores
+    with ThreadPoolExecutor() as executor:
+        for info, digest in zip(files, executor.map(file_checksum, paths)):
+            info.checksum = digest
+
+
 def humanize_size(size: int):
     """
     Humanize a size in bytes.
@@ -186,7 +711,23 @@ def humanize_size(size: int):
     return size
 
 
-def print_file_list(sources: List[str], logger, file_list: List[dict]):
+def listed_path(sources: List[str], file: FileEntry) -> str:
+    """
+    Get the path of an entry of a file list from the root of the transfer, as it is listed.
+    :param sources: The sources of the file list.
+    :param file: The entry.
+    :return: The path.
+    """
+    file_name = file.path
+
+    if file_name != "" and not sources[file.source].endswith("/"):
+        # The file is in a subdirectory, in recursive mode
+        file_name = os.path.join(os.path.basename(sources[file.source]), file_name)
+
+    return file_name if file_name != "" else os.path.basename(sources[file.source])
+
+
+def print_file_list(sources: List[str], logger, file_list: List[FileEntry]):
     """
     Print a file list.
     :param file_list:  The file list to print.
@@ -197,45 +738,77 @@ def print_file_list(sources: List[str], logger, file_list: List[dict]):
     # Calculate max length of size to align columns
     max_size_length = 0
     for file in file_list:
-        size = humanize_size(file["size"])
+        size = humanize_size(file.size)
         if len(size) > max_size_length:
             max_size_length = len(size)
 
     # Print like ls -l
     for file in file_list:
         # Generate permission string from permission int
-        file["permissions"] = str(file["permissions"])[-3:]
+        permissions = str(file.permissions)[-3:]
         permission_string = ""
         for i in range(3):
-            permission_string += "r" if int(file["permissions"][i]) & 4 else "-"
-            permission_string += "w" if int(file["permissions"][i]) & 2 else "-"
-            permission_string += "x" if int(file["permissions"][i]) & 1 else "-"
+            permission_string += "r" if int(permissions[i]) & 4 else "-"
+            permission_string += "w" if int(permissions[i]) & 2 else "-"
+            permission_string += "x" if int(permissions[i]) & 1 else "-"
 
-        if file["type"] == FileType.DIRECTORY.value:
+        if file.type == FileType.DIRECTORY.value:
             permission_string = "d" + permission_string
-        elif file["type"] == FileType.FILE.value:
+        elif file.type == FileType.FILE.value:
             permission_string = "-" + permission_string
 
-        size = humanize_size(file["size"])
+        size = humanize_size(file.size)
 
-        time = file["mtime"]
+        time = file.mtime
         time = strftime("%b %d %H:%M", localtime(time))
 
         # Make so evertyhing is aligned
         size = size.rjust(max_size_length)
 
-        file_name = file["path"]
+        logger.log(f"{permission_string} {size} {time} {listed_path(sources, file)}")
 
-        if file_name != "" and not sources[file["source"]].endswith("/"):
-            # The file is in a subdirectory, in recursive mode
-            file_name = os.path.join(
-                os.path.basename(sources[file["source"]]), file_name
-            )
+    logger.log(f"Total files: {len(file_list)}")
 
-        full_path = (
-            file_name if file_name != "" else os.path.basename(sources[file["source"]])
-        )
 
-        logger.log(f"{permission_string} {size} {time} {full_path}")
+def format_file_entry(sources: List[str], file: FileEntry) -> str:
+    """
+    Format an entry of a file list with fixed width columns, like rsync.
+    :param sources: The sources of the file list.
+    :param file: The entry.
+    :return: The mode, size, modification time and path of the entry.
+    """
+    time = strftime("%Y/%m/%d %H:%M:%S", localtime(file.mtime))
+    return (
+        f"{stat.filemode(file.permissions)} {file.size:>15,} {time} "
+        f"{listed_path(sources, file)}"
+    )
 
-    logger.log(f"Total files: {len(file_list)}")
+
+def stream_file_list(
+    sources: List[str], file_list: Iterable[FileEntry], list_format: str, output=None
+) -> int:
+    """
+    Print the entries of a file list as they are scanned or received, without keeping them in memory.
+    :param sources: The sources of the file list.
+    :param file_list: The entries to print.
+    :param list_format: "fixed" for lines with fixed width columns, "null" for the same records ended by a NUL.
+    :param output: The file to print to, the standard output by default.
+    :return: The amount of entries printed.
+    """
+    output = output if output is not None else sys.stdout
+    end = "\0" if list_format == "null" else "\n"
+
+    count = 0
+    lines = []
+    for file in file_list:
+        lines.append(format_file_entry(sources, file) + end)
+        count += 1
+
+        # The entries are written by blocks
+        if len(lines) == LIST_BUFFER_ENTRIES:
+            output.write("".join(lines))
+            lines = []
+
+    output.write("".join(lines))
+    output.flush()
+    return count
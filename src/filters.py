@@ -0,0 +1,162 @@
+#   Copyright (c) 2023, TriForMine. (https://triformine.dev) and samsoucoupe All rights reserved.
+#  #
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#  #
+#        http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import argparse
+import os
+import re
+from argparse import Namespace
+from typing import List, Optional, Tuple
+
+INCLUDE = "+"
+EXCLUDE = "-"
+
+
+def parse_filter_rule(rule: str) -> Tuple[str, str]:
+    """
+    Parse a filter rule, like "- *.o" or "include /src/".
+    :param rule: The rule.
+    :return: The (action, pattern) of the rule.
+    """
+    name, _, pattern = rule.strip().partition(" ")
+    actions = {"+": INCLUDE, "include": INCLUDE, "-": EXCLUDE, "exclude": EXCLUDE}
+    if name not in actions or not pattern:
+        raise argparse.ArgumentTypeError(f"invalid filter rule: {rule}")
+
+    return actions[name], pattern
+
+
+def translate_pattern(pattern: str) -> Tuple[str, bool]:
+    """
+    Translate a filter pattern into a regular expression matching the paths relative to the root of the transfer.
+    Like rsync, a pattern starting with a / is anchored to the root of the transfer, a pattern ending with a /
+    only matches directories, * and ? don't match slashes, ** matches anything, and a trailing /*** also
+    matches the directory itself.
+    A pattern without slashes is matched against the last component of the path.
+    :param pattern: The pattern.
+    :return: The regular expression, and whether the pattern only matches directories.
+    """
+    directory_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+
+    anchored = pattern.startswith("/")
+    pattern = pattern.lstrip("/")
+
+    suffix = ""
+    if pattern.endswith("/***"):
+        pattern = pattern[:-4]
+        suffix = "(?:/.*)?"
+
+    expression = ""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**", i):
+            expression += ".*"
+            i += 2
+            continue
+
+        if c == "*":
+            expression += "[^/]*"
+        elif c == "?":
+            expression += "[^/]"
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            expression += re.escape(pattern[i])
+        elif c == "[":
+            # A ] right after the opening bracket is part of the class
+            end = pattern.find("]", i + 2)
+            if end < 0:
+                expression += re.escape(c)
+            else:
+                content = pattern[i + 1 : end]
+                if content.startswith("!"):
+                    content = "^" + content[1:]
+                expression += "[" + content.replace("\\", "\\\\") + "]"
+                i = end
+        else:
+            expression += re.escape(c)
+        i += 1
+
+    if not anchored:
+        # Unanchored patterns can match from the start of any component
+        expression = "(?:.*/)?" + expression
+
+    return expression + suffix, directory_only
+
+
+class FilterRules:
+    rules: List[Tuple[str, str]]
+
+    def __init__(self, rules: List[Tuple[str, str]]):
+        """
+        Compile include and exclude rules, the first rule matching a path decides if it is excluded.
+        The rules are compiled into one regular expression for the files and one for the directories,
+        with a group for each rule to know which one matched first.
+        :param rules: The (action, pattern) of the rules, in order.
+        """
+        self.rules = rules
+
+        file_rules = []
+        directory_rules = []
+        for i, (_, pattern) in enumerate(rules):
+            expression, directory_only = translate_pattern(pattern)
+            directory_rules.append(f"(?P<r{i}>{expression})")
+            if not directory_only:
+                file_rules.append(f"(?P<r{i}>{expression})")
+
+        self.file_expression = re.compile("|".join(file_rules) or "(?!)", re.DOTALL)
+        self.directory_expression = re.compile(
+            "|".join(directory_rules) or "(?!)", re.DOTALL
+        )
+
+    def excluded(self, path: str, is_dir: bool) -> bool:
+        """
+        Check if a path is excluded by the rules.
+        :param path: The path, relative to the root of the transfer.
+        :param is_dir: Whether the path is a directory.
+        :return: True if the first matching rule is an exclude rule.
+        """
+        expression = self.directory_expression if is_dir else self.file_expression
+        match = expression.fullmatch(path.replace(os.sep, "/"))
+        if match is None:
+            return False
+
+        return self.rules[int(match.lastgroup[1:])][0] == EXCLUDE
+
+    def excluded_path(self, path: str, is_dir: bool) -> bool:
+        """
+        Check if a path or one of its parent directories is excluded by the rules.
+        :param path: The path, relative to the root of the transfer.
+        :param is_dir: Whether the path is a directory.
+        :return: True if the path is excluded.
+        """
+        parent = os.path.dirname(path)
+        while parent:
+            if self.excluded(parent, True):
+                return True
+            parent = os.path.dirname(parent)
+
+        return self.excluded(path, is_dir)
+
+
+def filter_rules_from_args(args: Namespace) -> Optional[FilterRules]:
+    """
+    Compile the rules given with the --include, --exclude and --filter options.
+    :param args: The arguments.
+    :return: The rules, or None if there are none.
+    """
+    if not args.filters:
+        return None
+
+    return FilterRules(args.filters)
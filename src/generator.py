@@ -11,13 +11,44 @@
 #    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
+import itertools
+import math
 import os
+import select
+import statistics
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from os import path
-from typing import List, Tuple
+from typing import Iterator, List, Optional, Tuple
 
 from src.checksum import Checksum
-from src.filelist import FileType
-from src.message import send, MESSAGE_TAG, MessageMethod
+from src.filelist import FileEntry, FileType, prefix_checksum
+from src.filters import filter_rules_from_args
+from src.merkle import MerkleTree, TREE_FANOUT, TREE_LEAF_BLOCKS
+from src.message import send, recv, MESSAGE_TAG, MessageMethod
+from src.plan import new_transfer_plan, PROBE_SIZE, PROBE_SAMPLES
+
+# Amount of threads calculating the signatures of the modified files
+SIGNATURE_THREADS = 4
+# Amount of signatures calculated ahead of the requests being sent
+SIGNATURE_WINDOW = 16
+# Files up to this size are sent in bundles with --bundle
+BUNDLE_FILE_SIZE = 64 * 1024
+# Maximum size of the data of a bundle
+BUNDLE_SIZE = 1024 * 1024
+# Maximum amount of files in a bundle
+BUNDLE_FILES = 1000
+
+
+def tree_block_size(size: int) -> int:
+    """
+    Get the size of the blocks of the hash tree of a file, the square root of its size rounded up to a multiple of 8,
+    between 700 bytes and 131 kB. The blocks of the checksums sent without a tree keep the size of the baseline formula.
+    :param size: The size of the file
+    :return: The size of the blocks
+    """
+    return min(max(-(-math.isqrt(size) // 8) * 8, 700), 131072)
 
 
 class Generator:
@@ -26,21 +57,122 @@ class Generator:
         write_server: MessageMethod,
         source,
         destination,
-        source_list: List[dict],
-        destination_list: List[dict],
+        source_list: List[FileEntry],
+        destination_list: List[FileEntry],
         logger,
         args,
+        read_server: Optional[MessageMethod] = None,
     ):
-        # Sort source and destination lists with dict.path
-        self.source_list = sorted(source_list, key=lambda x: x["path"])
-        self.source_path_list = [x["path"] for x in self.source_list]
-        self.destination_list = sorted(destination_list, key=lambda x: x["path"])
-        self.destination_path_list = [x["path"] for x in self.destination_list]
+        # Sort source and destination lists by path
+        self.source_list = sorted(source_list, key=lambda x: x.path)
+        self.destination_list = sorted(destination_list, key=lambda x: x.path)
         self.source = source
         self.destination = destination
+
+        # The paths are computed once, and the destination entries are found by path,
+        # so that the lists are compared in linear time
+        self.transfer_paths = [
+            self.get_transfer_path(file_info) for file_info in self.source_list
+        ]
+        self.destination_paths = [
+            self.get_destination_path(file) for file in self.transfer_paths
+        ]
+        self.destination_index = {}
+        for file_info in self.destination_list:
+            self.destination_index.setdefault(file_info.path, file_info)
+
         self.write_server = write_server
+        self.read_server = read_server
         self.logger = logger
         self.args = args
+        self.filter_rules = filter_rules_from_args(args)
+
+        # Order in which the files are asked
+        self.schedule = self.get_schedule()
+
+        # Files compared with a hash tree, waiting for the client to send their differences
+        self.trees = {}
+
+        # Files that grew, waiting for the client to check that their start did not change
+        self.appends = {}
+
+        # Modified files waiting for the client to estimate their delta, in a dry run
+        self.estimates = set()
+        self.literal_bytes = 0
+        self.matched_bytes = 0
+
+    def get_transfer_path(self, file_info: FileEntry) -> str:
+        """
+        Returns the path of a source entry from the root of the transfer.
+        :param file_info: The source entry
+        :return: The path, which contains the source directory itself if it has no trailing slash
+        """
+
+        source = self.source[file_info.source]
+        if file_info.path == "":
+            return path.basename(source)
+
+        if not source.endswith("/"):
+            # The file is in a subdirectory, in recursive mode
+            return path.join(path.basename(source), file_info.path)
+
+        return file_info.path
+
+    def get_destination_path(self, file: str) -> str:
+        """
+        Returns the path of the destination entry of a file.
+        :param file: The path of the file from the root of the transfer
+        :return: The path of the entry in the destination list
+        """
+
+        if not self.destination.endswith("/") and file != path.basename(
+            self.destination
+        ):
+            # The destination is the target itself
+            return ""
+
+        return file
+
+    def get_schedule(self) -> List[int]:
+        """
+        Returns the order in which the files of the source list are asked.
+        By path, the files of a directory are asked together. By inode, which is close to the order of the data
+        on the disk for most filesystems, the reads of the sender are mostly sequential. By extent, the files are
+        asked in the order of their first block on the disk, the files without a known extent coming last by inode.
+        The sort is stable, so the files with the same key stay in the order of their path.
+        :return: The indexes of the entries of the source list
+        """
+
+        indexes = range(len(self.source_list))
+        if self.args.order == "inode":
+            return sorted(
+                indexes,
+                key=lambda i: (
+                    self.source_list[i].source,
+                    self.source_list[i].inode or 0,
+                ),
+            )
+        if self.args.order == "extent":
+            return sorted(
+                indexes,
+                key=lambda i: (
+                    self.source_list[i].source,
+                    self.source_list[i].extent is None,
+                    (
+                        self.source_list[i].extent
+                        if self.source_list[i].extent is not None
+                        else self.source_list[i].inode or 0
+                    ),
+                ),
+            )
+        if self.args.order == "size-asc":
+            return sorted(indexes, key=lambda i: self.source_list[i].size or 0)
+        if self.args.order == "size-desc":
+            return sorted(
+                indexes, key=lambda i: self.source_list[i].size or 0, reverse=True
+            )
+
+        return list(indexes)
 
     def get_missing_files(self) -> Tuple[List[str], List[int]]:
         """
@@ -51,28 +183,22 @@ class Generator:
         files = []
         sources = []
 
-        for file_info in self.source_list:
-            file = file_info["path"]
-            file = (
-                file if file != "" else path.basename(self.source[file_info["source"]])
-            )
+        for i in self.schedule:
+            file_info = self.source_list[i]
+            file = self.destination_paths[i]
 
-            if (
-                file != ""
-                and not self.source[file_info["source"]].endswith("/")
-                and file != path.basename(self.source[file_info["source"]])
-            ):
-                # The file is in a subdirectory, in recursive mode
-                file = path.join(path.basename(self.source[file_info["source"]]), file)
+            # Hard links are created by the receiver once the file they link to is there
+            if file_info.hard_link is not None:
+                continue
 
-            if not self.destination.endswith("/") and file != path.basename(
-                self.destination
+            # A directory replacing a file is created in its place
+            destination_info = self.destination_index.get(file)
+            if destination_info is None or (
+                file_info.type == FileType.DIRECTORY.value
+                and destination_info.type != FileType.DIRECTORY.value
             ):
-                file = ""
-
-            if file not in self.destination_path_list:
-                files.append(file_info["path"])
-                sources.append(file_info["source"])
+                files.append(file_info.path)
+                sources.append(file_info.source)
 
         return files, sources
 
@@ -82,177 +208,443 @@ class Generator:
         :return: List of extra files
         """
 
+        destination_name = path.basename(self.destination)
+        if (
+            not self.destination.endswith("/")
+            and "" in self.destination_index
+            and any(file != destination_name for file in self.transfer_paths)
+        ):
+            # The sources are copied into the destination itself
+            return []
+
+        transfer_paths = set(self.transfer_paths)
         files = []
 
         for file_info in self.destination_list:
-            file = file_info["path"]
-            file = file if file != "" else path.basename(self.destination)
-
-            found = False
-            for source in self.source_list:
-                source_file = source["path"]
-                source_file = (
-                    source_file
-                    if source_file != ""
-                    else path.basename(self.source[source["source"]])
-                )
-
-                if (
-                    source_file != ""
-                    and not self.source[source["source"]].endswith("/")
-                    and source_file != path.basename(self.source[source["source"]])
-                ):
-                    # The file is in a subdirectory, in recursive mode
-                    source_file = path.join(
-                        path.basename(self.source[source["source"]]), source_file
-                    )
-
-                if not self.destination.endswith("/") and source_file != path.basename(
-                    self.destination
-                ):
-                    if "" in self.destination_path_list:
-                        found = True
+            file = file_info.path
+            file = file if file != "" else destination_name
 
-                    continue
+            # The excluded files are protected from the deletion
+            if self.filter_rules is not None and self.filter_rules.excluded_path(
+                file, file_info.type == FileType.DIRECTORY.value
+            ):
+                continue
 
-                if source_file == file:
-                    found = True
-                    break
-            if not found:
-                files.append(file_info["path"])
+            if file not in transfer_paths:
+                files.append(file_info.path)
 
         return files
 
-    def get_modified_files(
-        self,
-    ) -> Tuple[List[str], List[int], List[List[int]], List[int]]:
+    def get_modified_requests(self) -> List[list]:
         """
-        Returns a list of files that are in both the source and destination lists, but have different checksums.
-        :return: List of modified files
+        Returns the requests of the files that are in both the source and destination lists, but are different.
+        The signatures of the destination files are not calculated, see get_signature.
+        :return: List of [path, source, destination path, amount of blocks, signature], the signature being
+        [checksums, strong checksums, total length] when it is known without reading the destination file
         """
 
-        modified_files = []
-        sources = []
-        checksums = []
-        total_lengths = []
-
-        for file_info in self.source_list:
-            file = file_info["path"]
-            file = (
-                file if file != "" else path.basename(self.source[file_info["source"]])
-            )
-
-            if file != "" and not self.source[file_info["source"]].endswith("/"):
-                # The file is in a subdirectory, in recursive mode
-                file = path.join(path.basename(self.source[file_info["source"]]), file)
+        requests = []
 
-            if not self.destination.endswith("/") and file != path.basename(
-                self.destination
-            ):
-                file = ""
+        for i in self.schedule:
+            file_info = self.source_list[i]
+            file = self.destination_paths[i]
 
             # Check if file is in destination list
-            if file in self.destination_path_list:
-                # Skip directories
-                if file_info["type"] == FileType.DIRECTORY.value:
+            destination_info = self.destination_index.get(file)
+            if destination_info is not None:
+                # Skip directories and hard links
+                if (
+                    file_info.type == FileType.DIRECTORY.value
+                    or file_info.hard_link is not None
+                ):
                     continue
 
-                destination_index = self.destination_path_list.index(file)
-                destination_info = self.destination_list[destination_index]
                 is_modified = False
 
                 # Check if file is modified
                 if self.args.checksum:
-                    if file_info["checksum"] != destination_info["checksum"]:
+                    if file_info.size != destination_info.size:
+                        is_modified = True
+                        self.logger.debug(
+                            f"File {file} has different size. (Source: {file_info.size}, Destination: {destination_info.size})"
+                        )
+                    elif file_info.checksum != destination_info.checksum:
                         self.logger.debug(
-                            f"File {file} has different checksum. (Source: {file_info['checksum']}, Destination: {destination_info['checksum']})"
+                            f"File {file} has different checksum. (Source: {file_info.checksum}, Destination: {destination_info.checksum})"
                         )
                         is_modified = True
                 else:
-                    if file_info["size"] != destination_info["size"]:
+                    if file_info.size != destination_info.size:
                         is_modified = True
                         self.logger.debug(
-                            f"File {file} has different size. (Source: {file_info['size']}, Destination: {destination_info['size']})"
+                            f"File {file} has different size. (Source: {file_info.size}, Destination: {destination_info.size})"
                         )
                     elif not self.args.ignore_times and (
-                        (
-                            self.args.update
-                            and file_info["mtime"] > destination_info["mtime"]
-                        )
+                        (self.args.update and file_info.mtime > destination_info.mtime)
                         or (
                             not self.args.update
-                            and file_info["mtime"] != destination_info["mtime"]
+                            and file_info.mtime != destination_info.mtime
                         )
                     ):
                         is_modified = True
                         self.logger.debug(
-                            f"File {file} has different modification time. (Source: {file_info['mtime']}, Destination: {destination_info['mtime']})"
+                            f"File {file} has different modification time. (Source: {file_info.mtime}, Destination: {destination_info.mtime})"
                         )
 
                 if is_modified:
-                    modified_files.append(file_info["path"])
-                    sources.append(file_info["source"])
-                    if destination_info["path"] == "":
+                    if destination_info.path == "":
                         destination_path = self.destination
                     else:
                         destination_path = path.join(
-                            self.destination, destination_info["path"]
+                            self.destination, destination_info.path
                         )
 
                     if not os.path.isdir(destination_path):
                         # Amount of blocks calculated from the total file size
                         # Block size is calculated like the real rsync
                         block_size = 700
-                        if file_info["size"] > 490000:
+                        if file_info.size > 490000:
                             # Square root of the file size (rounded up to a multiple of 8)
                             block_size = int(
-                                2 ** ((file_info["size"] - 1).bit_length() + 1) ** 0.5
+                                2 ** ((file_info.size - 1).bit_length() + 1) ** 0.5
                             )
 
                         # Maximum blocks size 131kB
                         if block_size > 131072:
                             block_size = 131072
 
-                        amount_of_blocks = int(file_info["size"] / block_size)
+                        amount_of_blocks = int(file_info.size / block_size)
 
-                        if file_info["size"] % block_size != 0:
+                        if file_info.size % block_size != 0:
                             amount_of_blocks += 1
 
                         if amount_of_blocks == 0:
                             amount_of_blocks = 1
 
-                        # Calculate checksums
-                        checksum = Checksum(destination_path, divide=amount_of_blocks)
-                        checksums.append(checksum.checksums)
-                        total_lengths.append(checksum.totalLength)
+                        # Files that grew are only checked to start with the destination file,
+                        # the checksums are only calculated if they don't
+                        destination_size = os.path.getsize(destination_path)
+                        if (
+                            self.args.append_verify
+                            and self.read_server is not None
+                            and 0 < destination_size < file_info.size
+                        ):
+                            self.appends[(file_info.source, file_info.path)] = (
+                                destination_path,
+                                amount_of_blocks,
+                            )
+                            signature = [None, None, destination_size]
+                        # Big files are compared with a hash tree first, the checksums are only
+                        # calculated for the parts that are different
+                        elif (
+                            self.args.tree_signatures
+                            and self.read_server is not None
+                            and destination_size
+                            >= tree_block_size(file_info.size)
+                            * TREE_LEAF_BLOCKS
+                            * TREE_FANOUT
+                        ):
+                            self.trees[(file_info.source, file_info.path)] = (
+                                destination_path,
+                                tree_block_size(file_info.size),
+                                None,
+                            )
+                            signature = [None, None, destination_size]
+                        else:
+                            signature = None
                     else:
-                        checksums.append([])
-                        total_lengths.append(0)
+                        amount_of_blocks = 0
+                        signature = [[], [], 0]
 
-        return modified_files, sources, checksums, total_lengths
+                    requests.append(
+                        [
+                            file_info.path,
+                            file_info.source,
+                            destination_path,
+                            amount_of_blocks,
+                            signature,
+                        ]
+                    )
+
+        return requests
+
+    @staticmethod
+    def get_signature(request: list) -> list:
+        """
+        Returns the signature of the destination file of a request.
+        :param request: The request, from get_modified_requests
+        :return: [checksums, strong checksums, total length]
+        """
+
+        _, _, destination_path, amount_of_blocks, signature = request
+        if signature is not None:
+            return signature
+
+        # Calculate checksums
+        checksum = Checksum(destination_path, divide=amount_of_blocks)
+        return [checksum.checksums, checksum.strongChecksums, checksum.totalLength]
+
+    def get_signatures(
+        self, executor: ThreadPoolExecutor, requests: List[list]
+    ) -> Iterator[Tuple[list, list]]:
+        """
+        Calculates the signatures of the requests in the background, a few requests ahead of the ones being sent.
+        The first signatures are calculated as soon as this method is called.
+        :param executor: The threads calculating the signatures
+        :param requests: The requests, from get_modified_requests
+        :return: A generator of the requests and their signatures, in the order of the requests
+        """
+
+        requests = iter(requests)
+        pending = deque(
+            (request, executor.submit(self.get_signature, request))
+            for request in itertools.islice(requests, SIGNATURE_WINDOW)
+        )
+
+        def results():
+            while pending:
+                request, future = pending.popleft()
+                for next_request in itertools.islice(requests, 1):
+                    pending.append(
+                        (
+                            next_request,
+                            executor.submit(self.get_signature, next_request),
+                        )
+                    )
+                yield request, future.result()
+
+        return results()
 
-    def ask_file(self, path: str, source: int, checksums: List[int], total_length: int):
+    def get_modified_files(
+        self,
+    ) -> Tuple[List[str], List[int], List[List[int]], List[List[bytes]], List[int]]:
+        """
+        Returns a list of files that are in both the source and destination lists, but have different checksums.
+        :return: List of modified files
+        """
+
+        modified_files = []
+        sources = []
+        checksums = []
+        strong_checksums = []
+        total_lengths = []
+
+        for request in self.get_modified_requests():
+            checksum, strong_checksum, total_length = self.get_signature(request)
+            modified_files.append(request[0])
+            sources.append(request[1])
+            checksums.append(checksum)
+            strong_checksums.append(strong_checksum)
+            total_lengths.append(total_length)
+
+        return modified_files, sources, checksums, strong_checksums, total_lengths
+
+    def ask_file(
+        self,
+        path: str,
+        source: int,
+        checksums: Optional[List[int]],
+        strong_checksums: Optional[List[bytes]],
+        total_length: int,
+    ):
         """
         Asks the client to send a file.
         :param path: Path of the file
         :param source: Source of the file
-        :param checksums: Checksums of the file
+        :param checksums: Checksums of the file, None to check that the file grew or to compare it with a hash tree
+        :param strong_checksums: Strong checksums of the file
         :param total_length: Total length of the file
         :return: None
         """
 
+        if (source, path) in self.appends:
+            self.ask_file_append(path, source, total_length)
+            return
+
+        if checksums is None:
+            self.ask_file_tree(path, source)
+            return
+
         send(
             self.write_server,
             MESSAGE_TAG.ASK_FILE_DATA,
-            (path, source, checksums, total_length),
+            (path, source, checksums, strong_checksums, total_length),
+            timeout=self.args.timeout,
+        )
+
+    def ask_file_append(self, path: str, source: int, total_length: int):
+        """
+        Asks the client to check that a file starts with the destination file, and to send the rest of it.
+        :param path: Path of the file
+        :param source: Source of the file
+        :param total_length: Total length of the destination file
+        :return: None
+        """
+        destination_path, _ = self.appends[(source, path)]
+
+        send(
+            self.write_server,
+            MESSAGE_TAG.ASK_FILE_APPEND,
+            (
+                path,
+                source,
+                total_length,
+                prefix_checksum(destination_path, total_length),
+            ),
+            timeout=self.args.timeout,
+        )
+
+    def handle_append_verify(self, path: str, source: int, verified: bool):
+        """
+        Handles the check of a file that grew.
+        If the start of the file changed, the file is asked with its checksums like any other modified file.
+        :param path: Path of the file
+        :param source: Source of the file
+        :param verified: Whether the file starts with the destination file
+        :return: None
+        """
+        destination_path, amount_of_blocks = self.appends.pop((source, path))
+        if verified:
+            return
+
+        self.logger.debug(f"File {path} did not only grow, asking for its delta")
+        checksum = Checksum(destination_path, divide=amount_of_blocks)
+        self.ask_file(
+            path,
+            source,
+            checksum.checksums,
+            checksum.strongChecksums,
+            checksum.totalLength,
+        )
+
+    def ask_file_tree(self, path: str, source: int):
+        """
+        Asks the client to compare the top of the hash tree of a file.
+        :param path: Path of the file
+        :param source: Source of the file
+        :return: None
+        """
+        (destination_path, block_size, _) = self.trees[(source, path)]
+        tree = MerkleTree(destination_path, block_size * TREE_LEAF_BLOCKS)
+        self.trees[(source, path)] = (destination_path, block_size, tree)
+
+        send(
+            self.write_server,
+            MESSAGE_TAG.ASK_FILE_TREE,
+            (
+                path,
+                source,
+                tree.leafSize,
+                tree.depth,
+                tree.depth,
+                [[i, tree.node(tree.depth, i)] for i in range(tree.count(tree.depth))],
+            ),
             timeout=self.args.timeout,
         )
 
+    def handle_tree_difference(
+        self, path: str, source: int, level: int, nodes: List[int]
+    ):
+        """
+        Go down the hash tree of a file into the nodes the client found different.
+        Once the leaves are reached, ask for the data of the different leaves.
+        :param path: Path of the file
+        :param source: Source of the file
+        :param level: Level of the different nodes
+        :param nodes: Indexes of the different nodes
+        :return: None
+        """
+        (destination_path, block_size, tree) = self.trees[(source, path)]
+
+        if level > 0 and nodes:
+            send(
+                self.write_server,
+                MESSAGE_TAG.ASK_FILE_TREE,
+                (
+                    path,
+                    source,
+                    tree.leafSize,
+                    tree.depth,
+                    level - 1,
+                    [
+                        [child, tree.node(level - 1, child)]
+                        for node in nodes
+                        for child in range(node * tree.fanout, (node + 1) * tree.fanout)
+                    ],
+                ),
+                timeout=self.args.timeout,
+            )
+            return
+
+        del self.trees[(source, path)]
+
+        # Block checksums of the leaves that are different
+        leaves = []
+        for leaf in nodes if level == 0 else []:
+            checksum = Checksum(
+                destination_path,
+                divide=max(1, -(-tree.leafSize // block_size)),
+                offset=leaf * tree.leafSize,
+                length=tree.leafSize,
+            )
+            leaves.append(
+                [
+                    leaf,
+                    checksum.checksums,
+                    checksum.strongChecksums,
+                    checksum.totalLength,
+                ]
+            )
+
+        send(
+            self.write_server,
+            MESSAGE_TAG.ASK_FILE_TREE_DATA,
+            (
+                path,
+                source,
+                tree.leafSize,
+                os.path.getsize(destination_path),
+                leaves,
+            ),
+            timeout=self.args.timeout,
+        )
+
+    def handle_answers(self, wait: bool = True):
+        """
+        Handles the hash tree differences and the checks of the files that grew sent back by the client.
+        :param wait: Wait until all the answers are received, otherwise only handle the pending answers
+        :return: None
+        """
+        while self.trees or self.appends or self.estimates:
+            if not wait:
+                r, _, _ = select.select([self.read_server.fd], [], [], 0)
+                if not r:
+                    return
+
+            tag, v = recv(self.read_server, timeout=self.args.timeout)
+
+            if tag == MESSAGE_TAG.FILE_TREE_DIFFERENCE:
+                (file_path, source, level, nodes) = v
+                self.handle_tree_difference(file_path, source, level, nodes)
+            elif tag == MESSAGE_TAG.FILE_APPEND_VERIFY:
+                (file_path, source, verified) = v
+                self.handle_append_verify(file_path, source, verified)
+            elif tag == MESSAGE_TAG.FILE_ESTIMATE:
+                (file_path, source, literal_bytes, matched_bytes) = v
+                self.estimates.discard((source, file_path))
+                self.literal_bytes += literal_bytes
+                self.matched_bytes += matched_bytes
+            elif tag == MESSAGE_TAG.END:
+                break
+            else:
+                raise Exception(f"Unknown message tag {tag}")
+
     def ask_files(
         self,
         files: List[str],
         sources: List[int],
         checksums: List[List[int]],
+        strong_checksums: List[List[bytes]],
         total_lengths: List[int],
     ):
         """
@@ -260,60 +652,410 @@ class Generator:
         :param files: A list of paths
         :param sources: A list of sources
         :param checksums: A list of checksums
+        :param strong_checksums: A list of strong checksums
         :param total_lengths: A list of total lengths
         :return: None
         """
 
         for i in range(len(files)):
-            self.ask_file(files[i], sources[i], checksums[i], total_lengths[i])
+            self.ask_file(
+                files[i],
+                sources[i],
+                checksums[i],
+                strong_checksums[i],
+                total_lengths[i],
+            )
+
+            # Keep the hash tree comparisons and the checks of the files that grew going while asking for the other files
+            if self.trees or self.appends:
+                self.handle_answers(wait=False)
+
+    def get_bundles(
+        self,
+        missing_files: List[str],
+        files_sources: List[int],
+        modified_requests: List[list],
+    ) -> Tuple[List[List[list]], List[str], List[int], List[list]]:
+        """
+        Groups the small files to ask them a bundle at a time.
+        The small modified files are sent whole, their signatures are not calculated.
+        :param missing_files: The missing files, from get_missing_files
+        :param files_sources: The sources of the missing files
+        :param modified_requests: The requests of the modified files, from get_modified_requests
+        :return: The bundles of [path, source], and the missing files, their sources and the modified requests
+        that are not in a bundle
+        """
+
+        sizes = {
+            (file_info.source, file_info.path): file_info.size
+            for file_info in self.source_list
+            if file_info.type == FileType.FILE.value
+        }
+
+        def is_small(file: str, source: int) -> bool:
+            size = sizes.get((source, file))
+            return size is not None and size <= BUNDLE_FILE_SIZE
+
+        bundles = []
+        bundle = []
+        bundle_size = 0
+
+        def add(file: str, source: int):
+            nonlocal bundle, bundle_size
+
+            size = sizes[(source, file)]
+            if bundle and (
+                len(bundle) >= BUNDLE_FILES or bundle_size + size > BUNDLE_SIZE
+            ):
+                bundles.append(bundle)
+                bundle = []
+                bundle_size = 0
+
+            bundle.append([file, source])
+            bundle_size += size
+
+        remaining_files = []
+        remaining_sources = []
+        for file, source in zip(missing_files, files_sources):
+            if is_small(file, source):
+                add(file, source)
+            else:
+                remaining_files.append(file)
+                remaining_sources.append(source)
+
+        remaining_requests = []
+        for request in modified_requests:
+            # Files that grew, files compared with a hash tree and files replacing a directory keep their request
+            if request[4] is None and is_small(request[0], request[1]):
+                add(request[0], request[1])
+            else:
+                remaining_requests.append(request)
+
+        if bundle:
+            bundles.append(bundle)
+
+        return bundles, remaining_files, remaining_sources, remaining_requests
+
+    def measure_throughput(self) -> Optional[float]:
+        """
+        Measures the throughput of the link from the client, by asking for some data.
+        :return: The throughput in bytes per second, None if it could not be measured
+        """
+        if self.read_server is None:
+            return None
+
+        # The first round trip also pays the latency of the link, the median of several is steadier
+        samples = []
+        for _ in range(PROBE_SAMPLES):
+            start = time.monotonic()
+            send(
+                self.write_server,
+                MESSAGE_TAG.ASK_LINK_PROBE,
+                PROBE_SIZE,
+                timeout=self.args.timeout,
+            )
+            _, data = recv(self.read_server, timeout=self.args.timeout)
+            elapsed = time.monotonic() - start
+
+            if elapsed > 0:
+                samples.append(len(data) / elapsed)
+
+        return statistics.median(samples) if samples else None
+
+    def estimate_deltas(self, requests: List[list]) -> Tuple[int, int]:
+        """
+        Asks the client the amount of data of the modified files that would be sent, and reused from the destination.
+        :param requests: The requests, from get_modified_requests
+        :return: The literal and matched bytes
+        """
+        with ThreadPoolExecutor(max_workers=SIGNATURE_THREADS) as executor:
+            for request, signature in self.get_signatures(executor, requests):
+                checksums, strong_checksums, total_length = signature
+                self.estimates.add((request[1], request[0]))
+                send(
+                    self.write_server,
+                    MESSAGE_TAG.ASK_FILE_ESTIMATE,
+                    (
+                        request[0],
+                        request[1],
+                        checksums,
+                        strong_checksums,
+                        total_length,
+                    ),
+                    timeout=self.args.timeout,
+                )
+                self.handle_answers(wait=False)
+
+        self.handle_answers()
+        return self.literal_bytes, self.matched_bytes
+
+    def get_transfer_plan(self) -> dict:
+        """
+        Predicts the synchronization, without asking for any file.
+        With --stats, the client estimates the deltas of the modified files, otherwise they are counted whole.
+        :return: The transfer plan, see new_transfer_plan
+        """
+        plan = new_transfer_plan()
+
+        missing_files, files_sources = self.get_missing_files()
+        extra_files = self.get_extra_files()
+        modified_requests = self.get_modified_requests()
+
+        # The files that grew and the big files are compared like the other files
+        self.trees.clear()
+        self.appends.clear()
+
+        entries = {}
+        files = 0
+        for file_info in self.source_list:
+            entries[(file_info.source, file_info.path)] = file_info
+            if file_info.hard_link is not None:
+                plan["hard_links"] += 1
+            elif file_info.type == FileType.FILE.value:
+                files += 1
+                plan["total_bytes"] += file_info.size
+
+        for file, source in zip(missing_files, files_sources):
+            file_info = entries[(source, file)]
+            if file_info.type == FileType.DIRECTORY.value:
+                plan["new_directories"] += 1
+            else:
+                plan["new_files"] += 1
+                plan["literal_bytes"] += file_info.size
+
+        plan["modified_files"] = len(modified_requests)
+        plan["unchanged_files"] = files - plan["new_files"] - plan["modified_files"]
+        plan["extra_files"] = len(extra_files)
+        plan["delete"] = bool(self.args.delete)
+        plan["throughput"] = self.measure_throughput()
+
+        if self.args.stats and self.read_server is not None:
+            for request in modified_requests:
+                if request[4] is not None and request[4][0] is None:
+                    request[4] = None
+
+            literal_bytes, matched_bytes = self.estimate_deltas(modified_requests)
+            plan["literal_bytes"] += literal_bytes
+            plan["matched_bytes"] += matched_bytes
+            plan["deltas"] = True
+        else:
+            plan["literal_bytes"] += sum(
+                entries[(request[1], request[0])].size for request in modified_requests
+            )
+
+        return plan
+
+    def delete_extra_files(self, extra_files: List[str]):
+        """
+        Asks the receiver to delete the extra files, with --delete.
+        :param extra_files: The extra files, from get_extra_files
+        :return: None
+        """
+
+        if not extra_files:
+            self.logger.debug("No extra files.")
+            return
+
+        self.logger.debug("Extra files:")
+        if self.args.delete:
+            self.logger.debug(f"Deleting extra files {extra_files}...")
+            send(
+                self.write_server,
+                MESSAGE_TAG.DELETE_FILES,
+                extra_files,
+                timeout=self.args.timeout,
+            )
+        else:
+            self.logger.debug(f"Ignoring extra files {extra_files}...")
+
+    def get_directories_info(
+        self,
+        missing_files: List[str],
+        files_sources: List[int],
+        modified_requests: List[list],
+        extra_files: List[str],
+    ) -> List[list]:
+        """
+        Returns the existing directories whose info must be applied again by the receiver,
+        because it is different or because the entries inside them change.
+        The directories that are missing are created with their info by the receiver.
+        :param missing_files: The missing files, from get_missing_files
+        :param files_sources: The sources of the missing files
+        :param modified_requests: The requests of the modified files, from get_modified_requests
+        :param extra_files: The extra files, from get_extra_files
+        :return: List of [path, file info]
+        """
+
+        destination_paths = {
+            (file_info.source, file_info.path): file
+            for file_info, file in zip(self.source_list, self.destination_paths)
+        }
+
+        changed = [
+            destination_paths[(source, file)]
+            for file, source in zip(missing_files, files_sources)
+        ]
+        changed += [
+            destination_paths[(request[1], request[0])] for request in modified_requests
+        ]
+        for source, _, links in self.get_hard_links():
+            changed += [destination_paths[(source, link)] for link in links]
+        if self.args.delete:
+            changed += extra_files
+        touched = {path.dirname(file) for file in changed}
+
+        directories = []
+        for file_info, file in zip(self.source_list, self.destination_paths):
+            if file_info.type != FileType.DIRECTORY.value:
+                continue
+
+            destination_info = self.destination_index.get(file)
+            if destination_info is None:
+                continue
+
+            if (
+                file in touched
+                or destination_info.mtime != file_info.mtime
+                or (
+                    self.args.perms
+                    and destination_info.permissions != file_info.permissions
+                )
+            ):
+                directories.append([file_info.path, file_info])
+
+        return directories
+
+    def get_hard_links(self) -> List[List]:
+        """
+        Returns the files linked together in the source, grouped by the file they link to.
+        :return: List of [source, file, links]
+        """
+
+        groups = {}
+        for file_info in self.source_list:
+            if file_info.hard_link is not None:
+                groups.setdefault((file_info.source, file_info.hard_link), []).append(
+                    file_info.path
+                )
+
+        return [[source, file, links] for (source, file), links in groups.items()]
 
     def run(self):
         """
         Runs the generator.
         """
 
+        if self.args.dry_run:
+            # Nothing is asked in a dry run, only the plan of the synchronization is sent
+            send(
+                self.write_server,
+                MESSAGE_TAG.TRANSFER_PLAN,
+                self.get_transfer_plan(),
+                timeout=self.args.timeout,
+            )
+            self.finish()
+            return
+
         missing_files, files_sources = self.get_missing_files()
         extra_files = self.get_extra_files()
-        (
-            modified_files,
-            modified_sources,
-            checksums,
-            total_lengths,
-        ) = self.get_modified_files()
-
-        if missing_files:
-            self.logger.debug("Missing files:")
-            # Ask for missing files, -1 means ask for the whole file
-            self.ask_files(
+        modified_requests = self.get_modified_requests()
+        directories_info = self.get_directories_info(
+            missing_files, files_sources, modified_requests, extra_files
+        )
+
+        bundles = []
+        if self.args.bundle:
+            (
+                bundles,
                 missing_files,
                 files_sources,
-                [[] for _ in missing_files],
-                [-1 for _ in missing_files],
-            )
-        else:
-            self.logger.debug("No missing files.")
+                modified_requests,
+            ) = self.get_bundles(missing_files, files_sources, modified_requests)
+
+        # The signatures of the modified files are calculated in the background,
+        # while the missing files are asked, the threads are stopped even if asking fails
+        with ThreadPoolExecutor(max_workers=SIGNATURE_THREADS) as executor:
+            signatures = self.get_signatures(executor, modified_requests)
+
+            # Deleting first frees space for the files to transfer
+            if self.args.delete_timing == "before":
+                self.delete_extra_files(extra_files)
+
+            if missing_files:
+                self.logger.debug("Missing files:")
+                # Ask for missing files, -1 means ask for the whole file
+                self.ask_files(
+                    missing_files,
+                    files_sources,
+                    [[] for _ in missing_files],
+                    [[] for _ in missing_files],
+                    [-1 for _ in missing_files],
+                )
+            else:
+                self.logger.debug("No missing files.")
 
-        if extra_files:
-            self.logger.debug("Extra files:")
-            if self.args.delete:
-                self.logger.debug(f"Deleting extra files {extra_files}...")
+            for bundle in bundles:
+                self.logger.debug(f"Bundle of {len(bundle)} files")
                 send(
                     self.write_server,
-                    MESSAGE_TAG.DELETE_FILES,
-                    extra_files,
+                    MESSAGE_TAG.ASK_FILE_BUNDLE,
+                    bundle,
                     timeout=self.args.timeout,
                 )
+
+            if self.args.delete_timing == "during":
+                self.delete_extra_files(extra_files)
+
+            if modified_requests:
+                self.logger.debug("Modified files:")
+                # Each file is asked as soon as its signature is calculated
+                for request, signature in signatures:
+                    checksums, strong_checksums, total_length = signature
+                    self.ask_file(
+                        request[0],
+                        request[1],
+                        checksums,
+                        strong_checksums,
+                        total_length,
+                    )
+
+                    if self.trees or self.appends:
+                        self.handle_answers(wait=False)
             else:
-                self.logger.debug(f"Ignoring extra files {extra_files}...")
+                self.logger.debug("No modified files.")
 
-        else:
-            self.logger.debug("No extra files.")
+        self.handle_answers()
 
-        if modified_files:
-            self.logger.debug("Modified files:")
-            self.ask_files(modified_files, modified_sources, checksums, total_lengths)
-        else:
-            self.logger.debug("No modified files.")
+        # The links are created once all the files they link to are received
+        hard_links = self.get_hard_links()
+        if hard_links:
+            self.logger.debug(f"Hard links {hard_links}")
+            send(
+                self.write_server,
+                MESSAGE_TAG.HARD_LINKS,
+                hard_links,
+                timeout=self.args.timeout,
+            )
+
+        # The receiver deletes the files once it received all the other messages
+        if self.args.delete_timing == "after":
+            self.delete_extra_files(extra_files)
+
+        # The receiver applies the info of the directories once their entries are written
+        if directories_info:
+            send(
+                self.write_server,
+                MESSAGE_TAG.DIRECTORY_INFO,
+                directories_info,
+                timeout=self.args.timeout,
+            )
+
+        self.finish()
+
+    def finish(self):
+        """
+        Tells the client that all the files were asked.
+        """
 
         self.logger.info("Generator finished")
         send(
@@ -0,0 +1,119 @@
+#   Copyright (c) 2023, TriForMine. (https://triformine.dev) and samsoucoupe All rights reserved.
+#  #
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#  #
+#        http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import hashlib
+from typing import List, Optional
+
+# Number of children of each node of the tree
+TREE_FANOUT = 16
+# Number of blocks in a leaf of the tree
+TREE_LEAF_BLOCKS = 64
+
+
+class MerkleTree:
+    leafSize: int
+    depth: int
+    levels: List[List[bytes]]
+
+    def __init__(
+        self,
+        path: str,
+        leaf_size: int,
+        depth: Optional[int] = None,
+        fanout: int = TREE_FANOUT,
+    ):
+        """
+        Create a hash tree of a file.
+        The leaves are the hashes of fixed size ranges of the file, and each node of the upper levels
+        is the hash of the hashes of its children. Two files can be compared from the top of the tree,
+        only going down into the nodes that are different.
+        :param path:  The path to the file.
+        :param leaf_size:  The size of the range of the file covered by a leaf.
+        :param depth:  The level of the top of the tree, the smallest one with at most fanout nodes by default.
+        Both sides of a comparison must use the same depth.
+        :param fanout:  The number of children of each node.
+        """
+        self.leafSize = leaf_size
+        self.fanout = fanout
+        self.levels = [self.hash_leaves(path)]
+
+        if depth is None:
+            depth = 0
+            while len(self.levels[0]) > fanout ** (depth + 1):
+                depth += 1
+        self.depth = depth
+
+        for _ in range(depth):
+            children = self.levels[-1]
+            self.levels.append(
+                [
+                    hashlib.md5(b"".join(children[i : i + fanout])).digest()
+                    for i in range(0, len(children), fanout)
+                ]
+            )
+
+    def hash_leaves(self, path: str) -> List[bytes]:
+        """
+        Hash every leaf of a file.
+        :param path:  The path to the file.
+        :return:  The hashes of the leaves.
+        """
+        leaves = []
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(self.leafSize)
+                if not data:
+                    break
+                leaves.append(hashlib.md5(data).digest())
+
+        return leaves
+
+    def node(self, level: int, index: int) -> Optional[bytes]:
+        """
+        Get the hash of a node.
+        :param level:  The level of the node, 0 being the leaves.
+        :param index:  The index of the node in its level.
+        :return:  The hash, or None if the file is too small to have this node.
+        """
+        if index < len(self.levels[level]):
+            return self.levels[level][index]
+        return None
+
+    def count(self, level: int) -> int:
+        """
+        Get the amount of nodes in a level.
+        :param level:  The level, 0 being the leaves.
+        :return:  The amount of nodes.
+        """
+        return len(self.levels[level])
+
+    def get_differences(self, level: int, nodes: List[List]) -> List[int]:
+        """
+        Compare nodes of another tree with this tree.
+        :param level:  The level of the nodes.
+        :param nodes:  A list of [index, hash] of the other tree, the hash being None if the other file doesn't have it.
+        :return:  The indexes of the nodes of this tree that are different or missing in the other tree.
+        """
+        differences = [
+            index
+            for index, node in nodes
+            if self.node(level, index) is not None and self.node(level, index) != node
+        ]
+
+        if level == self.depth:
+            # The other tree only sends its own top nodes, the nodes after them are missing
+            sent = {index for index, _ in nodes}
+            differences += [i for i in range(self.count(level)) if i not in sent]
+
+        return sorted(differences)
@@ -21,10 +21,14 @@ from typing import Optional
 
 import cbor2
 
+from src.filelist import FileEntry
 from src.logger import Logger
 
 MAX_SIZE = 256
 
+# CBOR tag of the file list entries, sent as the list of their fields instead of a map
+FILE_ENTRY_CBOR_TAG = 40100
+
 
 # Message tags
 class MESSAGE_TAG(Enum):
@@ -36,10 +40,6 @@ class MESSAGE_TAG(Enum):
     ASK_FILE_DATA = 3
     # File data
     FILE_DATA = 4
-    # File data end
-    FILE_DATA_END = 5
-    # File data offset
-    FILE_DATA_OFFSET = 6
     # End of transmission
     END = 7
     # Generator finished
@@ -54,6 +54,44 @@ class MESSAGE_TAG(Enum):
     PING = 12
     # Pong
     PONG = 13
+    # File delta, instructions to rebuild a file from its basis
+    FILE_DELTA = 14
+    # Ask to compare the nodes of the hash tree of a file
+    ASK_FILE_TREE = 15
+    # Nodes of the hash tree of a file that are different
+    FILE_TREE_DIFFERENCE = 16
+    # Ask for the data of the different leaves of the hash tree of a file
+    ASK_FILE_TREE_DATA = 17
+    # Data extents of a sparse file
+    FILE_SPARSE = 18
+    # Ask to check that a file only grew since the destination version, and to send its new data
+    ASK_FILE_APPEND = 19
+    # Data appended to a file
+    FILE_APPEND = 20
+    # Result of the check of the destination version of a file, before its appended data
+    FILE_APPEND_VERIFY = 21
+    # Hard links to create, from the files linked together in the source
+    HARD_LINKS = 22
+    # File list of the paths changed since the last synchronization, in watch mode
+    FILE_LIST_UPDATE = 23
+    # Part of a file list sent as it is scanned, the last part being sent with FILE_LIST
+    FILE_LIST_PART = 24
+    # Ask for the data of several small files
+    ASK_FILE_BUNDLE = 25
+    # Data of several small files, with the info and the length of each file
+    FILE_BUNDLE = 26
+    # Ask for data to measure the throughput of the link, in a dry run
+    ASK_LINK_PROBE = 27
+    # Data to measure the throughput of the link
+    LINK_PROBE = 28
+    # Ask for the amount of literal and matched data of a modified file, in a dry run
+    ASK_FILE_ESTIMATE = 29
+    # Amount of literal and matched data of a modified file
+    FILE_ESTIMATE = 30
+    # Prediction of the synchronization made in a dry run
+    TRANSFER_PLAN = 31
+    # Info of the existing directories to apply once all the files are written
+    DIRECTORY_INFO = 32
 
     def __str__(self):
         return self.name.replace("_", " ").title()
@@ -67,6 +105,39 @@ class SOCKET_IDENTIFICATION(Enum):
         return self.name.replace("_", " ").title()
 
 
+def _encode_default(encoder: cbor2.CBOREncoder, value):
+    if isinstance(value, FileEntry):
+        encoder.encode(cbor2.CBORTag(FILE_ENTRY_CBOR_TAG, value.to_list()))
+    else:
+        raise cbor2.CBOREncodeTypeError(f"cannot serialize type {type(value)}")
+
+
+def _decode_tag(*args):
+    # The hook receives the decoder and the tag with cbor2 5, and the tag and its mutability with cbor2 6
+    tag = next(arg for arg in args if isinstance(arg, cbor2.CBORTag))
+    if tag.tag == FILE_ENTRY_CBOR_TAG:
+        return FileEntry.from_list(tag.value)
+    return tag
+
+
+def encode(v: object) -> bytes:
+    """
+    Encode the data of a message
+    :param v: The message data
+    :return: The encoded data
+    """
+    return cbor2.dumps(v, default=_encode_default)
+
+
+def decode(data: bytes) -> object:
+    """
+    Decode the data of a message
+    :param data: The encoded data
+    :return: The message data
+    """
+    return cbor2.loads(data, tag_hook=_decode_tag)
+
+
 def _timeout_handler(_signum, _frame):
     raise TimeoutError("Timeout reached.")
 
@@ -152,13 +223,44 @@ def send(
             (filename, file_info, start, end, whole_file, data) = v
             if compress_file:
                 data = zlib.compress(data, compress_level)
+        elif tag == MESSAGE_TAG.FILE_DELTA and compress_file:
+            # Only the literal data of the delta is compressed
+            (filename, file_info, delta) = v
+            delta = [
+                zlib.compress(op, compress_level) if isinstance(op, bytes) else op
+                for op in delta
+            ]
+            data = encode((filename, file_info, delta))
+        elif tag == MESSAGE_TAG.FILE_SPARSE and compress_file:
+            # Only the data of the extents is compressed
+            (filename, file_info, size, first, last, extents) = v
+            extents = [
+                [offset, zlib.compress(extent, compress_level)]
+                for offset, extent in extents
+            ]
+            data = encode((filename, file_info, size, first, last, extents))
+        elif tag == MESSAGE_TAG.FILE_APPEND and compress_file:
+            (filename, file_info, offset, last, data) = v
+            data = encode(
+                (
+                    filename,
+                    file_info,
+                    offset,
+                    last,
+                    zlib.compress(data, compress_level),
+                )
+            )
+        elif tag == MESSAGE_TAG.FILE_BUNDLE and compress_file:
+            # The data of all the files is compressed at once
+            (entries, data) = v
+            data = encode((entries, zlib.compress(data, compress_level)))
         elif tag == MESSAGE_TAG.SOCKET_IDENTIFICATION:
             if v == SOCKET_IDENTIFICATION.CLIENT:
                 data = (1).to_bytes(4, byteorder="big")
             elif v == SOCKET_IDENTIFICATION.SERVER:
                 data = (2).to_bytes(4, byteorder="big")
         else:
-            data = cbor2.dumps(v)
+            data = encode(v)
 
         amount_of_packets = len(data) // MAX_SIZE + 1
         bytes_sent = 0
@@ -183,7 +285,7 @@ def send(
             fd.send(filename_data)
 
             # Encode file info
-            encoded_file_info = cbor2.dumps(file_info)
+            encoded_file_info = encode(file_info)
 
             # Send file info size
             size = len(encoded_file_info).to_bytes(4, byteorder="big")
@@ -318,7 +420,7 @@ def recv(
             file_info = fd.recv(file_info_size)
             if not size:
                 return MESSAGE_TAG.END, None
-            file_info = cbor2.loads(file_info)
+            file_info = decode(file_info)
 
             # Receive start byte
             size = fd.recv(4)
@@ -384,12 +486,32 @@ def recv(
                 total_data,
             )
 
+        if tag == MESSAGE_TAG.FILE_DELTA and compress_file:
+            filename, file_info, delta = decode(total_data)
+            delta = [
+                zlib.decompress(op) if isinstance(op, bytes) else op for op in delta
+            ]
+            return tag, (filename, file_info, delta)
+
+        if tag == MESSAGE_TAG.FILE_SPARSE and compress_file:
+            filename, file_info, size, first, last, extents = decode(total_data)
+            extents = [[offset, zlib.decompress(extent)] for offset, extent in extents]
+            return tag, (filename, file_info, size, first, last, extents)
+
+        if tag == MESSAGE_TAG.FILE_APPEND and compress_file:
+            filename, file_info, offset, last, data = decode(total_data)
+            return tag, (filename, file_info, offset, last, zlib.decompress(data))
+
+        if tag == MESSAGE_TAG.FILE_BUNDLE and compress_file:
+            entries, data = decode(total_data)
+            return tag, (entries, zlib.decompress(data))
+
         if tag == MESSAGE_TAG.SOCKET_IDENTIFICATION:
             return tag, SOCKET_IDENTIFICATION(
                 int.from_bytes(total_data, byteorder="big")
             )
 
-        return tag, cbor2.loads(total_data)
+        return tag, decode(total_data)
     except TimeoutError:
         exit(30)
     finally:
@@ -19,15 +19,21 @@ import sys
 import select
 import socket
 from argparse import Namespace
+from typing import Iterator
 
 from src.client import Client
 from src.demon import Daemon
 from src.filelist import (
     print_file_list,
+    stream_file_list,
+    FileEntry,
     FileListInfo,
-    generate_file_list,
+    iterate_file_list,
+    generate_file_list_for_paths,
     generate_file_list_flags_from_args,
+    read_files_from,
 )
+from src.filters import filter_rules_from_args
 from src.logger import Logger
 from src.message import (
     FileDescriptorMethod,
@@ -38,10 +44,28 @@ from src.message import (
     SOCKET_IDENTIFICATION,
 )
 from src.options import get_args
+from src.scan_cache import scan_cache_from_args
 from src.server import Server
 from src.utils import parse_path
 
 
+def receive_file_list(method) -> Iterator[FileEntry]:
+    """
+    Receive a file list sent in parts, as it is scanned.
+    :param method: The method to receive the file list from.
+    :return: A generator of the entries of the file list.
+    """
+    while True:
+        tag, entries = recv(method)
+        if tag == MESSAGE_TAG.SOCKET_IDENTIFICATION:
+            # The daemon identifies the sender of each message it relays
+            continue
+
+        yield from entries
+        if tag != MESSAGE_TAG.FILE_LIST_PART:
+            break
+
+
 def main(args=None):
     logger = Logger()
     args = get_args(logger, program_args=args)
@@ -65,16 +89,41 @@ def main(args=None):
         parsed_source_host = None
         parsed_source_destination = None
 
+    # The standard input of a remote sender carries the messages
+    if (
+        args.files_from == "-"
+        and parsed_source_mode != "local"
+        and not (args.server or args.daemon)
+    ):
+        logger.error(
+            "Cannot read --files-from from the standard input with a remote source"
+        )
+        exit(1)
+
     if args.list_only and not (args.server or args.daemon):
         file_list = []
+        sock = None
 
         logger.debug_mode = True
-        if parsed_source_mode == "local":
-            file_list = generate_file_list(
+        if parsed_source_mode == "local" and args.files_from:
+            file_list = generate_file_list_for_paths(
                 args.source[0],
+                read_files_from(args.files_from, args.source[0], args.recursive),
                 logger,
                 recursive=args.recursive,
+                filter_rules=filter_rules_from_args(args),
+                options=FileListInfo.PERMISSIONS.value
+                | FileListInfo.FILE_SIZE.value
+                | FileListInfo.FILE_TIMES.value,
+            )
+        elif parsed_source_mode == "local":
+            file_list = iterate_file_list(
+                args.source[0],
+                recursive=args.recursive,
                 directory=args.dirs,
+                threads=args.scan_threads,
+                scan_cache=scan_cache_from_args(args),
+                filter_rules=filter_rules_from_args(args),
                 options=FileListInfo.PERMISSIONS.value
                 | FileListInfo.FILE_SIZE.value
                 | FileListInfo.FILE_TIMES.value,
@@ -91,7 +140,7 @@ def main(args=None):
                     | FileListInfo.FILE_SIZE.value
                     | FileListInfo.FILE_TIMES.value,
                 )
-                tag, file_list = recv(FileDescriptorMethod(rd_server))
+                file_list = receive_file_list(FileDescriptorMethod(rd_server))
             else:
                 # Redirect rd_client to stdin and wr_client to stdout
                 os.dup2(rd_client, 0)
@@ -139,10 +188,15 @@ def main(args=None):
                 | FileListInfo.FILE_TIMES.value,
             )
 
-            _, identification = recv(SocketMethod(sock))
-            flag, file_list = recv(SocketMethod(sock))
+            file_list = receive_file_list(SocketMethod(sock))
+
+        if args.list_format == "ls":
+            print_file_list(args.source[0], logger, list(file_list))
+        else:
+            stream_file_list(args.source[0], file_list, args.list_format)
+
+        if sock is not None:
             sock.close()
-        print_file_list(args.source[0], logger, file_list)
         exit(0)
 
     if args.server:
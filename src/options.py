@@ -16,6 +16,7 @@ import argparse
 import os
 from typing import Optional, List
 
+from src.filters import EXCLUDE, INCLUDE, parse_filter_rule
 from src.logger import Logger
 
 
@@ -89,6 +90,92 @@ def parse_args(args=None):
     parser.add_argument(
         "--compress-level", type=int, help="specify level of compression"
     )
+    parser.add_argument(
+        "-S",
+        "--sparse",
+        action="store_true",
+        help="turn sequences of nulls into sparse blocks",
+    )
+    parser.add_argument(
+        "--append-verify",
+        action="store_true",
+        help="only send the data appended to files that grew",
+    )
+    parser.add_argument(
+        "--bundle",
+        action="store_true",
+        help="transfer the small files in bundles",
+    )
+    parser.add_argument(
+        "--scan-threads",
+        type=int,
+        default=1,
+        help="amount of directories to scan at the same time",
+    )
+    parser.add_argument(
+        "--fsync",
+        choices=["none", "file", "batch", "end"],
+        default="none",
+        help="flush the received files to the disk: never, each file, by groups or at the end",
+    )
+    parser.add_argument(
+        "--write-threads",
+        type=int,
+        default=1,
+        help="amount of threads writing the received files",
+    )
+    parser.add_argument(
+        "--scan-cache",
+        type=str,
+        help="reuse the directory listings stored in this file",
+    )
+    parser.add_argument(
+        "--rescan",
+        action="store_true",
+        help="ignore the listings of the scan cache",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and synchronize the changes",
+    )
+    parser.add_argument(
+        "--watch-delay",
+        type=float,
+        default=0.5,
+        help="seconds without changes to wait for",
+    )
+    parser.add_argument(
+        "--exclude",
+        dest="filters",
+        action="append",
+        type=lambda pattern: (EXCLUDE, pattern),
+        metavar="PATTERN",
+        help="exclude files matching PATTERN",
+    )
+    parser.add_argument(
+        "--include",
+        dest="filters",
+        action="append",
+        type=lambda pattern: (INCLUDE, pattern),
+        metavar="PATTERN",
+        help="don't exclude files matching PATTERN",
+    )
+    parser.add_argument(
+        "-f",
+        "--filter",
+        dest="filters",
+        action="append",
+        type=parse_filter_rule,
+        metavar="RULE",
+        help="add a file-filtering RULE",
+    )
+    parser.add_argument(
+        "--files-from",
+        type=str,
+        metavar="FILE",
+        help="read list of source-file names from FILE",
+    )
     parser.add_argument(
         "--existing", action="store_true", help="skip creating new files on receiver"
     )
@@ -100,6 +187,27 @@ def parse_args(args=None):
     parser.add_argument(
         "--delete", action="store_true", help="delete extraneous files from dest dirs"
     )
+    parser.add_argument(
+        "--delete-before",
+        dest="delete_timing",
+        action="store_const",
+        const="before",
+        help="receiver deletes before transfer",
+    )
+    parser.add_argument(
+        "--delete-during",
+        dest="delete_timing",
+        action="store_const",
+        const="during",
+        help="receiver deletes during the transfer",
+    )
+    parser.add_argument(
+        "--delete-after",
+        dest="delete_timing",
+        action="store_const",
+        const="after",
+        help="receiver deletes after transfer",
+    )
     parser.add_argument(
         "--force", action="store_true", help="force deletion of dirs even if not empty"
     )
@@ -124,16 +232,45 @@ def parse_args(args=None):
     parser.add_argument(
         "--port", type=int, help="specify double-colon alternate port number"
     )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="perform a trial run with no changes made, and print the transfer plan",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="with --dry-run, compute the deltas of the modified files",
+    )
     parser.add_argument(
         "--list-only",
         action="store_true",
         help="list the files instead of copying them",
     )
+    parser.add_argument(
+        "--list-format",
+        choices=["ls", "fixed", "null"],
+        default="ls",
+        help="print the list like ls, or stream it with fixed width lines or NUL-ended records",
+    )
+    parser.add_argument(
+        "--order",
+        choices=["path", "inode", "extent", "size-asc", "size-desc"],
+        default="path",
+        help="order in which the files are requested: path keeps the files of a directory together, "
+        "inode or extent (first block on the disk, with FIEMAP) follow the disk of the sender",
+    )
     parser.add_argument(
         "--whole-file",
         action="store_true",
         help="copy files whole (w/o dividing them into blocks)",
     )
+    parser.add_argument(
+        "--tree-signatures",
+        action="store_true",
+        help="compare big files with a hash tree first",
+    )
     parser.add_argument(
         "--checksum",
         action="store_true",
@@ -218,6 +355,11 @@ def get_args(logger: Logger, program_args: Optional[List[str]] = None):
     if args.ignore_existing:
         args.update = True
 
+    if args.delete_timing is not None:
+        args.delete = True
+    else:
+        args.delete_timing = "during"
+
     if args.delete:
         if not args.dirs and not args.recursive:
             logger.error("Delete is only allowed if either -r or -d is specified.")
@@ -0,0 +1,95 @@
+#   Copyright (c) 2023, TriForMine. (https://triformine.dev) and samsoucoupe All rights reserved.
+#  #
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#  #
+#        http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from typing import List, Optional
+
+# Size of the data sent by the client to measure the throughput of the link
+PROBE_SIZE = 1024 * 1024
+# Number of round trips made to measure the throughput of the link
+PROBE_SAMPLES = 4
+
+
+def new_transfer_plan() -> dict:
+    """
+    Create an empty transfer plan, the prediction of a synchronization made in a dry run.
+    :return: The counts of the files of each category, and the predicted bytes
+    """
+    return {
+        "new_files": 0,
+        "new_directories": 0,
+        "modified_files": 0,
+        "unchanged_files": 0,
+        "hard_links": 0,
+        "extra_files": 0,
+        "delete": False,
+        "total_bytes": 0,
+        "literal_bytes": 0,
+        "matched_bytes": 0,
+        "deltas": False,
+        "throughput": None,
+    }
+
+
+def estimated_duration(plan: dict) -> Optional[float]:
+    """
+    Estimate the duration of the transfer of a plan from the measured throughput of the link.
+    :param plan: The transfer plan
+    :return: The duration in seconds, None if the throughput was not measured
+    """
+    if not plan["throughput"]:
+        return None
+
+    return plan["literal_bytes"] / plan["throughput"]
+
+
+def format_transfer_plan(plan: dict) -> List[str]:
+    """
+    Format a transfer plan like the stats of rsync.
+    :param plan: The transfer plan
+    :return: The lines of the report
+    """
+    extra = "deleted" if plan["delete"] else "kept"
+    literal = "" if plan["deltas"] else " (modified files counted whole)"
+
+    lines = [
+        f"Number of files: {plan['new_files'] + plan['modified_files'] + plan['unchanged_files']:,} "
+        f"(new: {plan['new_files']:,}, modified: {plan['modified_files']:,}, "
+        f"unchanged: {plan['unchanged_files']:,})",
+        f"Number of new directories: {plan['new_directories']:,}",
+        f"Number of hard links: {plan['hard_links']:,}",
+        f"Number of extra files: {plan['extra_files']:,} ({extra})",
+        f"Total file size: {plan['total_bytes']:,} bytes",
+        f"Predicted literal data: {plan['literal_bytes']:,} bytes{literal}",
+        f"Predicted matched data: {plan['matched_bytes']:,} bytes",
+    ]
+
+    duration = estimated_duration(plan)
+    if duration is not None:
+        lines.append(
+            f"Measured throughput: {plan['throughput'] / 1024 / 1024:.2f} MB/s"
+        )
+        lines.append(f"Estimated transfer time (rough): {duration:.2f} seconds")
+
+    return lines
+
+
+def print_transfer_plan(plan: dict, logger):
+    """
+    Print a transfer plan.
+    :param plan: The transfer plan
+    :param logger: The logger to log to
+    :return: None
+    """
+    for line in format_transfer_plan(plan):
+        logger.log(line)
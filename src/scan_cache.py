@@ -0,0 +1,157 @@
+#   Copyright (c) 2023, TriForMine. (https://triformine.dev) and samsoucoupe All rights reserved.
+#  #
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#  #
+#        http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import fcntl
+import os
+import time
+from argparse import Namespace
+from typing import Dict, List, Optional
+
+import cbor2
+
+# Directories modified less than this amount of nanoseconds before the scan are not cached,
+# a change in the same tick of the filesystem clock would not change their modification time
+SCAN_CACHE_MIN_AGE = 2 * 1000 * 1000 * 1000
+
+
+class ScanCache:
+    listings: Dict[str, list]
+
+    def __init__(self, path: str, rescan: bool = False, read_only: bool = False):
+        """
+        Create a cache of the directory listings of the previous scans, stored in a state file.
+        The listing of a directory is reused as long as its modification time and inode did not change,
+        which is the case as long as no entry is added, removed or renamed in it.
+        :param path:  The path to the state file.
+        :param rescan:  Whether to ignore the cached listings, the state file is still updated.
+        :param read_only:  Whether to only reuse the cached listings, without updating the state file.
+        """
+        self.path = path
+        self.rescan = rescan
+        self.read_only = read_only
+        self.start = time.time_ns()
+
+        # Listings read from the state file, and listings of the current scan
+        self.listings = {} if rescan else self.load()
+        self.scanned = {}
+        self.roots = []
+
+    def load(self) -> Dict[str, list]:
+        """
+        Read the listings stored in the state file.
+        :return:  The [modification time, inode, device, names] of the directories.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+                return cbor2.loads(f.read())
+        except (OSError, ValueError, cbor2.CBORDecodeError):
+            # A missing or corrupted state file only means that everything is scanned
+            return {}
+
+    def add_root(self, path: str):
+        """
+        Register a scanned tree, its directories that are not scanned again are removed from the state file.
+        :param path:  The path to the root of the tree.
+        """
+        self.roots.append(os.path.abspath(path))
+
+    def get(
+        self, directory: str, directory_stat: os.stat_result
+    ) -> Optional[List[str]]:
+        """
+        Get the cached listing of a directory.
+        :param directory:  The path to the directory.
+        :param directory_stat:  The current stat of the directory.
+        :return:  The names of the entries, or None if the directory changed since it was cached.
+        """
+        listing = self.listings.get(os.path.abspath(directory))
+        if listing is None:
+            return None
+
+        mtime, inode, device, names = listing
+        if (mtime, inode, device) != (
+            directory_stat.st_mtime_ns,
+            directory_stat.st_ino,
+            directory_stat.st_dev,
+        ):
+            return None
+
+        self.scanned[os.path.abspath(directory)] = listing
+        return names
+
+    def put(self, directory: str, directory_stat: os.stat_result, names: List[str]):
+        """
+        Cache the listing of a directory.
+        :param directory:  The path to the directory.
+        :param directory_stat:  The stat of the directory, from before it was listed.
+        :param names:  The names of the entries.
+        """
+        if self.start - directory_stat.st_mtime_ns < SCAN_CACHE_MIN_AGE:
+            return
+
+        self.scanned[os.path.abspath(directory)] = [
+            directory_stat.st_mtime_ns,
+            directory_stat.st_ino,
+            directory_stat.st_dev,
+            names,
+        ]
+
+    def save(self):
+        """
+        Write the listings of the current scan to the state file, keeping the listings of the other trees.
+        Nothing is written for a read-only cache.
+        :return: None
+        """
+        if self.read_only:
+            return
+
+        try:
+            with open(self.path, "a+b") as f:
+                # The sender and the receiver can share the same state file
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                f.seek(0)
+                try:
+                    listings = cbor2.loads(f.read())
+                except (ValueError, cbor2.CBORDecodeError):
+                    listings = {}
+
+                listings = {
+                    directory: listing
+                    for directory, listing in listings.items()
+                    if not any(
+                        directory == root or directory.startswith(root + os.sep)
+                        for root in self.roots
+                    )
+                }
+                listings.update(self.scanned)
+
+                f.seek(0)
+                f.truncate()
+                f.write(cbor2.dumps(listings))
+        except OSError:
+            pass
+
+
+def scan_cache_from_args(args: Namespace) -> Optional[ScanCache]:
+    """
+    Create the scan cache asked with the --scan-cache option.
+    :param args: The arguments.
+    :return: The scan cache, or None if the option is not set.
+    """
+    if not args.scan_cache:
+        return None
+
+    # A dry run must not write anything
+    return ScanCache(args.scan_cache, args.rescan, read_only=args.dry_run)
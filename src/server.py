@@ -11,20 +11,39 @@
 #    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
+import functools
+import itertools
 import os
 import shutil
+import signal
 import sys
+import tempfile
 import time
 from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 from src.filelist import (
     generate_file_list,
+    generate_file_list_for_paths,
+    FileEntry,
     FileListInfo,
     generate_file_list_flags_from_args,
 )
+from src.filters import filter_rules_from_args
 from src.generator import Generator
 from src.logger import Logger
-from src.message import recv, send, MESSAGE_TAG, MessageMethod
+from src.message import (
+    recv,
+    send,
+    MESSAGE_TAG,
+    MessageMethod,
+    FileDescriptorMethod,
+)
+from src.plan import print_transfer_plan
+from src.scan_cache import scan_cache_from_args
+from src.utils import copy_range, delete_paths, write_sparse
+from src.writer import Syncer, Writer
 
 
 class Server:
@@ -57,8 +76,26 @@ class Server:
         self.wr = wr
         self.rd = rd
         self.args = args
+        self.write_generator = None
+        self.generator_pid = None
+
+        # Files received in several messages, opened once until their last part is written
+        self.open_files = {}
+
+        # Info of the directories, applied once all the files are written
+        self.directories = {}
+
+        # Flushes the written files to the disk, depending on --fsync
+        self.syncer = Syncer(args.fsync)
+
+        # Threads writing the received files, started again after each fork of the generator
+        self.writer = None
 
     def run(self):
+        # In watch mode, the server is stopped by the client once it is interrupted
+        if self.args.watch:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+
         self.logger.info("Server started")
         t1 = time.time()
         self.loop()
@@ -67,7 +104,7 @@ class Server:
         self.logger.info(f"Time elapsed: {t2 - t1:.2f}s")
         sys.exit(0)
 
-    def handle_file_creation(self, path: str, data: bytes, file_info: dict):
+    def handle_file_creation(self, path: str, data: bytes, file_info: FileEntry):
         """
         Handle file creation
         :param file_info: The file info
@@ -81,11 +118,17 @@ class Server:
 
         # Create directory if path ends with a slash
         if path.endswith("/"):
-            if os.path.exists(path) and not os.path.isdir(path):
-                os.remove(path)
+            # The trailing slash would hide a file in the place of the directory
+            directory = os.path.normpath(path)
+            if os.path.lexists(directory) and not os.path.isdir(directory):
+                os.remove(directory)
 
             self.logger.info(f"Creating directory {path}...")
             os.makedirs(path, exist_ok=True)
+            self.syncer.directory_changed(os.path.dirname(os.path.normpath(path)))
+
+            # Writing the files of the directory would change its modification time
+            self.directories[os.path.normpath(path)] = file_info
         else:
             # Create parent directory if it doesn't exist
             if not os.path.exists(os.path.dirname(path)):
@@ -108,25 +151,10 @@ class Server:
             self.logger.info(f"Creating file {path}...")
             with open(path, "wb") as f:
                 f.write(data)
-
-            if self.args.hard_links and len(file_info["hard_links"]) > 0:
-                for link in file_info["hard_links"]:
-                    self.logger.info(f"Creating hard link {link}...")
-                    link = os.path.join(os.path.dirname(path), link)
-                    if os.path.exists(link):
-                        os.remove(link)
-                    os.link(path, link)
-
-            if self.args.perms:
-                os.chmod(path, file_info["permissions"])
-
-            if self.args.times:
-                # Set the access and modification time
-                os.utime(path, (file_info["atime"], file_info["mtime"]))
-            else:
-                # Set the modification time
-                atime = os.path.getatime(path)
-                os.utime(path, (atime, file_info["mtime"]))
+                f.flush()
+                self.apply_file_info(path, file_info, f.fileno())
+                self.syncer.file_written(path, f.fileno())
+            self.syncer.directory_changed(os.path.dirname(path))
 
     def handle_file_modification(
         self,
@@ -134,7 +162,7 @@ class Server:
         start_byte: int,
         end_byte: int,
         whole_file: bool,
-        file_info: dict,
+        file_info: FileEntry,
         data: bytes,
     ):
         """
@@ -189,24 +217,343 @@ class Server:
             if whole_file:
                 f.truncate()
 
-        if self.args.hard_links and len(file_info["hard_links"]) > 0:
-            for link in file_info["hard_links"]:
-                self.logger.info(f"Creating hard link {link}...")
-                link = os.path.join(os.path.dirname(path), link)
-                if os.path.exists(link):
-                    os.remove(link)
-                os.link(path, link)
+            f.flush()
+            self.apply_file_info(path, file_info, f.fileno())
+            self.syncer.file_written(path, f.fileno())
+
+    def handle_file_reconstruction(self, path: str, file_info: FileEntry, delta: list):
+        """
+        Rebuild a file from its current version (the basis) and a delta.
+        The new file is written sequentially to a temporary file next to the basis,
+        which is left untouched until the temporary file is renamed over it.
+        :param path: The file path
+        :param file_info: The file info
+        :param delta: The [offset, length] ranges to copy from the basis, and the literal data, in file order
+        :return: None
+        """
+        if self.args.ignore_existing:
+            return
+
+        if not os.path.isfile(path):
+            self.logger.error(
+                f"Could not rebuild file {path}: the basis file is missing"
+            )
+            return
+
+        self.logger.info(f"Rebuilding file {path}...")
+
+        fd, temp_path = tempfile.mkstemp(
+            prefix=f".{os.path.basename(path)}.", dir=os.path.dirname(path)
+        )
+        try:
+            with open(path, "rb") as basis, os.fdopen(fd, "wb", buffering=0) as f:
+                for op in delta:
+                    if isinstance(op, bytes) and self.args.sparse:
+                        write_sparse(f.fileno(), op)
+                    elif isinstance(op, bytes):
+                        f.write(op)
+                    else:
+                        (offset, length) = op
+                        copy_range(
+                            basis.fileno(),
+                            f.fileno(),
+                            offset,
+                            length,
+                            sparse=self.args.sparse,
+                        )
+
+                # The holes at the end of a sparse file only exist once it is truncated
+                if self.args.sparse:
+                    f.truncate(f.tell())
+
+                # Keep the permissions of the basis, mkstemp creates the file as 0600
+                os.fchmod(f.fileno(), os.fstat(basis.fileno()).st_mode)
+                self.apply_file_info(temp_path, file_info, f.fileno())
+                self.syncer.file_replacing(f.fileno())
+
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        # The renaming is only durable once the directory is flushed
+        self.syncer.directory_changed(os.path.dirname(path))
+
+    def handle_sparse_file(
+        self,
+        path: str,
+        file_info: FileEntry,
+        size: int,
+        first: bool,
+        last: bool,
+        extents: list,
+    ):
+        """
+        Handle the data extents of a sparse file.
+        The file is truncated to its size, which leaves it as a single hole, then only the extents are written.
+        :param path: The file path
+        :param file_info: The file info
+        :param size: The size of the file
+        :param first: If these are the first extents of the file
+        :param last: If these are the last extents of the file
+        :param extents: The [offset, data] of the extents
+        :return: None
+        """
+        if first:
+            if not os.path.exists(path) and self.args.existing:
+                return
+            if os.path.exists(path) and self.args.ignore_existing:
+                return
+
+            # Create parent directory if it doesn't exist
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            if os.path.isdir(path):
+                try:
+                    # If the directory is empty, we delete it
+                    os.rmdir(path)
+                except OSError:
+                    # If the directory is not empty and --force is set, we delete it recursively
+                    if self.args.force:
+                        self.logger.warn(f"Deleting directory {path} recursively...")
+                        shutil.rmtree(path)
+                    else:
+                        self.logger.error(
+                            f"Could not create file {path}: a directory with the same name already exists and is not empty. Use --force to delete it."
+                        )
+                        return
+
+            self.logger.info(f"Creating sparse file {path}...")
+            self.open_files[path] = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+            os.ftruncate(self.open_files[path], size)
+        elif path not in self.open_files:
+            # The first extents were skipped
+            return
+
+        fd = self.open_files[path]
+        try:
+            for offset, data in extents:
+                os.lseek(fd, offset, os.SEEK_SET)
+                write_sparse(fd, data)
+
+            if last:
+                self.apply_file_info(path, file_info, fd)
+                self.syncer.file_written(path, fd)
+                self.syncer.directory_changed(os.path.dirname(path))
+        except BaseException:
+            last = True
+            raise
+        finally:
+            if last:
+                del self.open_files[path]
+                os.close(fd)
+
+    def handle_write(self, tag: MESSAGE_TAG, v):
+        """
+        Write the data of a file received from the client, called by the threads of the writer
+        :param tag: The tag of the message
+        :param v: The value of the message
+        :return: None
+        """
+        if tag == MESSAGE_TAG.FILE_DATA:
+            (file_name, file_info, start, end, whole_file, data) = v
+            target_path = self.get_target_path(file_name, file_info.source)
+
+            # Check whether the file needs to be created or modified,
+            # the parent directories may have been created by the files written by the other threads
+            if not os.path.exists(target_path) or target_path.endswith("/"):
+                self.handle_file_creation(target_path, data, file_info)
+            else:
+                self.handle_file_modification(
+                    target_path, start, end, whole_file, file_info, data
+                )
+        elif tag == MESSAGE_TAG.FILE_DELTA:
+            (file_name, file_info, delta) = v
+            target_path = self.get_target_path(file_name, file_info.source)
+            self.handle_file_reconstruction(target_path, file_info, delta)
+        elif tag == MESSAGE_TAG.FILE_BUNDLE:
+            (entries, data) = v
+            self.handle_file_bundle(entries, data)
+        elif tag == MESSAGE_TAG.FILE_SPARSE:
+            (file_name, file_info, size, first, last, extents) = v
+            target_path = self.get_target_path(file_name, file_info.source)
+            self.handle_sparse_file(target_path, file_info, size, first, last, extents)
+        elif tag == MESSAGE_TAG.FILE_APPEND:
+            (file_name, file_info, offset, last, data) = v
+            target_path = self.get_target_path(file_name, file_info.source)
+            self.handle_file_append(target_path, file_info, offset, last, data)
+
+    def handle_file_bundle(self, entries: list, data: bytes):
+        """
+        Write the small files sent together in a bundle
+        :param entries: The [file name, file info, length] of the files, in the order of their data
+        :param data: The data of all the files
+        :return: None
+        """
+        data = memoryview(data)
+        offset = 0
+
+        for file_name, file_info, length in entries:
+            target_path = self.get_target_path(file_name, file_info.source)
+            file_data = data[offset : offset + length]
+            offset += length
+
+            # Check whether the file needs to be created or modified
+            if not os.path.exists(target_path) or target_path.endswith("/"):
+                self.handle_file_creation(target_path, file_data, file_info)
+            else:
+                self.handle_file_modification(
+                    target_path, 0, 0, True, file_info, file_data
+                )
+
+    def handle_file_append(
+        self, path: str, file_info: FileEntry, offset: int, last: bool, data: bytes
+    ):
+        """
+        Handle the data appended to a file.
+        The file is modified in place, its start was checked to be the same as the source file.
+        :param path: The file path
+        :param file_info: The file info
+        :param offset: The offset of the data
+        :param last: If this is the last data of the file
+        :param data: The data
+        :return: None
+        """
+        if path not in self.open_files:
+            # The file is checked and opened with its first data
+            if self.args.ignore_existing:
+                return
+
+            if not os.path.isfile(path):
+                self.logger.error(
+                    f"Could not append to file {path}: the file is missing"
+                )
+                return
+
+            self.open_files[path] = os.open(path, os.O_WRONLY)
+
+        self.logger.info(
+            f"Appending to file {path} from byte {offset} to {offset + len(data)}..."
+        )
+
+        fd = self.open_files[path]
+        try:
+            os.pwrite(fd, data, offset)
+
+            if last:
+                self.apply_file_info(path, file_info, fd)
+                self.syncer.file_written(path, fd)
+        except BaseException:
+            last = True
+            raise
+        finally:
+            if last:
+                del self.open_files[path]
+                os.close(fd)
+
+    def apply_file_info(
+        self,
+        path: str,
+        file_info: FileEntry,
+        fd: Optional[int] = None,
+        dir_fd: Optional[int] = None,
+    ):
+        """
+        Apply the permissions and times of a file
+        :param path: The file path
+        :param file_info: The file info
+        :param fd: The file descriptor of the file once all its data is written, to not look up its path again
+        :param dir_fd: The file descriptor of the directory the path is relative to
+        :return: None
+        """
+        target = fd if fd is not None else path
 
         if self.args.perms:
-            os.chmod(path, int(file_info["permissions"]))
+            os.chmod(target, int(file_info.permissions), dir_fd=dir_fd)
 
         if self.args.times:
             # Set the access and modification time
-            os.utime(path, (file_info["atime"], file_info["mtime"]))
+            os.utime(target, (file_info.atime, file_info.mtime), dir_fd=dir_fd)
         else:
             # Set the modification time
-            atime = os.path.getatime(path)
-            os.utime(path, (atime, file_info["mtime"]))
+            atime = os.stat(target, dir_fd=dir_fd).st_atime
+            os.utime(target, (atime, file_info.mtime), dir_fd=dir_fd)
+
+    def apply_directories_info(self):
+        """
+        Apply the permissions and times of the directories, once all the files are written.
+        The deepest directories are done first, so that the permissions of a directory never prevent
+        reaching the directories inside it, and the directories of a parent are done relative to it.
+        :return: None
+        """
+        directories = sorted(
+            self.directories.items(),
+            key=lambda item: (-item[0].count("/"), os.path.dirname(item[0])),
+        )
+        self.directories = {}
+
+        for parent, entries in itertools.groupby(
+            directories, key=lambda item: os.path.dirname(item[0])
+        ):
+            try:
+                # The top-level directories of a relative destination have no parent in their path
+                dir_fd = os.open(parent or os.curdir, os.O_RDONLY | os.O_DIRECTORY)
+            except OSError:
+                self.logger.warn(
+                    f"Cannot apply the info of the directories of {parent}"
+                )
+                continue
+
+            try:
+                for path, file_info in entries:
+                    try:
+                        self.apply_file_info(
+                            os.path.basename(path), file_info, dir_fd=dir_fd
+                        )
+                        self.syncer.directory_changed(path)
+                    except FileNotFoundError:
+                        # The directory was deleted after being created
+                        pass
+            finally:
+                os.close(dir_fd)
+
+    def handle_hard_links(self, groups: list):
+        """
+        Handle the creation of hard links
+        The files linked together in the source are only received once, the other files are linked to it
+        :param groups: The [source, file, links] of the files linked together
+        :return: None
+        """
+        for source, file_name, links in groups:
+            path = self.get_target_path(file_name, source)
+            if not os.path.isfile(path):
+                continue
+
+            for link in links:
+                link_path = self.get_target_path(link, source)
+
+                if os.path.lexists(link_path):
+                    if os.path.isfile(link_path) and os.path.samefile(path, link_path):
+                        continue
+                    if self.args.ignore_existing:
+                        continue
+                    if os.path.isdir(link_path) and not os.path.islink(link_path):
+                        self.logger.error(
+                            f"Could not create hard link {link_path}: a directory with the same name already exists."
+                        )
+                        continue
+                    os.remove(link_path)
+                elif self.args.existing:
+                    continue
+
+                # Create parent directory if it doesn't exist
+                if not os.path.exists(os.path.dirname(link_path)):
+                    os.makedirs(os.path.dirname(link_path), exist_ok=True)
+
+                self.logger.info(f"Creating hard link {link_path}...")
+                os.link(path, link_path)
+                self.syncer.directory_changed(os.path.dirname(link_path))
 
     def handle_file_deletion(self, files: list):
         """
@@ -217,68 +564,96 @@ class Server:
         if files is None:
             return
 
-        for file in files:
-            self.logger.info(f"Deleting {file}...")
+        self.logger.info(f"Deleting {len(files)} files...")
 
-            # If the file is a directory, we delete it
-            if os.path.isdir(os.path.join(self.destination, file)):
-                shutil.rmtree(os.path.join(self.destination, file))
-            else:
-                try:
-                    # If the file is not a directory, we delete it
-                    os.remove(os.path.join(self.destination, file))
-                except OSError:
-                    self.logger.warn(f"Cannot delete {file}")
+        # The files of different directories are deleted in parallel
+        for file in delete_paths(self.destination, files):
+            self.logger.warn(f"Cannot delete {file}")
 
-    def handle_file_offset(
-        self, file_name: str, start_byte: int, end_byte: int, offset: int
-    ):
+        for directory in {
+            os.path.dirname(os.path.normpath(os.path.join(self.destination, file)))
+            for file in files
+        }:
+            self.syncer.directory_changed(directory)
+
+    def get_target_path(self, file_name: str, source: int) -> str:
         """
-        Move all the content from start_byte to end_byte by offset.
-        :param file_name: The file name
-        :param start_byte: The start byte
-        :param end_byte: The end byte
-        :param offset: The offset
-        :return:
+        Get the destination path of a file sent by the client
+        :param file_name: The file name, relative to its source
+        :param source: The index of the source of the file
+        :return: The destination path
         """
-        if self.args.ignore_existing:
-            return
+        if file_name != "" and not self.source[source].endswith("/"):
+            # The file is in a subdirectory, in recursive mode
+            file_name = os.path.join(os.path.basename(self.source[source]), file_name)
+
+        if self.destination.endswith("/"):
+            target_path = (
+                os.path.join(self.destination, file_name)
+                if file_name != "" and file_name != "/"
+                else os.path.join(
+                    self.destination, os.path.basename(self.source[source])
+                )
+            )
+        else:
+            target_path = self.destination
 
-        # Create parent directory if it doesn't exist
-        if not os.path.exists(
-            os.path.dirname(os.path.join(self.destination, file_name))
-        ):
-            os.makedirs(
-                os.path.dirname(os.path.join(self.destination, file_name)),
-                exist_ok=True,
+        if file_name == "/":
+            target_path += "/"
+
+        return target_path
+
+    def start_generator(self, source_files: list, destination_files: list):
+        """
+        Start the generator in a child process, once the previous one is finished
+        :param source_files: The source file list
+        :param destination_files: The destination file list
+        :return: None
+        """
+        self.wait_generator()
+
+        # The generator reads the messages of the client meant for it from a pipe
+        rd_generator, wr_generator = os.pipe()
+
+        # Forking while the threads of the writer and the syncer run could leave their locks held in the generator
+        self.writer.close()
+        self.syncer.close()
+
+        pid = os.fork()
+
+        if pid == 0:
+            self.rd.close()
+            os.close(wr_generator)
+            generator = Generator(
+                self.wr,
+                self.source,
+                self.destination,
+                source_files,
+                destination_files,
+                self.logger,
+                self.args,
+                FileDescriptorMethod(rd_generator),
             )
+            generator.run()
+            sys.exit(0)
 
-        self.logger.info(
-            f"Moving file {file_name} from byte {start_byte} to {end_byte}..."
-        )
-        target_path = (
-            os.path.join(self.destination, file_name)
-            if file_name != ""
-            else os.path.join(self.destination, os.path.basename(self.source[0]))
-        )
-        # verify if not a directory
-        if not os.path.isdir(target_path):
-            with open(target_path, "r+b") as f:
-                f.seek(start_byte)
-                data = f.read(end_byte - start_byte + 1)
-                f.seek(start_byte + offset)
-                f.write(data)
+        os.close(rd_generator)
+        self.writer = Writer(self.handle_write, threads=self.args.write_threads)
+        self.write_generator = FileDescriptorMethod(wr_generator)
+        self.generator_pid = pid
 
-                # Replace the offset with empty bytes, this is needed to avoid having the same data twice
-                # The date will be overwritten by the next modification
-                f.seek(start_byte)
-                f.write(b"\x00" * offset)
+    def wait_generator(self):
+        """
+        Wait for the generator to exit
+        :return: None
+        """
+        if self.generator_pid is None:
+            return
 
-                # If data is smaller than end_byte - start_byte, we need to truncate the file
-                if len(data) < end_byte - start_byte:
-                    f.truncate()
-        else:
-            self.logger.warn(f"Cannot modify directory {file_name}")
+        os.waitpid(self.generator_pid, 0)
+        self.write_generator.close()
+        self.write_generator = None
+        self.generator_pid = None
 
     def loop(self):
         """
@@ -294,23 +669,54 @@ class Server:
             logger=self.logger,
         )
 
-        if self.args.destination.endswith("/") and not os.path.exists(
-            self.args.destination
+        if (
+            not self.args.dry_run
+            and self.args.destination.endswith("/")
+            and not os.path.exists(self.args.destination)
         ):
             os.makedirs(self.args.destination)
 
+        scan_destination = functools.partial(
+            generate_file_list,
+            [self.destination],
+            self.logger,
+            recursive=self.args.recursive,
+            directory=True,
+            options=generate_file_list_flags_from_args(self.args),
+            threads=self.args.scan_threads,
+            scan_cache=scan_cache_from_args(self.args),
+            filter_rules=filter_rules_from_args(self.args),
+        )
+
+        # Scan the destination while the client is scanning the source,
+        # with --files-from only the listed paths are compared
+        destination_scan = None
+        scan_executor = None
+        if not self.args.files_from:
+            scan_executor = ThreadPoolExecutor(max_workers=1)
+            destination_scan = scan_executor.submit(scan_destination)
+            scan_executor.shutdown(wait=False)
+
+        self.writer = Writer(self.handle_write, threads=self.args.write_threads)
+
         while True:
+            # In watch mode, the client can wait for changes for longer than the timeout
             tag, v = recv(
-                self.rd, timeout=self.args.timeout, compress_file=self.args.compress
+                self.rd,
+                timeout=(
+                    self.args.timeout
+                    if self.generator_pid is not None or not self.args.watch
+                    else None
+                ),
+                compress_file=self.args.compress,
             )
 
             if tag == MESSAGE_TAG.ASK_FILE_LIST:
-                destination_files = generate_file_list(
-                    [self.destination],
-                    self.logger,
-                    recursive=self.args.recursive,
-                    directory=True,
-                    options=generate_file_list_flags_from_args(self.args),
+                # The destination is only scanned once, by the scan started with the loop
+                destination_files = (
+                    destination_scan.result()
+                    if destination_scan is not None
+                    else scan_destination()
                 )
                 send(
                     self.wr,
@@ -331,67 +737,113 @@ class Server:
                 self.logger.info(f"File list received {v}")
 
                 source_files = v
+                self.writer.join()
 
-                pid = os.fork()
+                # The scanning thread does not exist in the generator process, wait for it before forking
+                destination_files = (
+                    destination_scan.result()
+                    if destination_scan is not None
+                    else scan_destination()
+                )
+                if scan_executor is not None:
+                    scan_executor.shutdown(wait=True)
 
                 # Once the file list is received, we start the generator
-                if pid == 0:
-                    self.rd.close()
+                self.start_generator(source_files, destination_files)
+            elif tag == MESSAGE_TAG.FILE_LIST_UPDATE:
+                (source_files, paths) = v
+                self.logger.info(f"File list update received {source_files}")
+
+                # The destination is scanned once the previous changes are written
+                self.writer.join()
+
+                if paths is None:
+                    # The sources were scanned entirely
                     destination_files = generate_file_list(
                         [self.destination],
                         self.logger,
                         recursive=self.args.recursive,
                         directory=True,
                         options=generate_file_list_flags_from_args(self.args),
+                        threads=self.args.scan_threads,
+                        filter_rules=filter_rules_from_args(self.args),
                     )
-                    generator = Generator(
-                        self.wr,
-                        self.source,
-                        self.destination,
-                        source_files,
-                        destination_files,
+                else:
+                    # Only the destination of the changed paths is compared
+                    destination_files = generate_file_list_for_paths(
+                        [self.destination],
+                        [
+                            [
+                                0,
+                                os.path.relpath(
+                                    self.get_target_path(path, source),
+                                    self.destination,
+                                ),
+                                scan,
+                            ]
+                            for source, path, scan in paths
+                        ],
                         self.logger,
-                        self.args,
-                    )
-                    generator.run()
-                    sys.exit(0)
-            elif tag == MESSAGE_TAG.FILE_DATA:
-                (file_name, file_info, start, end, whole_file, data) = v
-                source = file_info["source"]
-
-                if file_name != "" and not self.source[source].endswith("/"):
-                    # The file is in a subdirectory, in recursive mode
-                    file_name = os.path.join(
-                        os.path.basename(self.source[source]), file_name
-                    )
-
-                if self.destination.endswith("/"):
-                    target_path = (
-                        os.path.join(self.destination, file_name)
-                        if file_name != "" and file_name != "/"
-                        else os.path.join(
-                            self.destination, os.path.basename(self.source[source])
-                        )
+                        recursive=self.args.recursive,
+                        options=generate_file_list_flags_from_args(self.args),
+                        filter_rules=filter_rules_from_args(self.args),
                     )
-                else:
-                    target_path = self.destination
 
-                if file_name == "/":
-                    target_path += "/"
-
-                # Check whether the file needs to be created or modified
-                if not os.path.exists(target_path):
-                    self.handle_file_creation(target_path, data, file_info)
+                self.start_generator(source_files, destination_files)
+            elif tag == MESSAGE_TAG.GENERATOR_FINISHED:
+                # In watch mode, all the files asked by the generator were received
+                self.writer.join()
+                self.apply_directories_info()
+                self.syncer.flush()
+                self.wait_generator()
+                self.logger.info("Synchronization finished")
+            elif tag in (
+                # Answers of the client to the generator
+                MESSAGE_TAG.FILE_TREE_DIFFERENCE,
+                MESSAGE_TAG.FILE_APPEND_VERIFY,
+                MESSAGE_TAG.LINK_PROBE,
+                MESSAGE_TAG.FILE_ESTIMATE,
+            ):
+                send(self.write_generator, tag, v, timeout=self.args.timeout)
+            elif tag in (
+                MESSAGE_TAG.FILE_DATA,
+                MESSAGE_TAG.FILE_DELTA,
+                MESSAGE_TAG.FILE_BUNDLE,
+                MESSAGE_TAG.FILE_SPARSE,
+                MESSAGE_TAG.FILE_APPEND,
+            ):
+                # The files are written in the background while the next messages are received,
+                # the messages of a file are written in order by the same thread
+                file_name, file_info = (
+                    v[0][0][:2] if tag == MESSAGE_TAG.FILE_BUNDLE else v[:2]
+                )
+                target_path = self.get_target_path(file_name, file_info.source)
+                if tag == MESSAGE_TAG.FILE_DATA and target_path.endswith("/"):
+                    # The directories are created before their files are queued,
+                    # since a file in their place must be removed before the files are written
+                    self.handle_write(tag, v)
                 else:
-                    self.handle_file_modification(
-                        target_path, start, end, whole_file, file_info, data
-                    )
-            elif tag == MESSAGE_TAG.FILE_DATA_OFFSET:
-                (file_name, start, end, offset) = v
-                self.handle_file_offset(file_name, start, end, offset)
+                    self.writer.submit(target_path, tag, v)
+            elif tag == MESSAGE_TAG.TRANSFER_PLAN:
+                print_transfer_plan(v, self.logger)
             elif tag == MESSAGE_TAG.DELETE_FILES:
+                # The files received before are written before deleting
+                self.writer.join()
                 self.handle_file_deletion(v)
+            elif tag == MESSAGE_TAG.DIRECTORY_INFO:
+                for file_name, file_info in v:
+                    target_path = self.get_target_path(file_name, file_info.source)
+                    self.directories[os.path.normpath(target_path)] = file_info
+            elif tag == MESSAGE_TAG.HARD_LINKS:
+                # The files linked to must be written
+                self.writer.join()
+                self.handle_hard_links(v)
             elif tag == MESSAGE_TAG.END:
+                self.writer.close()
+                self.apply_directories_info()
+
+                # The synchronization is only reported finished once the files are on the disk
+                self.syncer.flush()
                 self.logger.info("Server: End of transmission")
                 send(
                     self.wr,
@@ -11,7 +11,27 @@
 #    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
-from typing import Tuple, Optional
+import errno
+import fcntl
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Optional
+
+# ioctl of Linux mapping the logical extents of a file to the disk, _IOWR('f', 11, struct fiemap)
+FS_IOC_FIEMAP = 0xC020660B
+# Header of struct fiemap: start, length, flags, mapped extents, extent count, reserved
+FIEMAP_HEADER = struct.Struct("=QQIIII")
+# struct fiemap_extent: logical, physical, length, 2 reserved, flags, 3 reserved
+FIEMAP_EXTENT = struct.Struct("=QQQQQIIII")
+# The physical offset of the extent is not known yet, or the data is stored with the metadata
+FIEMAP_EXTENT_UNKNOWN = 0x2
+FIEMAP_EXTENT_DATA_INLINE = 0x200
+
+# Size of the blocks checked for zeros when writing sparse files
+SPARSE_BLOCK_SIZE = 4096
+# Amount of threads deleting the extra files, each in its own directories
+DELETE_THREADS = 8
 
 
 def parse_path(path: str) -> Tuple[str, Optional[str], Optional[str], str]:
@@ -35,3 +55,232 @@ def parse_path(path: str) -> Tuple[str, Optional[str], Optional[str], str]:
             return "ssh", None, path.split(":")[0], path.split(":")[1]
     else:
         return "local", None, None, path
+
+
+def get_data_extents(
+    fd: int, offset: int = 0, length: Optional[int] = None
+) -> List[Tuple[int, int]]:
+    """
+    Get the parts of a file that contain data, skipping the holes of sparse files
+    Uses SEEK_DATA and SEEK_HOLE, the whole range is considered as data if they are not supported
+    :param fd: The file descriptor
+    :param offset: The offset of the range to look at
+    :param length: The length of the range to look at, until the end of the file by default
+    :return: A list of (offset, length) of the data extents
+    """
+    end = os.fstat(fd).st_size
+    if length is not None:
+        end = min(end, offset + length)
+
+    if not hasattr(os, "SEEK_DATA"):
+        return [(offset, end - offset)] if offset < end else []
+
+    extents = []
+    while offset < end:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # There is only a hole after the offset
+                break
+            return extents + [(offset, end - offset)]
+
+        if start >= end:
+            break
+
+        offset = min(os.lseek(fd, start, os.SEEK_HOLE), end)
+        extents.append((start, offset - start))
+
+    return extents
+
+
+def get_physical_offset(path: str) -> Optional[int]:
+    """
+    Get the offset on the disk of the first extent of a file, with the FIEMAP ioctl of Linux
+    :param path: The path of the file
+    :return: The physical offset in bytes, None if the file has no extent or the filesystem does not support it
+    """
+    request = bytearray(FIEMAP_HEADER.size + FIEMAP_EXTENT.size)
+    FIEMAP_HEADER.pack_into(request, 0, 0, 2**64 - 1, 0, 0, 1, 0)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+
+    try:
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, request)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+    mapped_extents = FIEMAP_HEADER.unpack_from(request)[3]
+    if mapped_extents == 0:
+        return None
+
+    extent = FIEMAP_EXTENT.unpack_from(request, FIEMAP_HEADER.size)
+    if extent[5] & (FIEMAP_EXTENT_UNKNOWN | FIEMAP_EXTENT_DATA_INLINE):
+        return None
+    return extent[1]
+
+
+def write_sparse(fd: int, data: bytes):
+    """
+    Write data to the current position of a file, seeking over the blocks full of zeros to leave holes
+    The file must be truncated to its final size afterwards
+    :param fd: The file descriptor
+    :param data: The data to write
+    :return: None
+    """
+    view = memoryview(data)
+    for start in range(0, len(data), SPARSE_BLOCK_SIZE):
+        block = view[start : start + SPARSE_BLOCK_SIZE]
+        if block.nbytes == data.count(0, start, start + block.nbytes):
+            os.lseek(fd, block.nbytes, os.SEEK_CUR)
+        else:
+            os.write(fd, block)
+
+
+def copy_range(
+    source_fd: int,
+    destination_fd: int,
+    offset: int,
+    length: int,
+    sparse: bool = False,
+):
+    """
+    Copy a range of a file to the current position of another file
+    Uses copy_file_range when available so the data does not go through user space
+    :param source_fd: The file descriptor to copy from
+    :param destination_fd: The file descriptor to copy to
+    :param offset: The offset of the range in the source file
+    :param length: The length of the range
+    :param sparse: Seek over the holes of the source file instead of writing zeros
+    The destination file must be truncated to its final size afterwards
+    :return: None
+    """
+    if sparse:
+        position = os.lseek(destination_fd, 0, os.SEEK_CUR) - offset
+        for start, size in get_data_extents(source_fd, offset, length):
+            os.lseek(destination_fd, position + start, os.SEEK_SET)
+            copy_range(source_fd, destination_fd, start, size)
+        os.lseek(destination_fd, position + offset + length, os.SEEK_SET)
+        return
+
+    if hasattr(os, "copy_file_range"):
+        try:
+            while length > 0:
+                copied = os.copy_file_range(source_fd, destination_fd, length, offset)
+                if copied == 0:
+                    break
+                offset += copied
+                length -= copied
+            return
+        except OSError:
+            # Not supported between those file systems, fall back to read and write
+            pass
+
+    while length > 0:
+        data = os.pread(source_fd, min(length, 1024 * 1024), offset)
+        if not data:
+            break
+        os.write(destination_fd, data)
+        offset += len(data)
+        length -= len(data)
+
+
+def remove_entry(dir_fd: int, name: str):
+    """
+    Remove a file, or a directory and its content, relative to an open directory
+    The paths are never resolved again from the root, and symbolic links are removed without being followed
+    :param dir_fd: The file descriptor of the directory of the entry
+    :param name: The name of the entry
+    :return: None
+    """
+    try:
+        os.unlink(name, dir_fd=dir_fd)
+        return
+    except OSError as e:
+        # Linux fails with EISDIR, other systems with EPERM
+        if e.errno not in (errno.EISDIR, errno.EPERM):
+            raise
+
+    fd = os.open(name, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=dir_fd)
+    try:
+        with os.scandir(fd) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    remove_entry(fd, entry.name)
+                else:
+                    os.unlink(entry.name, dir_fd=fd)
+    finally:
+        os.close(fd)
+
+    os.rmdir(name, dir_fd=dir_fd)
+
+
+def remove_entries(directory: str, names: List[str]) -> List[str]:
+    """
+    Remove entries of a directory, the directory being opened once
+    :param directory: The path of the directory
+    :param names: The names of the entries
+    :return: The names of the entries that could not be removed
+    """
+    failed = []
+
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return names
+
+    try:
+        for name in names:
+            try:
+                remove_entry(dir_fd, name)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                failed.append(name)
+    finally:
+        os.close(dir_fd)
+
+    return failed
+
+
+def delete_paths(
+    root: str, paths: List[str], threads: int = DELETE_THREADS
+) -> List[str]:
+    """
+    Delete files and directory trees, the directories being deleted from in parallel
+    The paths inside a deleted directory are skipped, since they are deleted with it
+    :param root: The directory the paths are relative to
+    :param paths: The paths to delete
+    :param threads: The amount of threads
+    :return: The paths that could not be deleted
+    """
+    directories: Dict[str, List[str]] = {}
+    deleted = set()
+
+    for file in sorted(path.rstrip("/") for path in paths):
+        parent = os.path.dirname(file)
+
+        # Skip the paths whose ancestor is already deleted
+        ancestor = parent
+        while ancestor and ancestor not in deleted:
+            ancestor = os.path.dirname(ancestor)
+        if ancestor:
+            continue
+
+        deleted.add(file)
+        directories.setdefault(parent, []).append(os.path.basename(file))
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = executor.map(
+            lambda item: remove_entries(os.path.join(root, item[0]), item[1]),
+            directories.items(),
+        )
+        for (parent, _), names in zip(directories.items(), results):
+            failed.extend(os.path.join(parent, name) for name in names)
+
+    return failed
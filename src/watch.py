@@ -0,0 +1,205 @@
+#   Copyright (c) 2023, TriForMine. (https://triformine.dev) and samsoucoupe All rights reserved.
+#  #
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#  #
+#        http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import ctypes
+import ctypes.util
+import os
+import select
+import stat
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+from src.filelist import scan_directory
+
+# inotify flags, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+
+# struct inotify_event, without the name that follows it
+EVENT_HEADER = struct.Struct("iIII")
+
+# Maximum time the changes are delayed when they keep coming, in multiples of the watch delay
+MAX_DELAY_FACTOR = 10
+
+
+class Watcher:
+    directories: Dict[int, Tuple[int, str]]
+
+    def __init__(self, sources: List[str], recursive: bool = True):
+        """
+        Watch the changes in the source directories with inotify.
+        :param sources:  The source directories.
+        :param recursive:  Whether to watch the subdirectories.
+        """
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.sources = sources
+        self.recursive = recursive
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+        # Source index and path of the watched directories, by watch descriptor
+        self.directories = {}
+
+        for i, source in enumerate(sources):
+            if os.path.isdir(source):
+                self.add_directory(i, source)
+
+    def add_directory(self, source: int, path: str):
+        """
+        Watch a directory, and its subdirectories in recursive mode.
+        :param source:  The index of the source of the directory.
+        :param path:  The path to the directory.
+        :return: None
+        """
+        directories = [path]
+        if self.recursive:
+            directories += [
+                entry_path
+                for entry_path, entry_stat in scan_directory(path)
+                if stat.S_ISDIR(entry_stat.st_mode)
+            ]
+
+        for directory in directories:
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(directory), WATCH_MASK
+            )
+            if wd >= 0:
+                # A directory moved in the tree keeps its watch descriptor
+                self.directories[wd] = (source, directory)
+
+    def read_events(self, changes: Dict[Tuple[int, str], bool]) -> bool:
+        """
+        Read the pending events, and add the changed paths to the changes.
+        :param changes:  The changed paths, relative to their source, by source.
+        The value is whether the content of the path needs to be scanned, for new directories.
+        :return:  False if events were lost and the sources need to be scanned entirely.
+        """
+        complete = True
+
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return complete
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[
+                    offset + EVENT_HEADER.size : offset + EVENT_HEADER.size + length
+                ].rstrip(b"\0")
+                offset += EVENT_HEADER.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    complete = False
+                    continue
+
+                if mask & IN_IGNORED:
+                    self.directories.pop(wd, None)
+                    continue
+
+                if wd not in self.directories or not name:
+                    continue
+
+                source, directory = self.directories[wd]
+                path = os.path.join(directory, os.fsdecode(name))
+
+                new_directory = bool(
+                    mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO)
+                )
+                if new_directory and self.recursive:
+                    self.add_directory(source, path)
+
+                key = (source, os.path.relpath(path, self.sources[source]))
+                changes[key] = changes.get(key, False) or new_directory
+
+    def wait(self, delay: float) -> Optional[List[Tuple[int, str, bool]]]:
+        """
+        Wait for changes in the sources.
+        Once a change happens, the changes are gathered until none happens for the delay,
+        so a file being written or a directory being copied is only synchronized once.
+        :param delay:  The time without changes to wait for, in seconds.
+        :return:  The [source, path, scan content] of the changed paths, relative to their source,
+        or None if events were lost and the sources need to be scanned entirely.
+        """
+        changes = {}
+        complete = True
+        start = None
+
+        while True:
+            timeout = None
+            if start is not None:
+                # The changes are not delayed forever if they never stop
+                timeout = min(
+                    delay, start + delay * MAX_DELAY_FACTOR - time.monotonic()
+                )
+                if timeout <= 0:
+                    break
+
+            r, _, _ = select.select([self.fd], [], [], timeout)
+            if not r:
+                break
+
+            if start is None:
+                start = time.monotonic()
+            complete = self.read_events(changes) and complete
+
+        if not complete:
+            return None
+
+        # The content of the new directories is scanned, the changes inside them are already included
+        new_directories = {key for key, scan in changes.items() if scan}
+        paths = []
+        for (source, path), scan in sorted(changes.items()):
+            parent = os.path.dirname(path)
+            while parent and (source, parent) not in new_directories:
+                parent = os.path.dirname(parent)
+
+            if not parent:
+                paths.append([source, path, scan])
+
+        return paths
+
+    def close(self):
+        """
+        Stop watching the sources.
+        :return: None
+        """
+        os.close(self.fd)
@@ -0,0 +1,248 @@
+#   Copyright (c) 2023, TriForMine. (https://triformine.dev) and samsoucoupe All rights reserved.
+#  #
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#  #
+#        http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import os
+import queue
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Set
+
+# Amount of messages waiting to be written by each thread, before the network stops being read
+WRITE_QUEUE_SIZE = 16
+# Amount of written files synchronized together, with --fsync=batch
+FSYNC_BATCH_FILES = 256
+
+
+class Writer:
+    """
+    Applies the messages of the receiver to the disk in background threads, while the network keeps being read.
+    The messages of a file always go to the same thread, so they are applied in the order they were received.
+    """
+
+    def __init__(
+        self,
+        handle: Callable[[Any, Any], None],
+        threads: int = 1,
+        queue_size: int = WRITE_QUEUE_SIZE,
+    ):
+        """
+        :param handle: The function applying a message, called with its tag and its value
+        :param threads: The amount of threads writing to the disk
+        :param queue_size: The amount of messages waiting for each thread
+        """
+        self.handle = handle
+        self.queues: List[queue.Queue] = [
+            queue.Queue(maxsize=queue_size) for _ in range(max(threads, 1))
+        ]
+        self.error: Optional[BaseException] = None
+        self.threads = [
+            threading.Thread(target=self.work, args=(q,), daemon=True)
+            for q in self.queues
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def work(self, messages: queue.Queue):
+        """
+        Apply the messages of a queue until the writer is closed
+        :param messages: The queue of the thread
+        :return: None
+        """
+        while True:
+            message = messages.get()
+            try:
+                if message is None:
+                    return
+
+                # Once a message failed, the next ones are dropped until the error is raised
+                if self.error is None:
+                    self.handle(*message)
+            except BaseException as e:
+                self.error = e
+            finally:
+                messages.task_done()
+
+    def raise_error(self):
+        """
+        Raise the error of a message that failed to be applied
+        :return: None
+        """
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def submit(self, key: str, tag, value):
+        """
+        Queue a message, waiting while the queue of its thread is full
+        :param key: The path of the file of the message, which chooses its thread
+        :param tag: The tag of the message
+        :param value: The value of the message
+        :return: None
+        """
+        self.raise_error()
+        index = zlib.crc32(key.encode("utf-8", "surrogateescape")) % len(self.queues)
+        self.queues[index].put((tag, value))
+
+    def join(self):
+        """
+        Wait until all the queued messages are applied
+        :return: None
+        """
+        for messages in self.queues:
+            messages.join()
+        self.raise_error()
+
+    def close(self):
+        """
+        Apply the queued messages and stop the threads
+        :return: None
+        """
+        for messages in self.queues:
+            messages.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.raise_error()
+
+
+def fsync_path(path: str, directory: bool = False):
+    """
+    Flush a file or a directory to the disk
+    :param path: The path of the file or directory
+    :param directory: If the path is a directory
+    :return: None
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY | (os.O_DIRECTORY if directory else 0))
+    except FileNotFoundError:
+        # The file was deleted or replaced since it was written
+        return
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Syncer:
+    """
+    Flushes the written files and their directories to the disk, depending on the --fsync policy:
+    none leaves it to the system, file flushes each file as soon as it is written, batch flushes the files
+    in groups in a background thread, and end flushes all the files once the synchronization is finished.
+    """
+
+    def __init__(self, policy: str = "none", batch_files: int = FSYNC_BATCH_FILES):
+        """
+        :param policy: none, file, batch or end
+        :param batch_files: The amount of files flushed together, with batch
+        """
+        self.policy = policy
+        self.batch_files = batch_files
+        self.lock = threading.Lock()
+        self.files: List[str] = []
+        self.directories: Set[str] = set()
+        self.batches: List[Future] = []
+        # The thread flushing the batches, started by the first one
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    @staticmethod
+    def sync(files: List[str], directories: Set[str]):
+        """
+        Flush files, then the directories of their entries
+        :param files: The paths of the files
+        :param directories: The paths of the directories
+        :return: None
+        """
+        for path in files:
+            fsync_path(path)
+        for path in directories:
+            fsync_path(path, directory=True)
+
+    def submit(self):
+        """
+        Flush the files and directories collected so far in the background, must be called with the lock
+        :return: None
+        """
+        if self.files or self.directories:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1)
+            self.batches.append(
+                self.executor.submit(self.sync, self.files, self.directories)
+            )
+            self.files = []
+            self.directories = set()
+
+    def file_written(self, path: str, fd: int):
+        """
+        Called once the data and the info of a file are written
+        :param path: The path the file has once complete
+        :param fd: The open file descriptor of the file
+        :return: None
+        """
+        if self.policy == "file":
+            os.fsync(fd)
+        elif self.policy in ("batch", "end"):
+            with self.lock:
+                self.files.append(path)
+                if self.policy == "batch" and len(self.files) >= self.batch_files:
+                    self.submit()
+
+    def file_replacing(self, fd: int):
+        """
+        Called once a temporary file is complete, before it is renamed over a file.
+        It is flushed right away with every policy, since its data must be on the disk before the renaming.
+        :param fd: The open file descriptor of the temporary file
+        :return: None
+        """
+        if self.policy != "none":
+            os.fsync(fd)
+
+    def directory_changed(self, path: str):
+        """
+        Called once entries are created, renamed or deleted in a directory, or its info is applied
+        :param path: The path of the directory
+        :return: None
+        """
+        if self.policy == "file":
+            fsync_path(path, directory=True)
+        elif self.policy in ("batch", "end"):
+            with self.lock:
+                self.directories.add(path)
+
+    def flush(self):
+        """
+        Wait until all the written files are flushed to the disk
+        :return: None
+        """
+        if self.policy not in ("batch", "end"):
+            return
+
+        with self.lock:
+            self.submit()
+            batches = self.batches
+            self.batches = []
+
+        for batch in batches:
+            batch.result()
+
+    def close(self):
+        """
+        Wait until all the written files are flushed to the disk, and stop the thread flushing them
+        :return: None
+        """
+        self.flush()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -101,35 +101,50 @@ class ChecksumTest(unittest.TestCase):
             checksum.totalLength, checksum2.totalLength, "Total length is not equal."
         )
 
-    def test_compare_checksums_with_file(self):
+    def test_delta_with_offset(self):
         """
-        Test if the checksums are correct
+        Test if the delta reuses the basis when the data has moved
         :return:
         """
-        checksum = Checksum(self.file, divide=2)
-        parts = checksum.compare_with_file(self.file2)
-
-        self.assertGreater(len(parts), 0, "Parts length is not bigger than 0.")
+        checksum = Checksum(self.file, divide=1)
+        delta = checksum.get_delta(self.file3)
 
-        # The second part is different, it should be asking for 3 bytes from the 6th byte.
-        self.assertEqual(parts[0], (3, 6, 0), "The part is not correct.")
+        self.assertEqual(
+            delta,
+            [b" ", [0, 4]],
+            "It should send the new byte and then copy the whole basis.",
+        )
 
-    def test_compare_checksums_with_offset(self):
+    def test_delta_with_different_end(self):
         """
-        Test if the checksums are correct
+        Test if the delta only sends the parts that are not in the basis
         :return:
         """
-        checksum = Checksum(self.file, divide=1)
-        parts = checksum.compare_with_file(self.file3)
+        checksum = Checksum(self.file, divide=2)
+        delta = checksum.get_delta(self.file2)
 
-        self.assertEqual(len(parts), 2, "Parts length is not 2.")
+        self.assertEqual(
+            delta,
+            [[0, 3], b"t2"],
+            "It should copy the first part and send the rest.",
+        )
 
+    def test_delta_from_checksums(self):
+        """
+        Test if the delta is the same when the checksums are received
+        :return:
+        """
+        checksum = Checksum(self.file, divide=2)
+        checksum2 = Checksum(
+            checksums=checksum.checksums,
+            strong_checksums=checksum.strongChecksums,
+            total_length=checksum.totalLength,
+        )
         self.assertEqual(
-            parts[0],
-            (0, 4, 1),
-            "It should first tell to move bytes 0 from 4 by 1 byte.",
+            checksum.get_delta(self.file2),
+            checksum2.get_delta(self.file2),
+            "Deltas are not equal.",
         )
-        self.assertEqual(parts[1], (0, 1, 0), "It should then ask for bytes 0 to 1.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+#   Copyright (c) 2023, TriForMine. (https://triformine.dev) and samsoucoupe All rights reserved.
+#  #
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#  #
+#        http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from src.filelist import (
+    scan_directory,
+    generate_info,
+    prefix_checksum,
+    FileType,
+    FileListInfo,
+)
+from src.scan_cache import ScanCache
+from unittest import mock
+import os
+import tempfile
+from os import path
+import unittest
+
+
+class FileListTest(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+
+        os.makedirs(path.join(self.test_dir.name, "a", "b"))
+        for file in ["test.txt", path.join("a", "test.txt"), path.join("a", "b", "c")]:
+            with open(path.join(self.test_dir.name, file), "w") as f:
+                f.write("unit_tests")
+
+        # Broken symbolic links are skipped
+        os.symlink("missing", path.join(self.test_dir.name, "link"))
+
+    def tearDown(self) -> None:
+        self.test_dir.cleanup()
+
+    def test_scan_directory(self):
+        """
+        Test if all the entries are found, with the files of a directory before its subdirectories
+        """
+        entries = [
+            path.relpath(entry_path, self.test_dir.name)
+            for entry_path, _ in scan_directory(self.test_dir.name)
+        ]
+        self.assertEqual(
+            entries,
+            [
+                "test.txt",
+                "a",
+                path.join("a", "test.txt"),
+                path.join("a", "b"),
+                path.join("a", "b", "c"),
+            ],
+        )
+
+    def test_scan_directory_not_recursive(self):
+        """
+        Test if only the entries of the directory are found
+        """
+        entries = [
+            path.relpath(entry_path, self.test_dir.name)
+            for entry_path, _ in scan_directory(self.test_dir.name, recursive=False)
+        ]
+        self.assertEqual(entries, ["test.txt", "a"])
+
+    def test_scan_directory_threads(self):
+        """
+        Test if the entries are found in the same order with several threads
+        """
+        for i in range(20):
+            os.makedirs(path.join(self.test_dir.name, "a", str(i), "d"))
+
+        self.assertEqual(
+            [
+                entry_path
+                for entry_path, _ in scan_directory(self.test_dir.name, threads=8)
+            ],
+            [entry_path for entry_path, _ in scan_directory(self.test_dir.name)],
+        )
+
+        # Stopping the walk early cancels the directories left
+        scan = scan_directory(self.test_dir.name, threads=8)
+        next(scan)
+        scan.close()
+
+    def test_scan_directory_cache(self):
+        """
+        Test if the listings of unchanged directories are reused, and the changed directories are read again
+        """
+        cache_file = path.join(self.test_dir.name, "cache")
+        tree = path.join(self.test_dir.name, "a")
+        for directory in [tree, path.join(tree, "b")]:
+            os.utime(directory, (0, 0))
+
+        scan_cache = ScanCache(cache_file)
+        entries = list(scan_directory(tree, scan_cache=scan_cache))
+        scan_cache.save()
+
+        with mock.patch("src.filelist.os.scandir", side_effect=AssertionError):
+            self.assertEqual(
+                [entry_path for entry_path, _ in entries],
+                [
+                    entry_path
+                    for entry_path, _ in scan_directory(
+                        tree, scan_cache=ScanCache(cache_file)
+                    )
+                ],
+            )
+
+        with open(path.join(tree, "b", "d"), "w") as f:
+            f.write("unit_tests")
+
+        self.assertIn(
+            path.join(tree, "b", "d"),
+            [
+                entry_path
+                for entry_path, _ in scan_directory(
+                    tree, scan_cache=ScanCache(cache_file)
+                )
+            ],
+        )
+        with self.assertRaises(AssertionError):
+            with mock.patch("src.filelist.os.scandir", side_effect=AssertionError):
+                list(
+                    scan_directory(tree, scan_cache=ScanCache(cache_file, rescan=True))
+                )
+
+    def test_scan_cache_read_only(self):
+        """
+        Test if a read-only scan cache, used by a dry run, does not write the state file
+        """
+        cache_file = path.join(self.test_dir.name, "cache")
+        tree = path.join(self.test_dir.name, "a")
+
+        scan_cache = ScanCache(cache_file, read_only=True)
+        list(scan_directory(tree, scan_cache=scan_cache))
+        scan_cache.save()
+        self.assertFalse(path.exists(cache_file))
+
+    def test_generate_info_with_stat(self):
+        """
+        Test if the info generated from the stat of a scan is the same as from the path
+        """
+        options = FileListInfo.FILE_SIZE.value | FileListInfo.PERMISSIONS.value
+        for entry_path, entry_stat in scan_directory(self.test_dir.name):
+            self.assertEqual(
+                generate_info(entry_path, options, 0, path_stat=entry_stat),
+                generate_info(entry_path, options, 0),
+            )
+
+        info = generate_info(path.join(self.test_dir.name, "a"), options, 0)
+        self.assertEqual(info.type, FileType.DIRECTORY.value)
+
+    def test_prefix_checksum(self):
+        """
+        Test if a change anywhere in the prefix of a file changes its checksum
+        """
+        file = path.join(self.test_dir.name, "log")
+        data = bytearray(os.urandom(3 * 1024 * 1024))
+        with open(file, "wb") as f:
+            f.write(data)
+        length = 2 * 1024 * 1024 + 1
+        checksum = prefix_checksum(file, length)
+
+        with open(file, "ab") as f:
+            f.write(b"appended")
+        self.assertEqual(prefix_checksum(file, length), checksum)
+
+        with open(file, "r+b") as f:
+            f.seek(length // 2)
+            f.write(bytes([data[length // 2] ^ 0xFF]))
+        self.assertNotEqual(prefix_checksum(file, length), checksum)
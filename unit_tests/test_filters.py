@@ -0,0 +1,99 @@
+#   Copyright (c) 2023, TriForMine. (https://triformine.dev) and samsoucoupe All rights reserved.
+#  #
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#  #
+#        http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from src.filelist import scan_directory
+from src.filters import FilterRules, parse_filter_rule, EXCLUDE, INCLUDE
+import argparse
+import os
+import tempfile
+from os import path
+import unittest
+
+
+class FiltersTest(unittest.TestCase):
+    def test_parse_filter_rule(self):
+        """
+        Test if the short and long forms of the rules are parsed
+        """
+        self.assertEqual(parse_filter_rule("- *.o"), (EXCLUDE, "*.o"))
+        self.assertEqual(parse_filter_rule("include /src/"), (INCLUDE, "/src/"))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            parse_filter_rule("merge rules")
+
+    def test_patterns(self):
+        """
+        Test if the patterns match like in rsync
+        """
+        rules = FilterRules([(EXCLUDE, "*.o")])
+        self.assertTrue(rules.excluded("main.o", False))
+        self.assertTrue(rules.excluded("src/main.o", False))
+        self.assertFalse(rules.excluded("main.c", False))
+
+        rules = FilterRules([(EXCLUDE, "/build")])
+        self.assertTrue(rules.excluded("build", True))
+        self.assertFalse(rules.excluded("src/build", True))
+
+        rules = FilterRules([(EXCLUDE, "cache/")])
+        self.assertTrue(rules.excluded("a/cache", True))
+        self.assertFalse(rules.excluded("a/cache", False))
+
+        rules = FilterRules([(EXCLUDE, "src/*.c")])
+        self.assertTrue(rules.excluded("src/main.c", False))
+        self.assertFalse(rules.excluded("src/lib/main.c", False))
+
+        rules = FilterRules([(EXCLUDE, "src/**.c")])
+        self.assertTrue(rules.excluded("src/lib/main.c", False))
+
+    def test_first_match_wins(self):
+        """
+        Test if the first matching rule decides
+        """
+        rules = FilterRules([(INCLUDE, "keep.log"), (EXCLUDE, "*.log")])
+        self.assertFalse(rules.excluded("keep.log", False))
+        self.assertTrue(rules.excluded("other.log", False))
+
+    def test_excluded_path(self):
+        """
+        Test if the paths in an excluded directory are excluded
+        """
+        rules = FilterRules([(EXCLUDE, "node_modules/")])
+        self.assertTrue(rules.excluded_path("a/node_modules/b/c.js", False))
+        self.assertFalse(rules.excluded_path("a/b/c.js", False))
+
+    def test_scan_pruning(self):
+        """
+        Test if the excluded directories are not walked
+        """
+        with tempfile.TemporaryDirectory() as test_dir:
+            os.makedirs(path.join(test_dir, "node_modules", "a"))
+            os.makedirs(path.join(test_dir, "src"))
+
+            rules = FilterRules([(EXCLUDE, "node_modules/")])
+            root_length = len(path.join(test_dir, ""))
+            walked = []
+
+            def exclude(entry_path: str, is_dir: bool) -> bool:
+                walked.append(entry_path)
+                return rules.excluded(entry_path[root_length:], is_dir)
+
+            entries = [
+                entry_path[root_length:]
+                for entry_path, _ in scan_directory(test_dir, exclude=exclude)
+            ]
+            self.assertEqual(entries, ["src"])
+            self.assertNotIn(path.join(test_dir, "node_modules", "a"), walked)
+
+
+if __name__ == "__main__":
+    unittest.main()
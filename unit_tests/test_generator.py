@@ -0,0 +1,264 @@
+#   Copyright (c) 2023, TriForMine. (https://triformine.dev) and samsoucoupe All rights reserved.
+#  #
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#  #
+#        http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from src.filelist import FileEntry, FileType
+from src.generator import Generator, tree_block_size
+from src.logger import Logger
+import os
+import tempfile
+import time
+import unittest
+
+
+def get_args(**kwargs) -> Namespace:
+    args = {
+        "checksum": False,
+        "update": False,
+        "ignore_times": False,
+        "append_verify": False,
+        "tree_signatures": False,
+        "filters": None,
+        "order": "path",
+        "bundle": False,
+        "delete": False,
+        "dry_run": False,
+        "stats": False,
+        "perms": False,
+    }
+    args.update(kwargs)
+    return Namespace(**args)
+
+
+class GeneratorTest(unittest.TestCase):
+    def setUp(self):
+        self.destination = tempfile.TemporaryDirectory()
+        for file in ["same", "modified", "extra"]:
+            with open(os.path.join(self.destination.name, file), "w") as f:
+                f.write("unit_tests")
+
+    def tearDown(self):
+        self.destination.cleanup()
+
+    def get_generator(self, source_list, destination_list) -> Generator:
+        return Generator(
+            None,
+            ["src/"],
+            self.destination.name + "/",
+            source_list,
+            destination_list,
+            Logger(),
+            get_args(),
+        )
+
+    def test_diff(self):
+        """
+        Test if the entries are classified as missing, extra and modified
+        """
+        generator = self.get_generator(
+            [
+                FileEntry(FileType.FILE.value, "same", 0, 1, size=10),
+                FileEntry(FileType.FILE.value, "modified", 0, 2, size=10),
+                FileEntry(FileType.FILE.value, "missing", 0, 1, size=10),
+                FileEntry(FileType.FILE.value, "link", 0, 1, size=10, hard_link="same"),
+            ],
+            [
+                FileEntry(FileType.FILE.value, "same", 0, 1, size=10),
+                FileEntry(FileType.FILE.value, "modified", 0, 1, size=10),
+                FileEntry(FileType.FILE.value, "extra", 0, 1, size=10),
+            ],
+        )
+
+        self.assertEqual(generator.get_missing_files(), (["missing"], [0]))
+        self.assertEqual(generator.get_extra_files(), ["extra"])
+        modified_files, _, _, _, total_lengths = generator.get_modified_files()
+        self.assertEqual(modified_files, ["modified"])
+        self.assertEqual(total_lengths, [10])
+
+    def test_block_size(self):
+        """
+        Test if the checksums keep the block size of the baseline, and the hash trees use the square root of the size
+        """
+        with open(os.path.join(self.destination.name, "big"), "wb") as f:
+            f.truncate(1000000)
+
+        generator = self.get_generator(
+            [FileEntry(FileType.FILE.value, "big", 0, 2, size=1000000)],
+            [FileEntry(FileType.FILE.value, "big", 0, 1, size=1000000)],
+        )
+        (request,) = generator.get_modified_requests()
+        # Blocks of int(2 ** 21 ** 0.5) = 23 bytes
+        self.assertEqual(request[3], 43479)
+
+        self.assertEqual(tree_block_size(1000), 700)
+        self.assertEqual(tree_block_size(1000000), 1000)
+        self.assertEqual(tree_block_size(10**12), 131072)
+
+    def test_order(self):
+        """
+        Test if the missing files are asked in the chosen order
+        """
+        source_list = [
+            FileEntry(FileType.FILE.value, "a", 0, 1, size=30, inode=2),
+            FileEntry(FileType.FILE.value, "b", 0, 1, size=10, inode=3, extent=8192),
+            FileEntry(FileType.FILE.value, "c", 0, 1, size=20, inode=1, extent=4096),
+        ]
+
+        for order, files in [
+            ("path", ["a", "b", "c"]),
+            ("inode", ["c", "a", "b"]),
+            # The files without an extent come last
+            ("extent", ["c", "b", "a"]),
+            ("size-asc", ["b", "c", "a"]),
+            ("size-desc", ["a", "c", "b"]),
+        ]:
+            generator = self.get_generator(source_list, [])
+            generator.args.order = order
+            generator.schedule = generator.get_schedule()
+            self.assertEqual(generator.get_missing_files()[0], files)
+
+    def test_bundles(self):
+        """
+        Test if the small missing and modified files are grouped in bundles
+        """
+        source_list = [
+            FileEntry(FileType.FILE.value, f"{i:02}", 0, 1, size=60 * 1024)
+            for i in range(20)
+        ] + [
+            FileEntry(FileType.DIRECTORY.value, "dir", 0, 1, size=4096),
+            FileEntry(FileType.FILE.value, "big", 0, 1, size=1024 * 1024),
+        ]
+        generator = self.get_generator(source_list, [])
+        missing_files, files_sources = generator.get_missing_files()
+
+        generator.source_list += [
+            FileEntry(FileType.FILE.value, "modified", 0, 1, size=10),
+            FileEntry(FileType.FILE.value, "appended", 0, 1, size=20),
+        ]
+        modified_requests = [
+            ["modified", 0, "", 1, None],
+            ["appended", 0, "", 1, [None, None, 10]],
+        ]
+
+        bundles, files, sources, requests = generator.get_bundles(
+            missing_files, files_sources, modified_requests
+        )
+        # The data of a bundle is at most 1 MiB
+        self.assertEqual(
+            bundles,
+            [
+                [[f"{i:02}", 0] for i in range(17)],
+                [[f"{i:02}", 0] for i in range(17, 20)] + [["modified", 0]],
+            ],
+        )
+        self.assertEqual(files, ["big", "dir"])
+        self.assertEqual(sources, [0, 0])
+        self.assertEqual(requests, [modified_requests[1]])
+
+    def test_transfer_plan(self):
+        """
+        Test if the files of each category are counted in the transfer plan
+        """
+        source_list = [
+            FileEntry(FileType.FILE.value, "same", 0, 1, size=10),
+            FileEntry(FileType.FILE.value, "modified", 0, 2, size=30),
+            FileEntry(FileType.FILE.value, "new", 0, 1, size=20),
+            FileEntry(FileType.DIRECTORY.value, "dir", 0, 1, size=4096),
+            FileEntry(FileType.FILE.value, "link", 0, 1, size=20, hard_link="new"),
+        ]
+        destination_list = [
+            FileEntry(FileType.FILE.value, "same", 0, 1, size=10),
+            FileEntry(FileType.FILE.value, "modified", 0, 1, size=10),
+            FileEntry(FileType.FILE.value, "extra", 0, 1, size=10),
+        ]
+
+        generator = self.get_generator(source_list, destination_list)
+        plan = generator.get_transfer_plan()
+
+        self.assertEqual(plan["new_files"], 1)
+        self.assertEqual(plan["new_directories"], 1)
+        self.assertEqual(plan["modified_files"], 1)
+        self.assertEqual(plan["unchanged_files"], 1)
+        self.assertEqual(plan["hard_links"], 1)
+        self.assertEqual(plan["extra_files"], 1)
+        self.assertEqual(plan["total_bytes"], 60)
+        # The modified files are counted whole without their deltas
+        self.assertEqual(plan["literal_bytes"], 50)
+        self.assertFalse(plan["deltas"])
+
+    def test_directories_info(self):
+        """
+        Test if the existing directories are only updated when they differ or their entries change
+        """
+        source_list = [
+            FileEntry(FileType.DIRECTORY.value, "same", 0, 1),
+            FileEntry(FileType.DIRECTORY.value, "older", 0, 2),
+            FileEntry(FileType.DIRECTORY.value, "changed", 0, 1),
+            FileEntry(FileType.FILE.value, "changed/new", 0, 1, size=10),
+            FileEntry(FileType.DIRECTORY.value, "missing", 0, 1),
+        ]
+        destination_list = [
+            FileEntry(FileType.DIRECTORY.value, "same", 0, 1),
+            FileEntry(FileType.DIRECTORY.value, "older", 0, 1),
+            FileEntry(FileType.DIRECTORY.value, "changed", 0, 1),
+        ]
+
+        generator = self.get_generator(source_list, destination_list)
+        missing_files, files_sources = generator.get_missing_files()
+        directories = generator.get_directories_info(
+            missing_files, files_sources, generator.get_modified_requests(), []
+        )
+
+        self.assertEqual([file for file, _ in directories], ["changed", "older"])
+
+    def test_diff_many_files(self):
+        """
+        Test if big lists are compared in linear time
+        """
+        source_list = [
+            FileEntry(FileType.FILE.value, f"{i}", 0, 1, size=10) for i in range(200000)
+        ]
+        destination_list = [
+            FileEntry(FileType.FILE.value, f"{i}", 0, 1, size=10)
+            for i in range(1, 200001)
+        ]
+
+        start = time.monotonic()
+        generator = self.get_generator(source_list, destination_list)
+        self.assertEqual(generator.get_missing_files(), (["0"], [0]))
+        self.assertEqual(generator.get_extra_files(), ["200000"])
+        self.assertEqual(generator.get_modified_files()[0], [])
+        self.assertLess(time.monotonic() - start, 10)
+
+    def test_signatures(self):
+        """
+        Test if the signatures calculated in the background are given in the order of the requests
+        """
+        generator = self.get_generator([], [])
+        destination_path = os.path.join(self.destination.name, "same")
+        requests = [
+            [f"{i}", 0, destination_path, 1, None if i % 2 else [[], [], 0]]
+            for i in range(50)
+        ]
+
+        executor = ThreadPoolExecutor(max_workers=4)
+        signatures = list(generator.get_signatures(executor, requests))
+        executor.shutdown()
+
+        self.assertEqual([request for request, _ in signatures], requests)
+        self.assertEqual(
+            [signature for _, signature in signatures],
+            [Generator.get_signature(request) for request in requests],
+        )
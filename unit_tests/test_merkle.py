@@ -0,0 +1,91 @@
+#   Copyright (c) 2023, TriForMine. (https://triformine.dev) and samsoucoupe All rights reserved.
+#  #
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#  #
+#        http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from src.merkle import MerkleTree
+import tempfile
+from os import path
+import unittest
+
+
+class MerkleTreeTest(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+
+        self.file = path.join(self.test_dir.name, "test.txt")
+        self.file2 = path.join(self.test_dir.name, "test2.txt")
+
+        self.data = bytes(range(256)) * 40
+        with open(self.file, "wb") as f:
+            f.write(self.data)
+
+        with open(self.file2, "wb") as f:
+            f.write(self.data[:5000] + b"x" + self.data[5001:] + b"tail")
+
+    def tearDown(self) -> None:
+        self.test_dir.cleanup()
+
+    def test_tree_levels(self):
+        """
+        Test if the tree has the right amount of nodes in each level
+        :return:
+        """
+        tree = MerkleTree(self.file, 100, fanout=4)
+        self.assertEqual(
+            [tree.count(level) for level in range(tree.depth + 1)],
+            [103, 26, 7, 2],
+            "The levels are not correct.",
+        )
+
+    def test_same_file(self):
+        """
+        Test if the same file has no differences
+        :return:
+        """
+        tree = MerkleTree(self.file, 100, fanout=4)
+        tree2 = MerkleTree(self.file, 100, tree.depth, fanout=4)
+        nodes = [[i, tree.node(tree.depth, i)] for i in range(tree.count(tree.depth))]
+
+        self.assertEqual(
+            tree2.get_differences(tree.depth, nodes), [], "There are differences."
+        )
+
+    def test_different_leaves(self):
+        """
+        Test if going down the tree finds the different leaves
+        :return:
+        """
+        tree = MerkleTree(self.file, 100, fanout=4)
+        tree2 = MerkleTree(self.file2, 100, tree.depth, fanout=4)
+
+        level = tree.depth
+        differences = tree2.get_differences(
+            level, [[i, tree.node(level, i)] for i in range(tree.count(level))]
+        )
+        while level > 0:
+            level -= 1
+            differences = tree2.get_differences(
+                level,
+                [
+                    [child, tree.node(level, child)]
+                    for node in differences
+                    for child in range(node * 4, (node + 1) * 4)
+                ],
+            )
+
+        # The modified byte is in the leaf 50, and the tail is added to the last leaf
+        self.assertEqual(differences, [50, 102], "The leaves are not correct.")
+
+
+if __name__ == "__main__":
+    unittest.main()
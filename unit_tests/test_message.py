@@ -13,6 +13,7 @@
 #    limitations under the License.
 import os
 
+from src.filelist import FileEntry
 from src.message import send, MESSAGE_TAG, recv, FileDescriptorMethod
 import unittest
 
@@ -91,6 +92,21 @@ class TestMessage(unittest.TestCase):
             (MESSAGE_TAG.FILE_DATA, ("unit_tests.txt", {"mtime": 0}, 0, 0, True, data)),
         )
 
+    def test_file_list(self):
+        """
+        Test if the entries of a file list are correctly sent and received
+        :return:
+        """
+        file_list = [
+            FileEntry(1, "", 0, 10, size=4096, permissions=0o40755),
+            FileEntry(0, "a/b", 0, 20, size=3, checksum="abc", hard_link="c"),
+        ]
+        send(FileDescriptorMethod(self.pipes[1]), MESSAGE_TAG.FILE_LIST, file_list)
+        self.assertEqual(
+            recv(FileDescriptorMethod(self.pipes[0])),
+            (MESSAGE_TAG.FILE_LIST, file_list),
+        )
+
     def test_timeout(self):
         """
         Test if the timeout is triggered when no message is sent
@@ -16,6 +16,8 @@ import unittest
 import subprocess
 import os
 import tempfile
+import time
+import signal
 
 
 class TestMrSync(unittest.TestCase):
@@ -135,6 +137,41 @@ class TestMrSync(unittest.TestCase):
             "Directory is not in the list",
         )
 
+    def test_list_only_streamed(self):
+        """
+        Test the --list-only option with the NUL-ended records
+        :return:
+        """
+        result = subprocess.run(
+            [
+                "python3",
+                "mrsync.py",
+                "--list-only",
+                "--recursive",
+                "--list-format",
+                "null",
+                self.test_src_dir.name,
+            ],
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self.assertEqual(result.returncode, 0, "Return code is not 0")
+
+        records = result.stdout.decode().split("\0")
+        self.assertEqual(records[-1], "", "The last record is not ended")
+        self.assertEqual(
+            [record.split(" ")[-1] for record in records[:-1]],
+            [
+                os.path.basename(self.test_src_dir.name),
+                os.path.join(
+                    os.path.basename(self.test_src_dir.name),
+                    os.path.basename(self.test_file),
+                ),
+            ],
+        )
+        self.assertTrue(records[1].startswith("-rw"), "The mode is not listed")
+
     def test_sync(self):
         """
         Test the sync
@@ -342,6 +379,381 @@ class TestMrSync(unittest.TestCase):
         ) as f:
             self.assertEqual(f.read(), "unit_tests", "File is not the same")
 
+    def test_sync_update_delta(self):
+        """
+        Test the sync of a file that only changed in the middle
+        :return:
+        """
+        data = os.urandom(100000)
+        new_data = data[:40000] + b"changed" + data[41000:]
+
+        with open(os.path.join(self.test_src_dir.name, "data.bin"), "wb") as f:
+            f.write(new_data)
+
+        with open(os.path.join(self.test_dst_dir.name, "data.bin"), "wb") as f:
+            f.write(data)
+
+        result = subprocess.run(
+            [
+                "python3",
+                "mrsync.py",
+                "-q",
+                "-r",
+                self.test_src_dir.name + "/",
+                self.test_dst_dir.name,
+            ],
+            check=True,
+        )
+        self.assertEqual(result.returncode, 0)
+
+        # Check if the file is the same
+        with open(os.path.join(self.test_dst_dir.name, "data.bin"), "rb") as f:
+            self.assertEqual(f.read(), new_data, "File is not the same")
+
+    def test_sync_update_tree_signatures(self):
+        """
+        Test the sync of a big file compared with a hash tree
+        :return:
+        """
+        data = os.urandom(10000000)
+        new_data = data[:4000000] + b"changed" + data[4000007:] + b"tail"
+
+        with open(os.path.join(self.test_src_dir.name, "data.bin"), "wb") as f:
+            f.write(new_data)
+
+        with open(os.path.join(self.test_dst_dir.name, "data.bin"), "wb") as f:
+            f.write(data)
+
+        result = subprocess.run(
+            [
+                "python3",
+                "mrsync.py",
+                "-q",
+                "-r",
+                "--tree-signatures",
+                self.test_src_dir.name + "/",
+                self.test_dst_dir.name,
+            ],
+            check=True,
+        )
+        self.assertEqual(result.returncode, 0)
+
+        # Check if the file is the same
+        with open(os.path.join(self.test_dst_dir.name, "data.bin"), "rb") as f:
+            self.assertEqual(f.read(), new_data, "File is not the same")
+
+    def test_sync_update_with_checksum(self):
+        """
+        Test the sync with the --checksum option and a file with the same size and time
+        :return:
+        """
+        destination_file = os.path.join(
+            self.test_dst_dir.name, os.path.basename(self.test_file)
+        )
+        with open(destination_file, "w") as f:
+            f.write("unit_test2")
+
+        stat = os.stat(self.test_file)
+        os.utime(destination_file, (stat.st_atime, stat.st_mtime))
+
+        result = subprocess.run(
+            [
+                "python3",
+                "mrsync.py",
+                "-q",
+                "-r",
+                "--checksum",
+                self.test_src_dir.name + "/",
+                self.test_dst_dir.name,
+            ],
+            check=True,
+        )
+        self.assertEqual(result.returncode, 0)
+
+        # Check if the file is the same
+        with open(destination_file, "r") as f:
+            self.assertEqual(f.read(), "unit_tests", "File is not the same")
+
+    def test_sync_update_append_verify(self):
+        """
+        Test the sync of files that grew with the --append-verify option
+        :return:
+        """
+        test_file2 = os.path.join(self.test_src_dir.name, "test2.txt")
+        with open(self.test_file, "a") as f:
+            f.write(" appended")
+        with open(test_file2, "w") as f:
+            f.write("unit_tests appended")
+
+        # The first file only grew, the start of the second file is different
+        destination_file = os.path.join(
+            self.test_dst_dir.name, os.path.basename(self.test_file)
+        )
+        destination_file2 = os.path.join(self.test_dst_dir.name, "test2.txt")
+        with open(destination_file, "w") as f:
+            f.write("unit_tests")
+        with open(destination_file2, "w") as f:
+            f.write("unit_test2")
+
+        os.utime(destination_file, (0, 0))
+        os.utime(destination_file2, (0, 0))
+
+        result = subprocess.run(
+            [
+                "python3",
+                "mrsync.py",
+                "-q",
+                "-r",
+                "--append-verify",
+                self.test_src_dir.name + "/",
+                self.test_dst_dir.name,
+            ],
+            check=True,
+        )
+        self.assertEqual(result.returncode, 0)
+
+        with open(destination_file, "r") as f:
+            self.assertEqual(f.read(), "unit_tests appended", "File is not the same")
+        with open(destination_file2, "r") as f:
+            self.assertEqual(f.read(), "unit_tests appended", "File is not the same")
+
+    def test_sync_append_file_info(self):
+        """
+        Test the info of a file that grew, applied once its appended data is written
+        :return:
+        """
+        data = os.urandom(1024 * 1024)
+        big_file = os.path.join(self.test_src_dir.name, "big")
+        with open(big_file, "wb") as f:
+            f.write(data * 2)
+        os.chmod(big_file, 0o640)
+
+        destination_file = os.path.join(self.test_dst_dir.name, "big")
+        with open(destination_file, "wb") as f:
+            f.write(data)
+
+        result = subprocess.run(
+            [
+                "python3",
+                "mrsync.py",
+                "-q",
+                "-r",
+                "-t",
+                "-p",
+                "--append-verify",
+                self.test_src_dir.name + "/",
+                self.test_dst_dir.name,
+            ],
+            check=True,
+        )
+        self.assertEqual(result.returncode, 0)
+
+        with open(destination_file, "rb") as f:
+            self.assertEqual(f.read(), data * 2, "File is not the same")
+        # The info is applied once all the data is written
+        self.assertEqual(os.stat(destination_file).st_mode & 0o777, 0o640)
+        self.assertEqual(
+            os.stat(destination_file).st_mtime, int(os.stat(big_file).st_mtime)
+        )
+
+    def test_sync_directory_times(self):
+        """
+        Test the times of the directories, applied once the files inside them are written
+        :return:
+        """
+        directory = os.path.join(self.test_src_dir.name, "a", "b")
+        os.makedirs(directory)
+        with open(os.path.join(directory, "test2.txt"), "w") as f:
+            f.write("test2")
+        os.utime(directory, (0, 1000000))
+        os.utime(os.path.dirname(directory), (0, 2000000))
+
+        for _ in range(2):
+            result = subprocess.run(
+                [
+                    "python3",
+                    "mrsync.py",
+                    "-q",
+                    "-r",
+                    "-t",
+                    self.test_src_dir.name + "/",
+                    self.test_dst_dir.name,
+                ],
+                check=True,
+            )
+            self.assertEqual(result.returncode, 0)
+
+            self.assertEqual(
+                os.stat(os.path.join(self.test_dst_dir.name, "a", "b")).st_mtime,
+                1000000,
+            )
+            self.assertEqual(
+                os.stat(os.path.join(self.test_dst_dir.name, "a")).st_mtime, 2000000
+            )
+
+            # A new file in an existing directory
+            with open(os.path.join(directory, "test3.txt"), "w") as f:
+                f.write("test3")
+            os.utime(directory, (0, 1000000))
+
+    def test_sync_directory_times_relative_destination(self):
+        """
+        Test the times of the top-level directories of a relative destination
+        :return:
+        """
+        directory = os.path.join(self.test_src_dir.name, "a")
+        os.makedirs(directory)
+        with open(os.path.join(directory, "test2.txt"), "w") as f:
+            f.write("test2")
+        os.utime(directory, (0, 1000000))
+
+        result = subprocess.run(
+            [
+                "python3",
+                os.path.abspath("mrsync.py"),
+                "-q",
+                "-r",
+                "-t",
+                self.test_src_dir.name + "/",
+                ".",
+            ],
+            cwd=self.test_dst_dir.name,
+            check=True,
+        )
+        self.assertEqual(result.returncode, 0)
+
+        self.assertEqual(
+            os.stat(os.path.join(self.test_dst_dir.name, "a")).st_mtime, 1000000
+        )
+
+    def test_sync_hard_links(self):
+        """
+        Test the sync of files linked together with the --hard-links option
+        :return:
+        """
+        os.makedirs(os.path.join(self.test_src_dir.name, "dir"))
+        link = os.path.join(self.test_src_dir.name, "dir", "link.txt")
+        os.link(self.test_file, link)
+
+        # A copy of the file is replaced by a link
+        os.makedirs(os.path.join(self.test_dst_dir.name, "dir"))
+        destination_link = os.path.join(self.test_dst_dir.name, "dir", "link.txt")
+        with open(destination_link, "w") as f:
+            f.write("unit_tests")
+
+        result = subprocess.run(
+            [
+                "python3",
+                "mrsync.py",
+                "-q",
+                "-r",
+                "-H",
+                self.test_src_dir.name + "/",
+                self.test_dst_dir.name,
+            ],
+            check=True,
+        )
+        self.assertEqual(result.returncode, 0)
+
+        destination_file = os.path.join(
+            self.test_dst_dir.name, os.path.basename(self.test_file)
+        )
+        self.assertTrue(
+            os.path.samefile(destination_file, destination_link),
+            "Files are not linked",
+        )
+        with open(destination_link, "r") as f:
+            self.assertEqual(f.read(), "unit_tests", "File is not the same")
+
+    def test_sync_watch(self):
+        """
+        Test the synchronization of the changes with the --watch option
+        :return:
+        """
+        process = subprocess.Popen(
+            [
+                "python3",
+                "mrsync.py",
+                "-q",
+                "-r",
+                "--delete",
+                "--watch",
+                "--watch-delay",
+                "0.1",
+                self.test_src_dir.name + "/",
+                self.test_dst_dir.name,
+            ]
+        )
+
+        def wait_for(condition):
+            for _ in range(100):
+                if condition():
+                    return True
+                time.sleep(0.1)
+            return False
+
+        destination_file = os.path.join(
+            self.test_dst_dir.name, os.path.basename(self.test_file)
+        )
+        new_file = os.path.join(self.test_dst_dir.name, "dir", "new.txt")
+        try:
+            self.assertTrue(wait_for(lambda: os.path.exists(destination_file)))
+
+            # Create a directory with a file in it, and delete the first file
+            os.makedirs(os.path.join(self.test_src_dir.name, "dir"))
+            with open(os.path.join(self.test_src_dir.name, "dir", "new.txt"), "w") as f:
+                f.write("unit_tests")
+            os.remove(self.test_file)
+
+            self.assertTrue(
+                wait_for(
+                    lambda: os.path.exists(new_file)
+                    and not os.path.exists(destination_file)
+                ),
+                "Changes are not synchronized",
+            )
+            with open(new_file, "r") as f:
+                self.assertEqual(f.read(), "unit_tests", "File is not the same")
+        finally:
+            process.send_signal(signal.SIGINT)
+            self.assertEqual(process.wait(timeout=10), 0)
+
+    def test_sync_sparse(self):
+        """
+        Test the sync of a sparse file with the --sparse option
+        :return:
+        """
+        sparse_file = os.path.join(self.test_src_dir.name, "sparse.bin")
+        with open(sparse_file, "wb") as f:
+            f.truncate(8 * 1024 * 1024)
+            f.seek(4 * 1024 * 1024)
+            f.write(b"unit_tests")
+
+        result = subprocess.run(
+            [
+                "python3",
+                "mrsync.py",
+                "-q",
+                "-r",
+                "-S",
+                self.test_src_dir.name + "/",
+                self.test_dst_dir.name,
+            ],
+            check=True,
+        )
+        self.assertEqual(result.returncode, 0)
+
+        destination_file = os.path.join(self.test_dst_dir.name, "sparse.bin")
+        with open(sparse_file, "rb") as f1, open(destination_file, "rb") as f2:
+            self.assertEqual(f1.read(), f2.read(), "File is not the same")
+
+        # The holes are not allocated
+        self.assertLess(
+            os.stat(destination_file).st_blocks * 512,
+            8 * 1024 * 1024,
+            "File is not sparse",
+        )
+
     def test_sync_update_with_delete(self):
         """
         Test the sync with an updated file and the --delete option
@@ -377,6 +789,416 @@ class TestMrSync(unittest.TestCase):
             "File exists in the destination directory",
         )
 
+    def test_sync_delete_timing(self):
+        """
+        Test the deletion of extra directory trees before, during and after the transfer
+        :return:
+        """
+        for timing in ["before", "during", "after"]:
+            extra_dir = os.path.join(self.test_dst_dir.name, "extra", "a")
+            os.makedirs(extra_dir, exist_ok=True)
+            for i in range(20):
+                with open(os.path.join(extra_dir, f"{i}.txt"), "w") as f:
+                    f.write("extra")
+            os.symlink(self.test_src_dir.name, os.path.join(extra_dir, "link"))
+
+            result = subprocess.run(
+                [
+                    "python3",
+                    "mrsync.py",
+                    "-q",
+                    "-r",
+                    f"--delete-{timing}",
+                    self.test_src_dir.name + "/",
+                    self.test_dst_dir.name,
+                ],
+                check=True,
+            )
+            self.assertEqual(result.returncode, 0)
+
+            self.assertEqual(
+                os.listdir(self.test_dst_dir.name), ["unit_tests.txt"], timing
+            )
+            # The symbolic link is deleted, not what it points to
+            self.assertTrue(os.path.exists(self.test_file))
+
+    def test_sync_with_exclude(self):
+        """
+        Test the sync with excluded files, which are not copied nor deleted
+        :return:
+        """
+        os.makedirs(os.path.join(self.test_src_dir.name, "node_modules", "a"))
+        with open(
+            os.path.join(self.test_src_dir.name, "node_modules", "a", "index.js"), "w"
+        ) as f:
+            f.write("unit_tests")
+
+        # Create an excluded file in the destination directory
+        with open(os.path.join(self.test_dst_dir.name, "debug.log"), "w") as f:
+            f.write("unit_tests")
+
+        result = subprocess.run(
+            [
+                "python3",
+                "mrsync.py",
+                "-q",
+                "-r",
+                "--delete",
+                "--exclude",
+                "node_modules/",
+                "--filter",
+                "- *.log",
+                self.test_src_dir.name + "/",
+                self.test_dst_dir.name,
+            ],
+            check=True,
+        )
+        self.assertEqual(result.returncode, 0)
+
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(self.test_dst_dir.name, os.path.basename(self.test_file))
+            )
+        )
+        self.assertFalse(
+            os.path.exists(os.path.join(self.test_dst_dir.name, "node_modules")),
+            "Excluded directory exists in the destination directory",
+        )
+        self.assertTrue(
+            os.path.exists(os.path.join(self.test_dst_dir.name, "debug.log")),
+            "Excluded file was deleted from the destination directory",
+        )
+
+    def test_sync_files_from(self):
+        """
+        Test the sync of the paths listed in a file only
+        :return:
+        """
+        os.makedirs(os.path.join(self.test_src_dir.name, "a"))
+        with open(os.path.join(self.test_src_dir.name, "a", "test2.txt"), "w") as f:
+            f.write("test2")
+
+        files_from = os.path.join(self.test_src_dir.name, "files")
+        with open(files_from, "w") as f:
+            f.write("# comment\na/test2.txt\n")
+
+        result = subprocess.run(
+            [
+                "python3",
+                "mrsync.py",
+                "-q",
+                "--files-from",
+                files_from,
+                self.test_src_dir.name + "/",
+                self.test_dst_dir.name,
+            ],
+            check=True,
+        )
+        self.assertEqual(result.returncode, 0)
+
+        with open(os.path.join(self.test_dst_dir.name, "a", "test2.txt"), "r") as f:
+            self.assertEqual(f.read(), "test2")
+        self.assertFalse(
+            os.path.exists(
+                os.path.join(self.test_dst_dir.name, os.path.basename(self.test_file))
+            ),
+            "File not listed exists in the destination directory",
+        )
+
+    def test_sync_files_from_whole_source(self):
+        """
+        Test the sync of a whole source listed as . in a file
+        :return:
+        """
+        os.makedirs(os.path.join(self.test_src_dir.name, "a"))
+        with open(os.path.join(self.test_src_dir.name, "a", "test2.txt"), "w") as f:
+            f.write("test2")
+
+        with tempfile.NamedTemporaryFile("w", suffix=".files") as files_from:
+            files_from.write(".\n")
+            files_from.flush()
+
+            result = subprocess.run(
+                [
+                    "python3",
+                    "mrsync.py",
+                    "-q",
+                    "-r",
+                    "--files-from",
+                    files_from.name,
+                    self.test_src_dir.name + "/",
+                    self.test_dst_dir.name,
+                ],
+                check=True,
+            )
+        self.assertEqual(result.returncode, 0)
+
+        result = subprocess.run(
+            ["diff", "-r", self.test_src_dir.name, self.test_dst_dir.name],
+            stdout=subprocess.PIPE,
+        )
+        self.assertEqual(result.returncode, 0, result.stdout.decode())
+
+    def test_files_from_outside_sources(self):
+        """
+        Test if the listed paths going out of the sources are refused
+        :return:
+        """
+        with tempfile.NamedTemporaryFile("w", suffix=".files") as files_from:
+            files_from.write("../../etc/passwd\n")
+            files_from.flush()
+
+            result = subprocess.run(
+                [
+                    "python3",
+                    "mrsync.py",
+                    "-q",
+                    "--files-from",
+                    files_from.name,
+                    self.test_src_dir.name + "/",
+                    self.test_dst_dir.name,
+                ],
+                stderr=subprocess.PIPE,
+                timeout=60,
+            )
+        self.assertNotEqual(result.returncode, 0)
+        self.assertEqual(os.listdir(self.test_dst_dir.name), [])
+
+    def test_files_from_stdin_remote_source(self):
+        """
+        Test if the list of paths cannot be read from the standard input of a remote sender
+        :return:
+        """
+        result = subprocess.run(
+            [
+                "python3",
+                "mrsync.py",
+                "--files-from",
+                "-",
+                "localhost:" + self.test_src_dir.name + "/",
+                self.test_dst_dir.name,
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=60,
+        )
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(os.listdir(self.test_dst_dir.name), [])
+
+    def test_sync_bundle(self):
+        """
+        Test the sync of small files in bundles, with the missing and modified files
+        :return:
+        """
+        os.makedirs(os.path.join(self.test_src_dir.name, "a"))
+        for i in range(50):
+            with open(os.path.join(self.test_src_dir.name, "a", f"{i}.txt"), "w") as f:
+                f.write(f"small file {i}")
+        with open(os.path.join(self.test_src_dir.name, "empty.txt"), "w") as f:
+            pass
+
+        # Create a modified file in the destination directory
+        with open(
+            os.path.join(self.test_dst_dir.name, os.path.basename(self.test_file)), "w"
+        ) as f:
+            f.write("outdated")
+
+        result = subprocess.run(
+            [
+                "python3",
+                "mrsync.py",
+                "-q",
+                "-r",
+                "-z",
+                "--bundle",
+                self.test_src_dir.name + "/",
+                self.test_dst_dir.name,
+            ],
+            check=True,
+        )
+        self.assertEqual(result.returncode, 0)
+
+        result = subprocess.run(
+            ["diff", "-r", self.test_src_dir.name, self.test_dst_dir.name],
+            stdout=subprocess.PIPE,
+        )
+        self.assertEqual(result.returncode, 0, result.stdout.decode())
+
+    def test_sync_write_threads(self):
+        """
+        Test the sync with the files written by several threads
+        :return:
+        """
+        for directory in range(4):
+            os.makedirs(os.path.join(self.test_src_dir.name, f"{directory}"))
+            for i in range(25):
+                with open(
+                    os.path.join(self.test_src_dir.name, f"{directory}", f"{i}.txt"),
+                    "w",
+                ) as f:
+                    f.write(f"file {i}" * i)
+
+        result = subprocess.run(
+            [
+                "python3",
+                "mrsync.py",
+                "-q",
+                "-r",
+                "--write-threads",
+                "4",
+                self.test_src_dir.name + "/",
+                self.test_dst_dir.name,
+            ],
+            check=True,
+        )
+        self.assertEqual(result.returncode, 0)
+
+        result = subprocess.run(
+            ["diff", "-r", self.test_src_dir.name, self.test_dst_dir.name],
+            stdout=subprocess.PIPE,
+        )
+        self.assertEqual(result.returncode, 0, result.stdout.decode())
+
+    def test_sync_write_threads_directory_replacing_file(self):
+        """
+        Test the sync with several threads, when directories replace files of the destination
+        :return:
+        """
+        for directory in range(4):
+            os.makedirs(os.path.join(self.test_src_dir.name, f"{directory}"))
+            for i in range(25):
+                with open(
+                    os.path.join(self.test_src_dir.name, f"{directory}", f"{i}.txt"),
+                    "w",
+                ) as f:
+                    f.write(f"file {i}" * i)
+            with open(os.path.join(self.test_dst_dir.name, f"{directory}"), "w") as f:
+                f.write("file")
+
+        result = subprocess.run(
+            [
+                "python3",
+                "mrsync.py",
+                "-q",
+                "-r",
+                "--write-threads",
+                "4",
+                self.test_src_dir.name + "/",
+                self.test_dst_dir.name,
+            ],
+            check=True,
+        )
+        self.assertEqual(result.returncode, 0)
+
+        result = subprocess.run(
+            ["diff", "-r", self.test_src_dir.name, self.test_dst_dir.name],
+            stdout=subprocess.PIPE,
+        )
+        self.assertEqual(result.returncode, 0, result.stdout.decode())
+
+    def test_sync_fsync_batch(self):
+        """
+        Test the sync with the files flushed by groups, including a file rebuilt from its delta
+        :return:
+        """
+        for i in range(25):
+            with open(os.path.join(self.test_src_dir.name, f"{i}.txt"), "w") as f:
+                f.write(f"file {i}" * i)
+
+        data = os.urandom(100000)
+        with open(os.path.join(self.test_src_dir.name, "data.bin"), "wb") as f:
+            f.write(data[:40000] + b"changed" + data[41000:])
+        with open(os.path.join(self.test_dst_dir.name, "data.bin"), "wb") as f:
+            f.write(data)
+
+        result = subprocess.run(
+            [
+                "python3",
+                "mrsync.py",
+                "-q",
+                "-r",
+                "--write-threads",
+                "4",
+                "--fsync",
+                "batch",
+                self.test_src_dir.name + "/",
+                self.test_dst_dir.name,
+            ],
+            check=True,
+        )
+        self.assertEqual(result.returncode, 0)
+
+        result = subprocess.run(
+            ["diff", "-r", self.test_src_dir.name, self.test_dst_dir.name],
+            stdout=subprocess.PIPE,
+        )
+        self.assertEqual(result.returncode, 0, result.stdout.decode())
+
+    def test_dry_run_stats(self):
+        """
+        Test the transfer plan of a dry run, which does not change the destination
+        :return:
+        """
+        data = os.urandom(100000)
+        with open(os.path.join(self.test_src_dir.name, "big"), "wb") as f:
+            f.write(data + b"appended")
+        with open(os.path.join(self.test_dst_dir.name, "big"), "wb") as f:
+            f.write(data)
+
+        result = subprocess.run(
+            [
+                "python3",
+                "mrsync.py",
+                "-r",
+                "--dry-run",
+                "--stats",
+                self.test_src_dir.name + "/",
+                self.test_dst_dir.name,
+            ],
+            check=True,
+            stdout=subprocess.PIPE,
+        )
+        self.assertEqual(result.returncode, 0)
+
+        output = result.stdout.decode()
+        self.assertIn("(new: 1, modified: 1, unchanged: 0)", output)
+        self.assertIn("Predicted matched data: 99,", output)
+        self.assertIn("Estimated transfer time (rough):", output)
+
+        self.assertEqual(os.listdir(self.test_dst_dir.name), ["big"])
+        with open(os.path.join(self.test_dst_dir.name, "big"), "rb") as f:
+            self.assertEqual(f.read(), data)
+
+    def test_dry_run_scan_cache(self):
+        """
+        Test if a dry run does not write the state file of the --scan-cache option
+        :return:
+        """
+        cache_file = os.path.join(self.test_dst_dir.name, "cache")
+        os.mkdir(os.path.join(self.test_src_dir.name, "a"))
+        with open(os.path.join(self.test_src_dir.name, "a", "b"), "w") as f:
+            f.write("unit_tests")
+
+        result = subprocess.run(
+            [
+                "python3",
+                "mrsync.py",
+                "-r",
+                "--dry-run",
+                "--scan-cache",
+                cache_file,
+                self.test_src_dir.name + "/",
+                self.test_dst_dir.name,
+            ],
+            check=True,
+            stdout=subprocess.PIPE,
+        )
+        self.assertEqual(result.returncode, 0)
+
+        self.assertFalse(os.path.exists(cache_file))
+        self.assertEqual(os.listdir(self.test_dst_dir.name), [])
+
     def test_quiet(self):
         """
         Test the --quiet option
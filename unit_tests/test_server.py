@@ -0,0 +1,90 @@
+#   Copyright (c) 2023, TriForMine. (https://triformine.dev) and samsoucoupe All rights reserved.
+#  #
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#  #
+#        http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from argparse import Namespace
+from src.server import Server
+from src.writer import Writer
+from unittest import mock
+import tempfile
+import threading
+import unittest
+
+
+class ServerTest(unittest.TestCase):
+    def test_start_generator(self):
+        """
+        Test if the generator is forked without the threads of the writer, which are started again after
+        """
+        with tempfile.TemporaryDirectory() as destination:
+            server = Server(
+                "source",
+                destination,
+                mock.Mock(),
+                mock.Mock(),
+                mock.Mock(),
+                Namespace(fsync="none", write_threads=4),
+            )
+            running = threading.active_count()
+            server.writer = Writer(server.handle_write, threads=4)
+            threads = []
+
+            def fork():
+                threads.append(threading.active_count())
+                return 1
+
+            with mock.patch("src.server.os.fork", side_effect=fork):
+                server.start_generator([], [])
+
+            self.assertEqual(threads, [running])
+            self.assertEqual(threading.active_count(), running + 4)
+            server.writer.close()
+            server.write_generator.close()
+
+    def test_start_generator_syncer(self):
+        """
+        Test if the generator is forked without the thread of the syncer, once the files are flushed
+        """
+        with tempfile.TemporaryDirectory() as destination:
+            server = Server(
+                "source",
+                destination,
+                mock.Mock(),
+                mock.Mock(),
+                mock.Mock(),
+                Namespace(fsync="batch", write_threads=1),
+            )
+            server.writer = Writer(server.handle_write)
+            running = threading.active_count()
+
+            # The thread of the syncer is started by the first batch
+            server.syncer.directory_changed(destination)
+            server.syncer.flush()
+            self.assertEqual(threading.active_count(), running + 1)
+
+            threads = []
+
+            def fork():
+                threads.append(threading.active_count())
+                return 1
+
+            with mock.patch("src.server.os.fork", side_effect=fork):
+                server.start_generator([], [])
+
+            self.assertEqual(threads, [running - 1])
+            server.writer.close()
+            server.write_generator.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
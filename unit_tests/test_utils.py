@@ -0,0 +1,84 @@
+#   Copyright (c) 2023, TriForMine. (https://triformine.dev) and samsoucoupe All rights reserved.
+#  #
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#  #
+#        http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from src.utils import delete_paths, get_physical_offset
+import os
+import tempfile
+import unittest
+
+
+class UtilsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for directory in ["a/b/c", "d", "e"]:
+            os.makedirs(os.path.join(self.directory.name, directory))
+        for file in ["a/b/c/1", "a/2", "d/3", "d/4", "e/5", "6"]:
+            with open(os.path.join(self.directory.name, file), "w") as f:
+                f.write("unit_tests")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_physical_offset(self):
+        """
+        Test if the physical offset of a file is found once its data is on the disk, and not for empty files
+        """
+        path = os.path.join(self.directory.name, "data")
+        with open(path, "wb") as f:
+            f.write(os.urandom(65536))
+            os.fsync(f.fileno())
+
+        # The offset is unknown on the filesystems without FIEMAP
+        offset = get_physical_offset(path)
+        self.assertTrue(offset is None or offset >= 0)
+
+        empty = os.path.join(self.directory.name, "empty")
+        open(empty, "w").close()
+        self.assertIsNone(get_physical_offset(empty))
+        self.assertIsNone(
+            get_physical_offset(os.path.join(self.directory.name, "missing"))
+        )
+
+    def test_delete_paths(self):
+        """
+        Test if the files and the directory trees are deleted, with the paths inside them skipped
+        """
+        failed = delete_paths(
+            self.directory.name,
+            ["a", "a/b", "a/b/c/1", "d/3", "6", "missing", "e/5/"],
+            threads=2,
+        )
+
+        self.assertEqual(failed, [])
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ["d", "e"])
+        self.assertEqual(os.listdir(os.path.join(self.directory.name, "d")), ["4"])
+        self.assertEqual(os.listdir(os.path.join(self.directory.name, "e")), [])
+
+    def test_delete_paths_symlink(self):
+        """
+        Test if the symbolic links to directories are deleted without following them
+        """
+        os.symlink(
+            os.path.join(self.directory.name, "d"),
+            os.path.join(self.directory.name, "a", "link"),
+        )
+
+        self.assertEqual(delete_paths(self.directory.name, ["a"]), [])
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.directory.name, "d"))), ["3", "4"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+#   Copyright (c) 2023, TriForMine. (https://triformine.dev) and samsoucoupe All rights reserved.
+#  #
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#  #
+#        http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from src.writer import Syncer, Writer
+from unittest import mock
+import os
+import tempfile
+import threading
+import unittest
+
+
+class WriterTest(unittest.TestCase):
+    def test_order(self):
+        """
+        Test if the messages of each file are applied in order
+        """
+        applied = {}
+
+        def handle(tag, value):
+            applied.setdefault(tag, []).append(value)
+
+        writer = Writer(handle, threads=4)
+        for i in range(1000):
+            writer.submit(f"file{i % 10}", f"file{i % 10}", i)
+        writer.close()
+
+        for file in range(10):
+            self.assertEqual(applied[f"file{file}"], list(range(file, 1000, 10)))
+
+    def test_back_pressure(self):
+        """
+        Test if the messages wait for the queue when it is full
+        """
+        release = threading.Event()
+        writer = Writer(lambda tag, value: release.wait(), queue_size=2)
+
+        # The first message is being applied, the next two fill the queue
+        for i in range(3):
+            writer.submit("file", None, i)
+
+        submitted = threading.Event()
+        thread = threading.Thread(
+            target=lambda: (writer.submit("file", None, 3), submitted.set())
+        )
+        thread.start()
+        self.assertFalse(submitted.wait(0.2))
+
+        release.set()
+        thread.join()
+        self.assertTrue(submitted.is_set())
+        writer.close()
+
+    def test_error(self):
+        """
+        Test if the error of a message is raised once the messages are applied
+        """
+
+        def handle(tag, value):
+            raise OSError(value)
+
+        writer = Writer(handle)
+        writer.submit("file", None, "No space left on device")
+        with self.assertRaises(OSError):
+            writer.join()
+        writer.close()
+
+
+class SyncerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.files = []
+        for i in range(5):
+            path = os.path.join(self.directory.name, f"{i}")
+            with open(path, "w") as f:
+                f.write("unit_tests")
+            self.files.append(path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def written(self, syncer: Syncer):
+        for path in self.files:
+            with open(path, "rb") as f:
+                syncer.file_written(path, f.fileno())
+        syncer.directory_changed(self.directory.name)
+
+    def test_batch(self):
+        """
+        Test if the files are flushed in groups, and all of them once flushed
+        """
+        with mock.patch("src.writer.os.fsync") as fsync:
+            syncer = Syncer("batch", batch_files=2)
+            self.written(syncer)
+            # The groups of 2 files are flushed in the background
+            self.assertEqual(len(syncer.batches), 2)
+
+            syncer.flush()
+            self.assertEqual(fsync.call_count, 6)
+            self.assertEqual(syncer.batches, [])
+
+    def test_end(self):
+        """
+        Test if the files are only flushed once the synchronization is finished
+        """
+        with mock.patch("src.writer.os.fsync") as fsync:
+            syncer = Syncer("end")
+            self.written(syncer)
+            self.assertEqual(fsync.call_count, 0)
+
+            syncer.flush()
+            self.assertEqual(fsync.call_count, 6)
+
+    def test_file_replacing(self):
+        """
+        Test if the temporary files are flushed before their renaming, unless there is no policy
+        """
+        for policy, calls in [("none", 0), ("file", 1), ("batch", 1), ("end", 1)]:
+            with mock.patch("src.writer.os.fsync") as fsync:
+                syncer = Syncer(policy)
+                syncer.file_replacing(0)
+                self.assertEqual(fsync.call_count, calls)
+
+                # The temporary file is not flushed again by its path
+                syncer.flush()
+                self.assertEqual(fsync.call_count, calls)
+
+    def test_none(self):
+        """
+        Test if nothing is flushed without a policy
+        """
+        with mock.patch("src.writer.os.fsync") as fsync:
+            syncer = Syncer()
+            self.written(syncer)
+            syncer.flush()
+            self.assertEqual(fsync.call_count, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()